@@ -6,20 +6,170 @@ You can choose which method to run just specifying in one of the constructor par
 You'll need to have a server with running FreeLing
 '''
 
-from gensim import corpora, models, similarities
-from nltk.corpus import stopwords
-from nltk import wordpunct_tokenize
-from nltk.tokenize import sent_tokenize
 import string
 import collections
-import subprocess
 import json
 import ast
 import operator
+import heapq
+import numpy
 import sys
+import os
+import hashlib
+import multiprocessing
+import threading
+import time
+import re
+import resource
 from os import listdir
 from os.path import isfile, join
-from tfidf import TfIdf
+from tfidf import TfIdf, SparseTfIdf, BM25
+from freeling import FreeLingClient
+from sentence_store import SentenceStore
+from cache import LRUCache
+from metrics import QueryMetrics
+from docstore import DocumentStore, DocumentStoreWriter
+from ann import IVFPQIndex
+from shards import ShardedIndex, write_lsi_shards, write_tfidf_shards
+from segment import SegmentBM25, SegmentSparseTfIdf, SegmentTfIdf, decode_segment, write_segment
+from multiwords import MultiwordTable
+from positional import PositionalIndex, write_positional_index
+from lsi_training import train_lsi, build_sharded_index, load_sharded_index, SimilarityVectors
+
+CHUNK_SIZE = 64
+TERM_MODELS = ('tfidf', 'bm25')  # the models which keep the postings of the terms, their documents are file names
+worker_state = {}
+WORD_PUNCT = re.compile(r'\w+|[^\w\s]+')  # the same tokens as nltk.wordpunct_tokenize
+QUOTES = {'"', '“', '”', '«', '»', '``', "''"}  # the lemmas which open and close a phrase in a query
+
+# gensim and NLTK take most of the import time and of the memory of an idle process,
+# so they are imported by load_dependencies when the first model is loaded
+corpora = models = similarities = matutils = None
+stopwords = sent_tokenize = None
+dependencies_stats = {}
+
+
+def load_dependencies():
+    '''
+    It imports gensim and NLTK the first time it is called
+    :return: None
+    '''
+    global corpora, models, similarities, matutils, stopwords, sent_tokenize
+    if corpora is not None:
+        return
+    rss = get_rss()
+    start = time.perf_counter()
+    from nltk.corpus import stopwords
+    from nltk.tokenize import sent_tokenize
+    from gensim import models, similarities, matutils
+    from gensim import corpora  # the last one, it tells the others are loaded
+    dependencies_stats.update({'load_s': time.perf_counter() - start, 'rss_mb': (get_rss() - rss) / 2.0 ** 20})
+
+
+def get_rss():
+    '''
+    It gets the resident memory of the process
+    :return: Integer with the bytes (the peak resident memory where /proc is not available)
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def init_worker(state):
+    '''
+    It sets the state shared by all the calls of count_terms and lemma_file_to_bow in a process
+    :param state: dictionary with the state
+    :return: None
+    '''
+    worker_state.clear()
+    worker_state.update(state)
+
+
+def read_lemmas(file_path, multiwords):
+    '''
+    It reads the lemmas of a file, lowercased and with their multiwords rewritten, as every document of a model
+    :param file_path: String with the path of the lemma file
+    :param multiwords: MultiwordTable of the language
+    :return: List with the terms of the file (stopwords and punctuation symbols included)
+    '''
+    with open(file_path) as f:
+        return multiwords.apply(f.readline().lower().split())
+
+
+def clean_document(file_path, terms, token2id, clean_dir):
+    '''
+    It converts the terms of a document into a bag-of-words with the dictionary token2id.
+    If clean_dir is set, the terms of the dictionary are written there (the hapax legomenon are removed)
+    and the bag-of-words is built from them. Otherwise it is built from all the terms.
+    :param file_path: String with the path of the lemma file
+    :param terms: List with its terms, as read_lemmas returns them
+    :param token2id: dictionary with the identifier of each term of the model
+    :param clean_dir: String with the directory of the files without hapax legomenon, or None
+    :return: The path of the file the model is built from, the bag-of-words and the terms the model is built from
+    '''
+    if clean_dir:
+        terms = [term for term in terms if term in token2id]
+        file_path = join(clean_dir, file_path.split('/')[-1])
+        with open(file_path, 'w') as f:
+            f.write(' '.join(terms))
+    bow = sorted(collections.Counter(token2id[term] for term in terms if term in token2id).items())
+    return file_path, bow, terms
+
+
+def count_terms(files):
+    '''
+    It counts the terms of the given lemma files which are neither in worker_state['stopwords'] nor in worker_state['punct'].
+    The lemmas of each file are lowercased and their multiwords rewritten once, lemma_file_to_bow reuses them
+    :param files: List of lemma files
+    :return:
+        frequency: A Counter with the terms frequency
+        texts: List with a string of the rewritten lemmas of each file (stopwords included)
+    '''
+    stop_words = worker_state['stopwords']
+    punct_sym = worker_state['punct']
+    multiwords = worker_state['multiwords']
+    frequency = collections.Counter()
+    texts = []
+    for file_path in files:
+        terms = read_lemmas(file_path, multiwords)
+        frequency.update(term for term in terms if term not in stop_words and term not in punct_sym)
+        texts.append(' '.join(terms))
+    return frequency, texts
+
+
+def lemma_file_to_bow(document):
+    '''
+    It converts the lemmas of a file, as count_terms rewrote them, into a bag-of-words with the dictionary
+    in worker_state['token2id'] and worker_state['clean_dir'] (see clean_document)
+    :param document: Tuple with the path of the lemma file and the string with its lemmas returned by count_terms
+    :return: The path of the file the model is built from, the bag-of-words and its terms (if worker_state['keep_text'])
+    '''
+    file_path, text = document
+    file_path, bow, terms = clean_document(file_path, text.split(), worker_state['token2id'], worker_state['clean_dir'])
+    return file_path, bow, terms if worker_state['keep_text'] else None
+
+
+def freeze_results(sims):
+    '''
+    It copies the retrieved documents into tuples before they are cached, so the callers (several threads in
+    server.py) can not change the cached entry through the list they get
+    :param sims: List of (document, score) pairs
+    :return: Tuple of (document, score) tuples
+    '''
+    return tuple((sim[0], sim[1]) for sim in sims)
+
+
+def build_language_model(params, language):
+    '''
+    It builds and saves the model of a single language. It is run in its own process by SkyScanner.build_languages
+    :param params: dictionary with the parameters of the SkyScanner constructor
+    :param language: String with the language to build
+    :return: None
+    '''
+    SkyScanner(languages=[language], **params)
 
 
 class SkyScanner:
@@ -31,6 +181,8 @@ class SkyScanner:
             'financial-statement.txt': 'https://www.entrepreneur.com/encyclopedia/financial-statement',
             'equity-crowdfunding.txt': 'https://www.entrepreneur.com/topic/equity-crowdfunding',
             '4.txt': 'https://www.entrepreneur.com/topic/startup-funding/4'}
+    freeling_ports = {'english': 50005,
+                      'spanish': 50006}
 
 
     def __init__(self,
@@ -40,26 +192,155 @@ class SkyScanner:
                  model_name='lsi',
                  remove_sw=True,
                  remove_punct=True,
-                 remove_hl=True):
+                 remove_hl=True,
+                 freeling_host='localhost',
+                 freeling_pool_size=4,
+                 freeling_ports=None,
+                 models_dir=None,
+                 use_saved_models=True,
+                 check_corpus=True,
+                 languages=None,
+                 processes=1,
+                 tfidf_backend='dict',
+                 cache_size=1024,
+                 cache_ttl=3600,
+                 metrics=False,
+                 slow_query_ms=None,
+                 ann=False,
+                 ann_nlist=None,
+                 ann_nprobe=16,
+                 ann_rerank=100,
+                 shards=1,
+                 shard_processes=None,
+                 lazy=False,
+                 preload=None,
+                 bm25_pruning=True,
+                 multiwords=None,
+                 positional=False,
+                 proximity_weight=0.5,
+                 proximity_rerank=100,
+                 lsi_chunksize=20000,
+                 lsi_power_iters=2,
+                 lsi_extra_samples=100,
+                 lsi_onepass=True,
+                 lsi_workers=1,
+                 lsi_index='matrix',
+                 lsi_shard_size=32768):
         '''
         Class contructor
         :param project_dir: String with the directory where the project is 
         :param num_topics: Integer which tells the number of topics to the LSI model
         :param threshold: Float that identifies the minimum score needed to be considered as a possible retrieved document
-        :param model_name: String with one of these values: 'lsi' or 'tfidf' which tells to the system which model to use
+        :param model_name: String with one of these values: 'lsi', 'tfidf' or 'bm25' which tells to the system which model to use
         :param remove_sw: Boolean varible that tells whether the Stopwords will be deleted or not
         :param remove_punct: Boolean varible that tells whether the punctuation symbols will be deleted or not
         :param remove_hl: Boolean varible that tells whether the hapax legomenon will be deleted or not
+        :param freeling_host: String with the host where the FreeLing servers are running
+        :param freeling_pool_size: Integer with the number of connections kept opened to each FreeLing server
+        :param freeling_ports: dictionary with the port of the FreeLing server of each language (freeling_ports by default)
+        :param models_dir: String with the directory where the built models are saved (project_dir/data/models by default)
+        :param use_saved_models: Boolean variable that tells whether a saved model can be loaded instead of being rebuilt
+        :param check_corpus: Boolean variable that tells whether a saved model is only loaded if it was built from the
+        current lemma files. Otherwise its parameters are enough, so the files added to data/lemmas since it was built
+        can be added to it with add_documents instead of rebuilding it
+        :param languages: List with the names of the languages to load ('english', 'spanish'), all of them by default
+        :param processes: Integer with the number of processes used to build the models. If it is greater than 1,
+        each language is built in its own process and the lemma files of each language are processed by a pool
+        :param tfidf_backend: String with one of these values: 'dict' (TfIdf) or 'sparse' (SparseTfIdf, a sparse matrix
+        scored with NumPy) which tells to the system how to score the Tf-Idf model (both are saved in the same segment)
+        :param cache_size: Integer with the maximum number of entries of each query cache (0 disables them)
+        :param cache_ttl: Float with the seconds a cached entry is valid (None to keep it until it is evicted)
+        :param metrics: Boolean variable that tells whether the time of each stage of the queries is recorded (self.metrics)
+        :param slow_query_ms: Float with the milliseconds above which a query is logged with its stages (None to log nothing)
+        :param ann: Boolean variable that tells whether the LSI queries with top_k are answered by an approximate
+        nearest neighbour index (IVFPQIndex) instead of scanning the whole similarity index
+        :param ann_nlist: Integer with the number of lists of the approximate index (4 * sqrt(documents) by default)
+        :param ann_nprobe: Integer with the number of lists scanned by each query, the more the higher the recall
+        :param ann_rerank: Integer with the number of candidates of each query rescored with their exact vectors
+        :param shards: Integer with the number of shards the documents of each model are split in. If it is greater
+        than 1, the queries with top_k are scattered to all the shards and their top_k documents are merged
+        :param shard_processes: Integer with the number of processes which search the shards of each language
+        (one per shard by default, lower than 2 to search them in this process)
+        :param lazy: Boolean variable that tells whether the model of a language is loaded (or built) by the first query
+        in that language instead of by the constructor. gensim and NLTK are not imported until they are needed
+        :param preload: List with the names of the languages loaded by the constructor in lazy mode
+        :param bm25_pruning: Boolean variable that tells whether the BM25 queries with top_k skip the documents which
+        can not reach the top_k best scores (MaxScore)
+        :param multiwords: String with the path of the multiword table applied to the documents and the queries
+        (multiwords.txt by default)
+        :param positional: Boolean variable that tells whether a positional index of the lemma files is built, so the
+        queries can have quoted phrases and the documents where the query terms are close are boosted
+        :param proximity_weight: Float with the boost of a document whose query terms are adjacent (0 disables it)
+        :param proximity_rerank: Integer with the number of best scored documents boosted by proximity
+        :param lsi_chunksize: Integer with the number of documents decomposed at once by the LSI training
+        :param lsi_power_iters: Integer with the number of power iterations of the randomized SVD of the LSI training
+        :param lsi_extra_samples: Integer with the number of samples taken besides num_topics by the randomized SVD
+        :param lsi_onepass: Boolean variable that tells whether the LSI model is trained with the one-pass algorithm
+        instead of the multi-pass randomized one, which reads the corpus several times
+        :param lsi_workers: Integer with the number of processes which decompose the corpus (one-pass algorithm only)
+        :param lsi_index: String with one of these values: 'matrix' (MatrixSimilarity, a dense matrix in memory) or
+        'sharded' (Similarity, shards of lsi_shard_size documents written next to the model and memory-mapped)
+        which tells to the system how to store the LSI vectors of the documents
+        :param lsi_shard_size: Integer with the maximum number of documents of each shard of the sharded LSI index
         '''
         self.project_dir = project_dir
         self.threshold = threshold
+        self.models_dir = models_dir if models_dir else join(project_dir, 'data/models')
+        self.use_saved_models = use_saved_models
+        self.check_corpus = check_corpus
+        self.num_topics = num_topics
+        self.remove_sw = remove_sw
+        self.remove_punct = remove_punct
+        self.remove_hl = remove_hl
+        self.processes = processes
+        self.tfidf_backend = tfidf_backend
+        self.use_ann = ann
+        self.ann_nlist = ann_nlist
+        self.ann_nprobe = ann_nprobe
+        self.ann_rerank = ann_rerank
+        self.num_shards = shards
+        self.shard_processes = shard_processes
+        self.model_name = model_name
+        self.bm25_pruning = bm25_pruning
+        self.multiwords_file = multiwords
+        self.multiwords = MultiwordTable.load(multiwords)
+        self.positional = positional
+        self.proximity_weight = proximity_weight
+        self.proximity_rerank = proximity_rerank
+        self.lsi_chunksize = lsi_chunksize
+        self.lsi_power_iters = lsi_power_iters
+        self.lsi_extra_samples = lsi_extra_samples
+        self.lsi_onepass = lsi_onepass
+        self.lsi_workers = lsi_workers
+        if lsi_index not in ('matrix', 'sharded'):
+            print('ERROR: The LSI index has to be either \'matrix\' or \'sharded\'')
+            sys.exit()
+        self.lsi_index = lsi_index
+        self.lsi_shard_size = lsi_shard_size
+        self.lazy = lazy
+        self.loaded = set()
+        self.load_lock = threading.Lock()
+        self.load_stats = {}
+        self.build_stats = {}
+        self.built = set()  # the languages built by the processes of build_languages, init_model loads them
 
         self.init_variables()
-        self.ext_lang, self.stopwords_set = self.init_languages()
-        for language in self.ext_lang.keys():
-            print('\nLoading the model for ' + language + '...')
-            self.language = language
-            self.init_model(language, num_topics, model_name, remove_sw, remove_punct, remove_hl)
+        self.init_caches(cache_size, cache_ttl)
+        self.metrics = QueryMetrics(metrics, slow_query_ms)
+        self.ext_lang, self.stopwords_set = self.init_languages(languages, load_stopwords=not lazy)
+        if freeling_ports:
+            self.freeling_ports = freeling_ports
+        self.freeling = self.init_freeling(freeling_host, freeling_pool_size)
+        preload = list(self.ext_lang.keys()) if not lazy else (preload or [])
+        for language in preload:
+            if language not in self.ext_lang:
+                print('ERROR: The language ' + language + ' can not be preloaded, it is not one of ' + ', '.join(self.ext_lang))
+                sys.exit()
+        if processes > 1 and len(preload) > 1:
+            self.build_languages(num_topics, model_name, remove_sw, remove_punct, remove_hl,
+                                 freeling_host, freeling_pool_size, preload)
+        for language in preload:
+            self.load_language(language)
 
 
 
@@ -77,22 +358,57 @@ class SkyScanner:
         self.model = {}
         self.index = {}
         self.doc_index = {}
+        self.sentence_store = {}
+        self.docstore = {}
+        self.ann = {}
+        self.shards = {}
+        self.positions = {}
         self.query = None
 
 
+    def init_caches(self, size, ttl):
+        '''
+        It creates the query caches:
+            query_cache: normalized raw query -> (language, cleaned query)
+            results_cache: (language, cleaned query, top_k, min_score) -> top_k retrieved documents (see freeze_results)
+            snippet_cache: (document file, query) -> snippet
+        :param size: Integer with the maximum number of entries of each cache
+        :param ttl: Float with the seconds a cached entry is valid
+        :return: None
+        '''
+        self.query_cache = LRUCache(size, ttl)
+        self.results_cache = LRUCache(size, ttl)
+        self.snippet_cache = LRUCache(size, ttl)
+
+
+    def invalidate_caches(self):
+        '''
+        It empties the caches which depend on the model. It is called whenever the model changes
+        :return: None
+        '''
+        self.results_cache.clear()
+        self.snippet_cache.clear()
+
+
+    def cache_stats(self):
+        return {'query': self.query_cache.stats(),
+                'results': self.results_cache.stats(),
+                'snippet': self.snippet_cache.stats()}
+
+
     def init_model(self, language, num_topics, model_name, remove_sw, remove_punct, remove_hl):
         '''
         Function that loads the model in the given language
         :param language: String which tells which model language will be load
         :param num_topics: Integer which tells the number of topics to the LSI model
-        :param model_name: String with one of these values: 'lsi' or 'tfidf' which tells to the system which model to use
+        :param model_name: String with one of these values: 'lsi', 'tfidf' or 'bm25' which tells to the system which model to use
         :param remove_sw: Boolean varible that tells whether the Stopwords will be deleted or not
         :param remove_punct: Boolean varible that tells whether the punctuation symbols will be deleted or not 
         :param remove_hl: Boolean varible that tells whether the hapax legomenon will be deleted or not
         :return: None
         '''
         if remove_sw:
-            self.stopWords[language] = set(stopwords.words(language))
+            self.stopWords[language] = self.get_stopwords(language)
         else:
             self.stopWords[language] = set()
         if remove_punct:
@@ -100,40 +416,589 @@ class SkyScanner:
         else:
             self.punctSym[language] = set()
 
-        if (model_name != 'lsi' and model_name != 'tfidf'):
-            print('ERROR: The model has to be either \'lsi\' or \'tfidf\'')
+        if (model_name != 'lsi' and model_name not in TERM_MODELS):
+            print('ERROR: The model has to be either \'lsi\', \'tfidf\' or \'bm25\'')
             sys.exit()
-        if model_name == 'tfidf':
+        if model_name in TERM_MODELS:
             self.threshold = 0
         self.model_name = model_name
 
-        # getting the terms frequency
         self.files_dir[language] = join(self.project_dir, 'data/lemmas/' + self.ext_lang[language])
-        self.files[language], self.frequency[language] = self.get_terms_frequency()
-
-        # building the dictionary
-        if remove_hl:
-            self.dct[language], self.files_dir[language] = self.remove_hapax_legomenon()
+        manifest = self.get_manifest(language, num_topics, model_name, remove_sw, remove_punct, remove_hl)
+        if (self.use_saved_models or language in self.built) and self.is_saved_model_valid(language, manifest):
+            print('\tLoading the saved model...')
+            self.load_model(language, remove_hl)
         else:
-            self.dct[language] = self.build_dictionary()
+            self.rebuild_model(language, manifest)
+        if self.positional:
+            self.load_positions(language, manifest)
+
+        # loading the sentences built by getting_sentences.py, if there are
+        sentences_dir = join(self.project_dir, 'data/sentences/' + self.ext_lang[language])
+        if SentenceStore.exists(sentences_dir):
+            self.sentence_store[language] = SentenceStore(sentences_dir)
+
+
+    def load_language(self, language):
+        '''
+        It loads (or builds) the model of the given language unless it is already loaded. In lazy mode, it is called
+        by the first query in the language. The load time and the resident memory it takes are kept in self.load_stats
+        :param language: String with the language of the model
+        :return: None
+        '''
+        if language in self.loaded:
+            return
+        with self.load_lock:
+            if language in self.loaded:  # another thread loaded it while this one was waiting
+                return
+            load_dependencies()
+            print('\nLoading the model for ' + language + '...')
+            rss = get_rss()
+            start = time.perf_counter()
+            self.language = language
+            self.init_model(language, self.num_topics, self.model_name, self.remove_sw, self.remove_punct, self.remove_hl)
+            self.load_stats[language] = {'load_s': time.perf_counter() - start, 'rss_mb': (get_rss() - rss) / 2.0 ** 20}
+            self.loaded.add(language)
+
+
+    def language_stats(self):
+        '''
+        It tells which languages are loaded, how long each one took to load and how much resident memory it took
+        (the memory freed by the garbage collector while a model is loaded is not discounted), and the stats of
+        the models built by this process (self.build_stats)
+        :return: dictionary with the stats of each language and the ones of the import of gensim and NLTK
+        '''
+        languages = {}
+        for language in self.ext_lang.keys():
+            languages[language] = dict(self.load_stats.get(language, {}), loaded=language in self.loaded)
+            if language in self.build_stats:
+                languages[language]['build'] = self.build_stats[language]
+        return {'languages': languages, 'dependencies': dict(dependencies_stats), 'rss_mb': get_rss() / 2.0 ** 20}
+
+
+    def build_languages(self, num_topics, model_name, remove_sw, remove_punct, remove_hl, freeling_host, freeling_pool_size,
+                        languages=None):
+        '''
+        It builds and saves, each one in its own process, the models of the languages whose saved model is not valid,
+        so init_model just has to load them afterwards (self.built, even if use_saved_models is False). The processes
+        are shared out among the languages. A language whose process fails is built again by init_model
+        :param languages: List with the languages to build (all of them if it is None)
+        :return: None
+        '''
+        stale = []
+        for language in (languages or self.ext_lang.keys()):
+            self.files_dir[language] = join(self.project_dir, 'data/lemmas/' + self.ext_lang[language])
+            manifest = self.get_manifest(language, num_topics, model_name, remove_sw, remove_punct, remove_hl)
+            if not self.use_saved_models or not self.is_saved_model_valid(language, manifest):
+                stale.append(language)
+        if len(stale) < 2:
+            return
+
+        params = {'project_dir': self.project_dir,
+                  'num_topics': num_topics,
+                  'threshold': self.threshold,
+                  'model_name': model_name,
+                  'remove_sw': remove_sw,
+                  'remove_punct': remove_punct,
+                  'remove_hl': remove_hl,
+                  'freeling_host': freeling_host,
+                  'freeling_pool_size': freeling_pool_size,
+                  'freeling_ports': self.freeling_ports,
+                  'models_dir': self.models_dir,
+                  'use_saved_models': False,
+                  'check_corpus': self.check_corpus,
+                  'processes': max(1, self.processes // len(stale)),
+                  'tfidf_backend': self.tfidf_backend,
+                  'ann': self.use_ann,
+                  'ann_nlist': self.ann_nlist,
+                  'ann_nprobe': self.ann_nprobe,
+                  'ann_rerank': self.ann_rerank,
+                  'shards': self.num_shards,
+                  'shard_processes': 1,  # the builder does not run queries
+                  'multiwords': self.multiwords_file,
+                  'positional': self.positional,
+                  'lsi_chunksize': self.lsi_chunksize,
+                  'lsi_power_iters': self.lsi_power_iters,
+                  'lsi_extra_samples': self.lsi_extra_samples,
+                  'lsi_onepass': self.lsi_onepass,
+                  'lsi_workers': self.lsi_workers,
+                  'lsi_index': self.lsi_index,
+                  'lsi_shard_size': self.lsi_shard_size}
+        builders = []
+        for language in stale:
+            print('\nBuilding the model for ' + language + ' in a new process...')
+            builder = multiprocessing.Process(target=build_language_model, args=(params, language))
+            builder.start()
+            builders.append((language, builder))
+        for language, builder in builders:
+            builder.join()
+            if builder.exitcode == 0:
+                self.built.add(language)
+            else:
+                print('ERROR: The model for ' + language + ' could not be built in its own process, '
+                      'it will be built again by this one')
+
+
+    def rebuild_model(self, language, manifest=None):
+        '''
+        It builds from scratch the dictionary and the model of the given language and saves them.
+        The time of each step and the peak resident memory of this process and of its workers are kept in
+        self.build_stats (the peaks are the ones since they were started, not only the ones of this build)
+        :param language: String which tells which model language will be built
+        :param manifest: dictionary returned by get_manifest (it is computed if it is None)
+        :return: None
+        '''
+        load_dependencies()
+        start = time.perf_counter()
+        self.language = language
+        self.files_dir[language] = join(self.project_dir, 'data/lemmas/' + self.ext_lang[language])
+        if manifest is None:
+            manifest = self.get_manifest(language, self.num_topics, self.model_name,
+                                         self.remove_sw, self.remove_punct, self.remove_hl)
+
+        # getting the terms frequency
+        self.files[language], self.frequency[language], texts = self.get_terms_frequency()
+
+        # building the dictionary and the corpus
+        self.dct[language], self.files_dir[language], doc_index, tfidf = self.build_corpus(self.remove_hl, texts)
+        del texts
+        corpus_end = time.perf_counter()
 
         # building the model
-        self.model[language], self.index[language], self.doc_index[language] = self.build_model(num_topics)
+        self.model[language], self.index[language], self.doc_index[language] = self.build_model(self.num_topics, doc_index, tfidf)
+        model_end = time.perf_counter()
+        self.build_docstore(language)
+        if self.use_ann and self.model_name == 'lsi':
+            self.build_ann(language)
+        if self.num_shards > 1:
+            self.build_shards(language)
+        self.save_model(language, manifest)
+        if self.positional:
+            self.build_positions(language, manifest)
+        self.invalidate_caches()
+        self.build_stats[language] = {'corpus_s': corpus_end - start,
+                                      'model_s': model_end - corpus_end,
+                                      'total_s': time.perf_counter() - start,
+                                      'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2.0 ** 10,
+                                      'workers_peak_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 2.0 ** 10}
+
+
+    def add_documents(self, language, paths):
+        '''
+        It adds new documents to the model of the given language without rebuilding it:
+        the dictionary is extended, the LSI model is updated online and the new documents are appended 
+        to the index and doc_index (or added to the Tf-Idf model). 
+        The new documents keep the same terms as the built ones (see clean_document): with remove_hl, the hapax 
+        legomenon are the terms which are not in the dictionary of the model.
+        The terms which are new for the LSI model are only taken into account after rebuild_model.
+        The positional index is built again. The files which are already in the model are skipped
+        :param language: String with the language of the documents
+        :param paths: List with the paths of the lemma files of the new documents (data/lemmas/<language code>/...)
+        :return: None
+        '''
+        self.load_language(language)
+        self.language = language
+        known = set(self.get_document_names(language))
+        new_paths = []
+        for file_path in paths:
+            file_name = file_path.split('/')[-1]
+            if file_name not in known:
+                known.add(file_name)
+                new_paths.append(file_path)
+        if len(new_paths) < len(paths):
+            print('\t' + str(len(paths) - len(new_paths)) + ' documents are already in the ' + language + ' model')
+        paths = new_paths
+        if not paths:  # the model is up to date, only its manifest is written again
+            manifest = self.get_manifest(language, self.num_topics, self.model_name,
+                                         self.remove_sw, self.remove_punct, self.remove_hl)
+            with open(join(self.get_model_dir(language), 'manifest.json'), 'w') as f:
+                json.dump(manifest, f)
+            return
+        print('Adding ' + str(len(paths)) + ' documents to the ' + language + ' model...')
+        first = len(self.docstore[language]) if language in self.docstore else 0
+        token2id = dict(self.dct[language].token2id)  # the terms the model was built with
+        texts = []
+        doc_paths = []
+        counted = []
+        for file_path in paths:
+            terms = read_lemmas(file_path, self.multiwords)
+            # the same terms as build_corpus: the ones of the dictionary with remove_hl, all of them otherwise
+            file_path, bow, text = clean_document(file_path, terms, token2id,
+                                                  self.files_dir[language] if self.remove_hl else None)
+            texts.append(text)
+            doc_paths.append(file_path)
+            counted.append([term for term in terms
+                            if term not in self.stopWords[language] and term not in self.punctSym[language]])
+
+        self.dct[language].add_documents(counted)
+        if self.model_name == 'lsi':
+            lsi = self.model[language]
+            corpus = [[(term_id, freq) for term_id, freq in self.dct[language].doc2bow(text) if term_id < lsi.num_terms]
+                      for text in counted]
+            lsi.add_documents(corpus)
+            index = self.index[language]
+            vectors = matutils.corpus2dense(lsi[corpus], num_terms=index.num_features).T
+            norms = numpy.linalg.norm(vectors, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            if isinstance(index, similarities.Similarity):
+                index.add_documents(vectors / norms)  # the last shard is written again with them
+                index.close_shard()
+            else:
+                index.index = numpy.vstack([index.index, (vectors / norms).astype(index.index.dtype)])
+            if language in self.ann:
+                self.ann[language].add(vectors / norms)
+            first = len(self.doc_index[language])
+            for i, file_path in enumerate(doc_paths):
+                self.doc_index[language][first + i] = file_path
+        elif self.model_name in TERM_MODELS:
+            # the segment is read-only, it is decoded and written again
+            self.model[language] = decode_segment(self.model[language])
+            for file_path, text in zip(doc_paths, texts):
+                self.model[language].add_document(file_path.split('/')[-1], text)
+
+        self.build_docstore(language, first)
+        if language in self.shards:
+            self.build_shards(language)
+        manifest = self.get_manifest(language, self.num_topics, self.model_name,
+                                     self.remove_sw, self.remove_punct, self.remove_hl)
+        self.save_model(language, manifest)
+        if self.positional:
+            self.build_positions(language, manifest)
+        self.invalidate_caches()
+
+
+    def build_docstore(self, language, first=0):
+        '''
+        It writes the metadata of the documents of the model (url, title, path and body of the original article)
+        in the document store of the language, so the results are rendered without opening the articles
+        :param language: String with the language of the model
+        :param first: Integer with the first document to write, the previous ones are already in the store
+        :return: None
+        '''
+        print('\tBuilding the document store...')
+        model_dir = self.get_model_dir(language)
+        writer = DocumentStoreWriter(model_dir, append=first > 0)
+        if self.model_name == 'lsi':
+            docs = range(first, len(self.doc_index[language]))
+        elif self.model_name in TERM_MODELS:
+            docs = self.model[language].documents[first:]
+        for doc in docs:
+            if self.model_name == 'lsi':
+                file_path, url = self.get_lsi_output(doc, None, language)
+            elif self.model_name in TERM_MODELS:
+                file_path, url = self.get_tfidf_output(doc, None, language)
+            try:
+                with open(file_path) as f:
+                    lines = f.readlines()
+            except IOError:
+                lines = []
+            title = lines[0].strip() if lines else ''
+            body = lines[2] if len(lines) == 3 else ' '.join(lines)  # the same text get_snippet uses
+            writer.add_document(file_path.split('/')[-1], url, title, file_path, body)
+        writer.close()
+        self.docstore[language] = DocumentStore(model_dir, language)
+
+
+    def build_ann(self, language):
+        '''
+        It trains the approximate nearest neighbour index of the LSI vectors of the given language
+        :param language: String with the language of the model
+        :return: None
+        '''
+        print('\tBuilding the approximate nearest neighbour index...')
+        self.ann[language] = IVFPQIndex(self.ann_nlist, nprobe=self.ann_nprobe, rerank=self.ann_rerank)
+        self.ann[language].train(self.get_lsi_vectors(language))
+
+
+    def load_ann(self, language):
+        '''
+        It loads the saved approximate nearest neighbour index of the given language. It is built (and saved)
+        if there is not any, or if it does not cover all the documents or was built with another number of lists
+        :param language: String with the language of the model
+        :return: None
+        '''
+        ann_path = join(self.get_model_dir(language), 'ann.npz')
+        if isfile(ann_path):
+            ann = IVFPQIndex.load(ann_path)
+            if len(ann) == len(self.get_lsi_vectors(language)) and (not self.ann_nlist or ann.nlist == self.ann_nlist):
+                ann.nprobe, ann.rerank = self.ann_nprobe, self.ann_rerank
+                self.ann[language] = ann
+                return
+        self.build_ann(language)
+        self.ann[language].save(ann_path)
+
+
+    def build_shards(self, language):
+        '''
+        It splits the documents of the model of the given language in self.num_shards shards and opens them.
+        The LSI shards keep the unit vectors of their documents, the Tf-Idf ones their postings over
+        the global vocabulary
+        :param language: String with the language of the model
+        :return: None
+        '''
+        if self.model_name == 'bm25':
+            print('\tThe BM25 model is not sharded')
+            return
+        print('\tBuilding ' + str(self.num_shards) + ' shards...')
+        if language in self.shards:  # its workers are reading the files which are going to be rewritten
+            self.shards.pop(language).close()
+        shards_dir = join(self.get_model_dir(language), 'shards')
+        if self.model_name == 'lsi':
+            write_lsi_shards(shards_dir, self.get_lsi_vectors(language), self.num_shards)
+        elif self.model_name == 'tfidf':
+            write_tfidf_shards(shards_dir, self.model[language], self.num_shards)
+        self.shards[language] = ShardedIndex(shards_dir, self.shard_processes)
+
+
+    def load_shards(self, language):
+        '''
+        It opens the saved shards of the given language. They are built again if there are not any, or if they
+        were built from another model or with another number of shards
+        :param language: String with the language of the model
+        :return: None
+        '''
+        shards_dir = join(self.get_model_dir(language), 'shards')
+        if self.model_name == 'bm25':
+            return self.build_shards(language)
+        if self.model_name == 'lsi':
+            num_docs = len(self.get_lsi_vectors(language))
+        elif self.model_name == 'tfidf':
+            num_docs = len(self.model[language].documents)
+        if ShardedIndex.exists(shards_dir):
+            info = ShardedIndex.describe(shards_dir)
+            if (info['kind'] == self.model_name and info['bounds'][-1] == num_docs
+                    and len(info['bounds']) - 1 == max(1, min(self.num_shards, num_docs))):
+                self.shards[language] = ShardedIndex(shards_dir, self.shard_processes)
+                return
+        self.build_shards(language)
 
 
-    def init_languages(self):
+    def get_document_names(self, language):
+        '''
+        It gets the file names of the documents of the model
+        :param language: String with the language of the model
+        :return: List with the file name of each document, in the order of the document identifiers
+        '''
+        if self.model_name == 'lsi':
+            return [self.doc_index[language][doc].split('/')[-1] for doc in range(len(self.doc_index[language]))]
+        elif self.model_name in TERM_MODELS:
+            return list(self.model[language].documents)
+
+
+    def get_lemma_files(self, language):
+        '''
+        It gets the lemma files of the documents of the model (not the clean texts, they have lost the positions)
+        :param language: String with the language of the model
+        :return: List with the path of the lemma file of each document, in the order of the document identifiers
+        '''
+        lemmas_dir = join(self.project_dir, 'data/lemmas/' + self.ext_lang[language])
+        return [join(lemmas_dir, name) for name in self.get_document_names(language)]
+
+
+    def build_positions(self, language, manifest):
+        '''
+        It builds the positional index of the documents of the given language
+        :param language: String with the language of the model
+        :param manifest: dictionary returned by get_manifest for the model
+        :return: None
+        '''
+        print('\tBuilding the positional index...')
+        model_dir = self.get_model_dir(language)
+        write_positional_index(model_dir, self.get_lemma_files(language), self.stopWords[language],
+                               self.punctSym[language], self.multiwords, manifest)
+        self.positions[language] = PositionalIndex(model_dir)
+
+
+    def load_positions(self, language, manifest):
+        '''
+        It opens the saved positional index of the given language, or builds it if it was built for another model
+        :param language: String with the language of the model
+        :param manifest: dictionary returned by get_manifest for the model
+        :return: None
+        '''
+        if language in self.positions:  # built with the model
+            return
+        model_dir = self.get_model_dir(language)
+        if PositionalIndex.is_valid(model_dir, manifest):
+            self.positions[language] = PositionalIndex(model_dir)
+        else:
+            self.build_positions(language, manifest)
+
+
+    def get_model_dir(self, language):
+        return join(self.models_dir, self.ext_lang[language])
+
+
+    def get_manifest(self, language, num_topics, model_name, remove_sw, remove_punct, remove_hl):
+        '''
+        It identifies the model which would be built from the current corpus with the given parameters
+        :param language: String with the language of the model
+        :return: dictionary with the corpus fingerprint (name, size and modification time of every lemma file) 
+        and the constructor parameters
+        '''
+        fingerprint = hashlib.sha1()
+        files_dir = join(self.project_dir, 'data/lemmas/' + self.ext_lang[language])  # not the clean texts of a loaded model
+        for file_name in sorted(listdir(files_dir)):
+            file_path = join(files_dir, file_name)
+            if isfile(file_path):
+                stat = os.stat(file_path)
+                fingerprint.update(('%s\t%d\t%d\n' % (file_name, stat.st_size, stat.st_mtime_ns)).encode('utf-8'))
+        return {'fingerprint': fingerprint.hexdigest(),
+                'params': {'num_topics': num_topics,
+                           'model_name': model_name,
+                           'remove_sw': remove_sw,
+                           'remove_punct': remove_punct,
+                           'remove_hl': remove_hl,
+                           'tfidf_backend': self.tfidf_backend,
+                           'lsi_index': self.lsi_index,
+                           'multiwords': self.multiwords.fingerprint()}}
+
+
+    def is_saved_model_valid(self, language, manifest):
+        '''
+        It tells whether there is a saved model built from the same corpus with the same parameters
+        (only the same parameters if self.check_corpus is False)
+        :param language: String with the language of the model
+        :param manifest: dictionary returned by get_manifest
+        :return: Boolean
+        '''
+        manifest_path = join(self.get_model_dir(language), 'manifest.json')
+        if not isfile(manifest_path):
+            return False
+        if self.model_name in TERM_MODELS and not isfile(join(self.get_model_dir(language), self.model_name + '.seg')):
+            return False  # saved before the term models were written in segments
+        with open(manifest_path) as f:
+            try:
+                saved = json.load(f)
+            except ValueError:
+                return False
+        if not self.check_corpus:
+            return saved.get('params') == manifest['params']
+        return saved == manifest
+
+
+    def save_model(self, language, manifest):
+        '''
+        It saves the dictionary, the model, the index and the doc_index of the given language.
+        The manifest is written the last one, so an interrupted save is never considered valid
+        :param language: String with the language of the model
+        :param manifest: dictionary returned by get_manifest
+        :return: None
+        '''
+        print('\tSaving the model...')
+        model_dir = self.get_model_dir(language)
+        os.makedirs(model_dir, exist_ok=True)
+        manifest_path = join(model_dir, 'manifest.json')
+        if isfile(manifest_path):
+            os.remove(manifest_path)
+        self.dct[language].save(join(model_dir, 'dictionary'))
+        if self.model_name == 'lsi':
+            self.model[language].save(join(model_dir, 'lsi'))
+            if self.lsi_index == 'sharded':  # its shards are already written
+                self.index[language].save(join(model_dir, 'index'))
+            else:
+                self.index[language].save(join(model_dir, 'index'), separately=['index'])
+            with open(join(model_dir, 'doc_index.json'), 'w') as f:
+                json.dump(self.doc_index[language], f)
+            if language in self.ann:
+                self.ann[language].save(join(model_dir, 'ann.npz'))
+        elif self.model_name in TERM_MODELS:
+            write_segment(join(model_dir, self.model_name + '.seg'), self.model[language])
+            # it is served from the new segment, as the loaded models (after add_documents too)
+            self.model[language] = self.open_segment(language)
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f)
+
+
+    def open_segment(self, language):
+        '''
+        It opens the segment of the term model of the given language (see segment.py)
+        :param language: String with the language of the model
+        :return: SegmentBM25, SegmentTfIdf or SegmentSparseTfIdf, as self.model_name and self.tfidf_backend
+        '''
+        file_path = join(self.get_model_dir(language), self.model_name + '.seg')
+        if self.model_name == 'bm25':
+            return SegmentBM25(file_path)
+        if self.tfidf_backend == 'sparse':
+            return SegmentSparseTfIdf(file_path)
+        return SegmentTfIdf(file_path)
+
+
+    def load_model(self, language, remove_hl):
+        '''
+        It loads the saved dictionary, model, index and doc_index of the given language.
+        The similarity index is memory-mapped, so several processes share the same pages
+        :param language: String with the language of the model
+        :param remove_hl: Boolean varible that tells whether the hapax legomenon were deleted or not
+        :return: None
+        '''
+        model_dir = self.get_model_dir(language)
+        if remove_hl:
+            self.files_dir[language] = join(self.project_dir, 'data/clean_texts/' + self.ext_lang[language])
+        if DocumentStore.exists(model_dir):
+            self.docstore[language] = DocumentStore(model_dir, language)
+        self.dct[language] = corpora.Dictionary.load(join(model_dir, 'dictionary'))
+        if self.model_name == 'lsi':
+            self.model[language] = models.LsiModel.load(join(model_dir, 'lsi'))
+            if self.lsi_index == 'sharded':
+                self.index[language] = load_sharded_index(join(model_dir, 'index'))
+            else:
+                self.index[language] = similarities.MatrixSimilarity.load(join(model_dir, 'index'), mmap='r')
+            with open(join(model_dir, 'doc_index.json')) as f:
+                self.doc_index[language] = {int(doc): file_path for doc, file_path in json.load(f).items()}
+            if self.use_ann:
+                self.load_ann(language)
+        elif self.model_name in TERM_MODELS:
+            self.model[language] = self.open_segment(language)  # memory-mapped
+            self.index[language], self.doc_index[language] = None, None
+        if language not in self.docstore:
+            self.build_docstore(language)
+        if self.num_shards > 1:
+            self.load_shards(language)
+
+
+    def init_languages(self, languages=None, load_stopwords=True):
         '''
         It tells which languages will be used by the model
+        :param languages: List with the names of the languages to use, all the known ones if it is None
+        :param load_stopwords: Boolean variable that tells whether the stopwords are loaded now or by get_stopwords
         :return: 
              ext_lang: dictionary whith the language name and its ISO code
              stopwords_set: dictionary with a set of stopwords for each used language
         '''
         ext_lang = {'english': 'en',
                     'spanish': 'es'}
-        stopwords_set = {}
-        for language in ext_lang.keys():
-            stopwords_set[language] = set(stopwords.words(language))
-        return ext_lang, stopwords_set
+        if languages is not None:
+            ext_lang = {language: ext_lang[language] for language in languages}
+        self.stopwords_set = {}
+        if load_stopwords:
+            for language in ext_lang.keys():
+                self.get_stopwords(language)
+        return ext_lang, self.stopwords_set
+
+
+    def get_stopwords(self, language):
+        '''
+        It gets the set of stopwords of the given language, which is loaded from NLTK the first time.
+        The same set is used to guess the language of the queries and to clean them
+        :param language: String with the language
+        :return: Set of stopwords
+        '''
+        if language not in self.stopwords_set:
+            load_dependencies()
+            self.stopwords_set[language] = set(stopwords.words(language))
+        return self.stopwords_set[language]
+
+
+    def init_freeling(self, host, pool_size):
+        '''
+        It creates a pool of persistent connections to the FreeLing server of each language
+        :param host: String with the host where the FreeLing servers are running
+        :param pool_size: Integer with the number of connections kept opened to each server
+        :return: dictionary with a FreeLingClient for each used language
+        '''
+        return {language: FreeLingClient(self.freeling_ports[language], host, pool_size)
+                for language in self.ext_lang.keys()}
 
 
     def guess_language(self, text):
@@ -143,49 +1008,280 @@ class SkyScanner:
         :return: A string with the name of the detected language
         '''
         languages_ratios = {}
-        tokens = wordpunct_tokenize(text)
+        tokens = WORD_PUNCT.findall(text)
         words = [word.lower() for word in tokens]
-        for language in self.stopwords_set.keys():
+        for language in self.ext_lang.keys():
             words_set = set(words)
-            common_elements = words_set.intersection(self.stopwords_set[language])
+            common_elements = words_set.intersection(self.get_stopwords(language))
             languages_ratios[language] = len(common_elements)  # language "score"
 
         languages = sorted(languages_ratios.items(), key=operator.itemgetter(1), reverse=True)
-        if languages[0][1] <= languages_ratios['english']:
+        if 'english' in languages_ratios and languages[0][1] <= languages_ratios['english']:
             return 'english'
         return languages[0][0]
 
 
-    def run_query(self, query):
+    def run_query(self, query, top_k=None, min_score=None):
         '''
         It sends the given query to the model
         :param query: Query to be sent to the model
+        :param top_k: Integer with the maximum number of documents to retrieve. If it is None, all the documents 
+        are retrieved sorted (it costs O(n log n)), otherwise only the top_k best ones are selected (O(n + k log k))
+        :param min_score: Float with the minimum score (excluded) a document needs to be retrieved in top_k mode. 
+        If it is None, the threshold of the model is used
         :return: The documents sorted by the proximity to the given query
         '''
-        self.query = query
-        self.language = self.guess_language(query)
-        query = self.clean_query(query)
-        if self.model_name == 'lsi':
-            return self.run_lsi_query(query)
-        elif self.model_name == 'tfidf':
-            return self.run_tfidf_query(query)
-
-
-    def run_lsi_query(self, query):
+        with self.metrics.query('run_query', query):
+            self.query = query
+            normalized = ' '.join(query.lower().split())
+            cleaned = self.query_cache.get(normalized)
+            if cleaned is None:
+                with self.metrics.stage('guess_language'):
+                    self.language = self.guess_language(query)
+                self.load_language(self.language)
+                cleaned = (self.language,) + self.parse_query(query)
+                self.query_cache.put(normalized, cleaned)
+            self.language, query, phrases = cleaned
+
+            # only the top_k retrievals are cached, the full sorted lists would take too much memory
+            key = (self.language, tuple(query), phrases, top_k, min_score)
+            if top_k is not None:
+                sims = self.results_cache.get(key)
+                if sims is not None:
+                    return list(sims)
+            if self.uses_positions(self.language, query, phrases):
+                sims = self.positional_similarities(self.language, query, phrases, top_k, min_score)
+            elif self.model_name == 'lsi':
+                sims = self.run_lsi_query(query, top_k, min_score)
+            elif self.model_name in TERM_MODELS:
+                sims = self.run_tfidf_query(query, top_k, min_score)
+            if top_k is not None:
+                self.results_cache.put(key, freeze_results(sims))
+            return sims
+
+
+    def run_lsi_query(self, query, top_k=None, min_score=None):
         '''
         It sends the given query to the LSI model
         :param query: Query to be sent to the model
+        :param top_k: Integer with the maximum number of documents to retrieve (None to retrieve all of them)
+        :param min_score: Float with the minimum score (excluded) a document needs to be retrieved in top_k mode
         :return: The documents sorted by the proximity to the given query
         '''
-        vec_bow = self.dct[self.language].doc2bow(query)  # looks up the 'query' terms in the dictionary
-        vec_lsi = self.model[self.language][vec_bow]  # converts the query to LSI space to get the most probable topic
+        return self.lsi_similarities(self.language, query, top_k, min_score)
+
+
+    def lsi_similarities(self, language, query, top_k=None, min_score=None):
+        '''
+        It scores the given cleaned query with the LSI model of the given language
+        :param language: String with the language of the query
+        :param query: Cleaned query (list of terms)
+        :param top_k: Integer with the maximum number of documents to retrieve (None to retrieve all of them)
+        :param min_score: Float with the minimum score (excluded) a document needs to be retrieved in top_k mode
+        :return: The documents sorted by the proximity to the given query
+        '''
+        with self.metrics.stage('doc2bow'):
+            vec_bow = self.dct[language].doc2bow(query)  # looks up the 'query' terms in the dictionary
+        with self.metrics.stage('lsi_transform'):
+            vec_lsi = self.model[language][vec_bow]  # converts the query to LSI space to get the most probable topic
+
+        if top_k is not None and language in self.shards:
+            vector = matutils.unitvec(matutils.sparse2full(vec_lsi, self.index[language].num_features))
+            with self.metrics.stage('similarity'):
+                return self.shards[language].search(vector[:, None], top_k, self.get_min_score(min_score))[0]
+        if top_k is not None and language in self.ann:
+            return self.ann_similarities(language, vec_lsi, top_k, min_score)
 
         # gets a sorted list of the most relevant documents related to the given query
-        sims = self.index[self.language][vec_lsi]
-        sims = sorted(enumerate(sims), key=lambda item: -item[1])
+        with self.metrics.stage('similarity'):
+            sims = self.index[language][vec_lsi]
+        with self.metrics.stage('sort'):
+            if top_k is not None:
+                return self.select_top_k(sims, top_k, min_score)
+            sims = sorted(enumerate(sims), key=lambda item: -item[1])
         return sims
 
 
+    def search(self, query, language=None, top_k=10, min_score=None):
+        '''
+        It runs the given query and builds its results. Unlike run_query and get_output, it does not keep any state
+        of the query in the instance, so it can be called from several threads at the same time
+        :param query: Query to be sent to the model
+        :param language: String with the language of the query, it is guessed if it is None
+        :param top_k: Integer with the maximum number of documents to retrieve
+        :param min_score: Float with the minimum score (excluded) a document needs to be retrieved. 
+        If it is None, the threshold of the model is used
+        :return: 
+            language: String with the language of the query
+            results: List of dictionaries with the url, title, snippet and score of each retrieved document
+        '''
+        with self.metrics.query('search', query):
+            if language is None:
+                with self.metrics.stage('guess_language'):
+                    language = self.guess_language(query)
+            self.load_language(language)
+            normalized = (language, ' '.join(query.lower().split()))
+            cleaned = self.query_cache.get(normalized)
+            if cleaned is None:
+                lemmatized = self.lemmatize_text(query.replace("’", "'"), language)
+                cleaned = self.parse_lemmatized_query(lemmatized, language)
+                self.query_cache.put(normalized, cleaned)
+            cleaned, phrases = cleaned
+
+            # as in run_query, only the top_k retrievals are cached
+            key = (language, tuple(cleaned), phrases, top_k, min_score)
+            sims = self.results_cache.get(key) if top_k is not None else None
+            if sims is None:
+                if self.uses_positions(language, cleaned, phrases):
+                    sims = self.positional_similarities(language, cleaned, phrases, top_k, min_score)
+                elif self.model_name == 'lsi':
+                    sims = self.lsi_similarities(language, cleaned, top_k, min_score)
+                elif self.model_name in TERM_MODELS:
+                    sims = self.tfidf_similarities(language, cleaned, top_k, min_score)
+                if top_k is not None:
+                    sims = freeze_results(sims)
+                    self.results_cache.put(key, sims)
+            return language, self.get_results(sims, query, language, 10 if top_k is None else top_k)
+
+
+    def run_queries(self, queries, top_k=10, min_score=None):
+        '''
+        It sends several queries to the model at once. The queries are grouped by language, each group is lemmatized
+        in parallel by the FreeLing connection pool and, with the LSI model, projected as a matrix and scored against the index
+        with a single matrix product. The queries which use the positional index are scored one by one
+        :param queries: List of queries to be sent to the model
+        :param top_k: Integer with the maximum number of documents to retrieve for each query
+        :param min_score: Float with the minimum score (excluded) a document needs to be retrieved. 
+        If it is None, the threshold of the model is used
+        :return: List with a (language, retrieved documents) tuple for each query, in the same order as the queries.
+        The retrieved documents are sorted as in run_query with top_k
+        '''
+        with self.metrics.query('run_queries'):
+            groups = collections.defaultdict(list)
+            with self.metrics.stage('guess_language'):
+                for i, query in enumerate(queries):
+                    groups[self.guess_language(query)].append(i)
+
+            results = [None] * len(queries)
+            for language, positions in groups.items():
+                self.load_language(language)
+                with self.metrics.stage('lemmatize_text'):
+                    lemmatized = self.freeling[language].lemmatize_many([queries[i].replace("’", "'") for i in positions])
+                self.metrics.count('freeling_calls')
+                parsed = [self.parse_lemmatized_query(query, language) for query in lemmatized]
+                for i, (query, phrases) in zip(positions, parsed):
+                    if self.uses_positions(language, query, phrases):
+                        results[i] = (language, self.positional_similarities(language, query, phrases, top_k, min_score))
+                batch = [(i, query) for i, (query, phrases) in zip(positions, parsed) if results[i] is None]
+                if not batch:
+                    continue
+                positions = [i for i, query in batch]
+                cleaned = [query for i, query in batch]
+                if self.model_name == 'lsi':
+                    sims = self.run_lsi_queries(language, cleaned, top_k, min_score)
+                elif self.model_name == 'tfidf' and language in self.shards:
+                    with self.metrics.stage('similarity'):
+                        sims = self.shards[language].search(cleaned, top_k, self.get_min_score(min_score))
+                    sims = [[(self.model[language].documents[doc], score) for doc, score in query_sims] for query_sims in sims]
+                elif self.model_name in TERM_MODELS:
+                    sims = [self.tfidf_similarities(language, query, top_k, min_score) for query in cleaned]
+                for i, query_sims in zip(positions, sims):
+                    results[i] = (language, query_sims)
+            return results
+
+
+    def run_lsi_queries(self, language, queries, top_k, min_score=None):
+        '''
+        It sends several cleaned queries to the LSI model of the given language, projecting all of them at once 
+        and scoring them against the index with a single matrix product
+        :param language: String with the language of the queries
+        :param queries: List of cleaned queries (lists of terms)
+        :param top_k: Integer with the maximum number of documents to retrieve for each query
+        :param min_score: Float with the minimum score (excluded) a document needs to be retrieved
+        :return: List with the retrieved documents of each query
+        '''
+        index = self.index[language]
+        with self.metrics.stage('doc2bow'):
+            corpus = [self.dct[language].doc2bow(query) for query in queries]
+        with self.metrics.stage('lsi_transform'):
+            vectors = matutils.corpus2dense(self.model[language][corpus], num_terms=index.num_features)  # topics x queries
+            norms = numpy.linalg.norm(vectors, axis=0)
+            norms[norms == 0] = 1.0
+        if language in self.shards:
+            with self.metrics.stage('similarity'):
+                return self.shards[language].search(vectors / norms, top_k, self.get_min_score(min_score))
+        if language in self.ann:
+            return [self.ann_similarities(language, vector, top_k, min_score) for vector in (vectors / norms).T]
+        with self.metrics.stage('similarity'):
+            documents = self.get_lsi_vectors(language)
+            sims = documents.dot((vectors / norms).astype(documents.dtype))  # documents x queries
+        with self.metrics.stage('sort'):
+            return [self.select_top_k(sims[:, i], top_k, min_score) for i in range(len(queries))]
+
+
+    def ann_similarities(self, language, vec_lsi, top_k, min_score=None):
+        '''
+        It scores the given LSI vector with the approximate nearest neighbour index of the given language:
+        only the closest lists are scanned and their best candidates are rescored with the exact vectors
+        :param language: String with the language of the query
+        :param vec_lsi: The query in the LSI space, either sparse (list of (topic, weight)) or a dense Numpy array
+        :param top_k: Integer with the maximum number of documents to retrieve
+        :param min_score: Float with the minimum score (excluded). If it is None, the threshold of the model is used
+        :return: List of (document, score) tuples sorted by score, as select_top_k
+        '''
+        if min_score is None:
+            min_score = self.threshold
+        index = self.index[language]
+        if not isinstance(vec_lsi, numpy.ndarray):
+            vec_lsi = matutils.unitvec(matutils.sparse2full(vec_lsi, index.num_features))
+        with self.metrics.stage('ann_search'):
+            docs, scores = self.ann[language].search(vec_lsi, top_k, self.get_lsi_vectors(language),
+                                                     self.ann_nprobe, self.ann_rerank)
+        return [(int(doc), score) for doc, score in zip(docs, scores) if score > min_score]
+
+
+    def get_min_score(self, min_score):
+        return self.threshold if min_score is None else min_score
+
+
+    def select_top_k(self, scores, top_k, min_score=None):
+        '''
+        It selects the top_k best scored documents without sorting the whole list of scores.
+        The documents whose score is not above min_score are discarded before the selection.
+        :param scores: Numpy array with the score of each document, where the position is the document identifier
+        :param top_k: Integer with the maximum number of documents to retrieve
+        :param min_score: Float with the minimum score (excluded). If it is None, the threshold of the model is used
+        :return: List of (document, score) tuples sorted by score
+        '''
+        if min_score is None:
+            min_score = self.threshold
+        scores = numpy.asarray(scores)
+        candidates = numpy.flatnonzero(scores > min_score)
+        if top_k <= 0 or len(candidates) == 0:
+            return []
+        if len(candidates) > top_k:
+            best = numpy.argpartition(-scores[candidates], top_k - 1)[:top_k]
+            candidates = candidates[best]
+        candidates = candidates[numpy.argsort(-scores[candidates], kind='stable')]
+        return [(int(doc), scores[doc]) for doc in candidates]
+
+
+    def select_top_k_pairs(self, sims, top_k, min_score=None):
+        '''
+        It selects the top_k best scored pairs using a heap of size top_k.
+        The pairs whose score is not above min_score are discarded before the selection.
+        :param sims: Iterable of [document, score] pairs
+        :param top_k: Integer with the maximum number of documents to retrieve
+        :param min_score: Float with the minimum score (excluded). If it is None, the threshold of the model is used
+        :return: List of [document, score] pairs sorted by score
+        '''
+        if min_score is None:
+            min_score = self.threshold
+        if top_k <= 0:
+            return []
+        return heapq.nlargest(top_k, (sim for sim in sims if sim[1] > min_score), key=operator.itemgetter(1))
+
+
     def normalize_scores(self, sims):
         '''
         It normalizes the scores in the given results
@@ -198,25 +1294,175 @@ class SkyScanner:
         return [[x[0], x[1] / max_score] for x in sims]
 
 
-    def run_tfidf_query(self, query):
+    def run_tfidf_query(self, query, top_k=None, min_score=None):
         '''
         It sends the given query to the Tf-Idf model
         :param query: Query to be sent to the model
+        :param top_k: Integer with the maximum number of documents to retrieve (None to retrieve all of them)
+        :param min_score: Float with the minimum score (excluded) a document needs to be retrieved in top_k mode
         :return: The documents sorted by the proximity to the given query
         '''
-        sims = self.model[self.language].similarities(query)
-        sims.sort(key=lambda x: x[1], reverse=True)
+        return self.tfidf_similarities(self.language, query, top_k, min_score)
+
+
+    def tfidf_similarities(self, language, query, top_k=None, min_score=None):
+        '''
+        It scores the given cleaned query with the Tf-Idf (or BM25) model of the given language.
+        With the sparse backend, the top_k documents are selected straight from the NumPy array of scores,
+        and with BM25 the documents which can not reach the top_k are skipped (unless bm25_pruning is False)
+        :param language: String with the language of the query
+        :param query: Cleaned query (list of terms)
+        :param top_k: Integer with the maximum number of documents to retrieve (None to retrieve all of them)
+        :param min_score: Float with the minimum score (excluded) a document needs to be retrieved in top_k mode
+        :return: The documents sorted by the proximity to the given query
+        '''
+        model = self.model[language]
+        if top_k is not None and isinstance(model, BM25):
+            stats = {}
+            with self.metrics.stage('similarity'):
+                sims = model.top_k(query, top_k, self.get_min_score(min_score), self.bm25_pruning, stats)
+            self.metrics.count('documents_scored', stats['scored'])
+            return sims
+        if top_k is not None and language in self.shards:
+            with self.metrics.stage('similarity'):
+                sims = self.shards[language].search([query], top_k, self.get_min_score(min_score))[0]
+            return [(model.documents[doc], score) for doc, score in sims]
+        if top_k is not None and isinstance(model, SparseTfIdf):
+            with self.metrics.stage('similarity'):
+                scores = model.scores(query)
+            with self.metrics.stage('sort'):
+                return [(model.documents[doc], score) for doc, score in self.select_top_k(scores, top_k, min_score)]
+        with self.metrics.stage('similarity'):
+            sims = model.similarities(query)
+        with self.metrics.stage('sort'):
+            if top_k is not None:
+                return self.select_top_k_pairs(sims, top_k, min_score)
+            sims.sort(key=lambda x: x[1], reverse=True)
         # return self.normalize_scores(sims)
         return sims
 
 
-    def get_lsi_output(self, doc, score):
+    def uses_positions(self, language, query, phrases):
         '''
-        It builds the JSON object to be sent to the interface
-        :param sims: The documents sorted by the proximity to the given query
-        :return: The JSON object
+        It tells whether a cleaned query is scored with the positional index: it has phrases or, with the proximity
+        boost enabled, several distinct terms
+        :return: Boolean
         '''
-        file_path = self.doc_index[self.language][doc].replace(self.files_dir[self.language].split('/')[-2:-1][0], 'documents')
+        return language in self.positions and bool(phrases or (self.proximity_weight > 0 and len(set(query)) > 1))
+
+
+    def model_similarities(self, language, query, top_k=None, min_score=None):
+        if self.model_name == 'lsi':
+            return self.lsi_similarities(language, query, top_k, min_score)
+        elif self.model_name in TERM_MODELS:
+            return self.tfidf_similarities(language, query, top_k, min_score)
+
+
+    def candidate_similarities(self, language, query, docs):
+        '''
+        It scores the given cleaned query against some documents only, instead of the whole corpus
+        :param language: String with the language of the query
+        :param query: Cleaned query (list of terms)
+        :param docs: List of document identifiers
+        :return: List of (document, score) pairs in the order of docs, with the documents as model_similarities
+        '''
+        if self.model_name == 'lsi':
+            with self.metrics.stage('doc2bow'):
+                vec_bow = self.dct[language].doc2bow(query)
+            with self.metrics.stage('lsi_transform'):
+                vec_lsi = self.model[language][vec_bow]
+            vector = matutils.unitvec(matutils.sparse2full(vec_lsi, self.index[language].num_features))
+            with self.metrics.stage('similarity'):
+                scores = numpy.dot(self.get_lsi_vectors(language)[docs], vector) if docs else []
+            return [(doc, float(score)) for doc, score in zip(docs, scores)]
+        elif self.model_name in TERM_MODELS:
+            model = self.model[language]
+            with self.metrics.stage('similarity'):
+                scores = model.document_scores(query, docs)
+            return [(model.documents[doc], float(score)) for doc, score in zip(docs, scores)]
+
+
+    def get_doc_id(self, language, doc):
+        '''
+        It gets the identifier of a retrieved document (the LSI retrievals already have it, the Tf-Idf ones have its name)
+        :return: Integer with the document identifier or None
+        '''
+        if self.model_name == 'lsi':
+            return int(doc)
+        return self.docstore[language].find(doc)
+
+
+    def positional_similarities(self, language, query, phrases, top_k=None, min_score=None):
+        '''
+        It scores the given cleaned query with the model and the positional index of the given language: the documents
+        which do not contain all the quoted phrases are discarded, and the proximity_rerank best ones are boosted
+        by the proximity of the query terms (see boost_proximity)
+        :param language: String with the language of the query
+        :param query: Cleaned query (list of terms)
+        :param phrases: Tuple with the phrases returned by parse_lemmatized_query
+        :param top_k: Integer with the maximum number of documents to retrieve (None to retrieve all of them)
+        :param min_score: Float with the minimum score (excluded) a document needs to be retrieved in top_k mode
+        :return: The documents sorted by the proximity to the given query
+        '''
+        index = self.positions[language]
+        boost = self.proximity_weight > 0 and len(set(query)) > 1
+        if phrases:
+            with self.metrics.stage('phrases'):
+                docs = index.phrase_documents(phrases[0])
+                for phrase in phrases[1:]:
+                    docs = numpy.intersect1d(docs, index.phrase_documents(phrase))
+            # only the documents with the phrases are scored
+            sims = self.candidate_similarities(language, query, docs.tolist())
+            with self.metrics.stage('sort'):
+                if top_k is not None and not boost:
+                    return self.select_top_k_pairs(sims, top_k, min_score)
+                if top_k is not None:
+                    sims = self.select_top_k_pairs(sims, max(top_k, self.proximity_rerank), min_score)
+                else:
+                    sims.sort(key=lambda sim: -sim[1])
+        else:
+            sims = self.model_similarities(language, query, None if top_k is None else max(top_k, self.proximity_rerank),
+                                           min_score)
+        if boost:
+            with self.metrics.stage('proximity'):
+                sims = self.boost_proximity(language, query, sims)
+        return sims if top_k is None else sims[:top_k]
+
+
+    def boost_proximity(self, language, query, sims):
+        '''
+        It boosts the proximity_rerank best retrieved documents by the smallest window which contains the query terms
+        found in them: the score is multiplied by 1 + proximity_weight * found / terms * (found - 1) / (window - 1),
+        so the documents with all the terms side by side get the whole boost
+        :param language: String with the language of the query
+        :param query: Cleaned query (list of terms)
+        :param sims: The documents sorted by their score
+        :return: The documents sorted by their boosted score
+        '''
+        index = self.positions[language]
+        terms = list(collections.OrderedDict.fromkeys(query))
+        head = []
+        for sim in sims[:self.proximity_rerank]:
+            doc, score = sim[0], sim[1]
+            doc_id = self.get_doc_id(language, doc)
+            found, window = index.window(terms, doc_id) if doc_id is not None else (0, 0)
+            if found > 1 and score > 0:
+                score = score * (1 + self.proximity_weight * found / len(terms) * (found - 1) / float(window - 1))
+            head.append((doc, score))
+        head.sort(key=lambda sim: -sim[1])
+        return head + list(sims[self.proximity_rerank:])
+
+
+    def get_lsi_output(self, doc, score, language=None):
+        '''
+        It finds the original document of a LSI retrieval
+        :param doc: Integer with the document identifier
+        :param score: Float with the score of the document
+        :param language: String with the language of the model (the language of the last query if it is None)
+        :return: The path of the original document and its url
+        '''
+        language = language or self.language
+        file_path = self.doc_index[language][doc].replace(self.files_dir[language].split('/')[-2:-1][0], 'documents')
         file_name = file_path.split('/')[-1]
         file_path = '/'.join(file_path.split('/')[:-1]) + '/article/' + file_name
         if file_name in self.urls:
@@ -226,12 +1472,13 @@ class SkyScanner:
         return file_path, url
 
 
-    def get_tfidf_output(self, doc, score):
+    def get_tfidf_output(self, doc, score, language=None):
+        language = language or self.language
         if doc in self.urls:
             url = self.urls[doc]
         else:
             url = 'https://www.entrepreneur.com/article/' + doc[:-4]
-        file_path = join(self.project_dir, 'data/documents/' + self.ext_lang[self.language] + '/article/' + doc)
+        file_path = join(self.project_dir, 'data/documents/' + self.ext_lang[language] + '/article/' + doc)
         return file_path, url
 
 
@@ -241,27 +1488,55 @@ class SkyScanner:
         :param sims: The documents sorted by the proximity to the given query
         :return: The JSON object
         '''
-        if self.query == None:
-            print("ERROR: You have to send a query first")
-            pass
+        with self.metrics.query('get_output', self.query):
+            if self.query == None:
+                print("ERROR: You have to send a query first")
+                pass
+
+            output = self.get_results(sims, self.query, self.language)
+            return json.dumps([{'url': result['url'], 'title': result['title'], 'snippet': result['snippet']} for result in output])
 
+
+    def get_results(self, sims, query, language, n=10):
+        '''
+        It builds the results of the n best retrieved documents whose score is above the threshold
+        :param sims: The documents sorted by the proximity to the given query
+        :param query: String with the query
+        :param language: String with the language of the query
+        :param n: Integer with the maximum number of results
+        :return: List of dictionaries with the url, title, snippet and score of each document
+        '''
         output = []
         i = 0
         for sim in sims:
             doc = sim[0]
             score = sim[1]
-            if score > self.threshold and i < 10:
-                if self.model_name == 'tfidf':
-                    file_path, url = self.get_tfidf_output(doc, score)
-                elif self.model_name == 'lsi':
-                    file_path, url = self.get_lsi_output(doc, score)
-                with open(file_path) as f:
-                    lines = f.readlines()
-                    title = lines[0].strip()
-                    snippet = self.get_snippet(file_path, self.query)
-                    output.append({'url': url, 'title': title, 'snippet': snippet})
+            if score > self.threshold and i < n:
+                store = self.docstore.get(language)
+                doc_id = None
+                if store is not None:
+                    if self.model_name == 'lsi':
+                        doc_id = doc if doc < len(store) else None
+                    elif self.model_name in TERM_MODELS:
+                        doc_id = store.find(doc)
+                if doc_id is not None:
+                    with self.metrics.stage('read_document'):
+                        meta = store.get(doc_id)
+                    file_path, url, title = meta['path'], meta['url'], meta['title']
+                else:
+                    if self.model_name in TERM_MODELS:
+                        file_path, url = self.get_tfidf_output(doc, score, language)
+                    elif self.model_name == 'lsi':
+                        file_path, url = self.get_lsi_output(doc, score, language)
+                    self.metrics.count('files_opened')
+                    with self.metrics.stage('read_document'):
+                        with open(file_path) as f:
+                            title = f.readline().strip()
+                with self.metrics.stage('get_snippet'):
+                    snippet = self.get_snippet(file_path, query, language)
+                output.append({'url': url, 'title': title, 'snippet': snippet, 'score': float(score)})
                 i += 1
-        return json.dumps(output)
+        return output
 
 
 
@@ -317,109 +1592,145 @@ class SkyScanner:
         return True
 
 
-    def build_dictionary(self):
-        '''
-        To create a dictionary with all the corpus terms
-        :return: Dictionary with all the corpus terms
-        '''
-        print('\tBuilding the dictionary...')
-        dct = corpora.Dictionary([[]])
-        for file_path in self.files[self.language]:
-            with open(file_path) as f:
-                text = [term for term in f.readline().lower().split() if self.frequency[self.language][term] > 1]
-                dct.add_documents([text])
-        return dct
-
-
-    def remove_hapax_legomenon(self):
-        '''
-        To remove all the terms which appear just once in the whole corpus and 
-        create a dictionary with all the corpus terms
-        :return: 
-            dtc: Dictionary with all the corpus terms
-            clean_dir: The files directory to build the model
-        '''
-        print('\tBuilding the dictionary and removing the hapax legomenon...')
-        clean_dir = join(self.project_dir, 'data/clean_texts/' + self.ext_lang[self.language])
-        dct = corpora.Dictionary([[]])
-        for file_path in self.files[self.language]:
-            file_name = file_path.split('/')[-1]
-            with open(file_path) as f:
-                text = [term for term in f.readline().lower().split() if self.frequency[self.language][term] > 1]
-                dct.add_documents([text])
-                with open(join(clean_dir, file_name), 'w') as f:
-                    f.write(' '.join(text))
-        return dct, clean_dir
-
-
     def get_terms_frequency(self):
         '''
-        To get the corpus terms frequency
-        :param files_dir: Directory where all the text files are
+        To get the corpus terms frequency. With several processes, the files are counted in chunks by a pool
+        and the partial counts are merged
         :return: 
             files: The corpus files
             frequency: The terms frequency
+            texts: List with the rewritten lemmas of each file (see count_terms), so build_corpus does not read them again
         '''
         print('\tGetting the terms frequency...')
         files = [join(self.files_dir[self.language], f) for f in listdir(self.files_dir[self.language]) if isfile(join(self.files_dir[self.language], f))]
-        frequency = collections.Counter()
-        for file_path in files:
-            with open(file_path) as f:
-                text = [term for term in f.readline().lower().split() if term not in self.stopWords[self.language] and term not in self.punctSym[self.language]]
-                frequency += collections.Counter(text)
-        return files, frequency
+        state = {'stopwords': self.stopWords[self.language],
+                 'punct': self.punctSym[self.language],
+                 'multiwords': self.multiwords}
+        if self.processes > 1:
+            chunks = [files[i:i + CHUNK_SIZE] for i in range(0, len(files), CHUNK_SIZE)]
+            frequency = collections.Counter()
+            texts = []
+            with multiprocessing.Pool(self.processes, initializer=init_worker, initargs=(state,)) as pool:
+                for partial, partial_texts in pool.imap(count_terms, chunks):  # in order, as the texts of the files
+                    frequency.update(partial)
+                    texts.extend(partial_texts)
+            return files, frequency, texts
+        init_worker(state)
+        return (files,) + count_terms(files)
+
+
+    def get_corpus_path(self, language):
+        return join(self.get_model_dir(language), 'corpus.mm')
+
+
+    def build_corpus(self, remove_hl, texts):
+        '''
+        To create a dictionary with all the corpus terms which appear more than once (the stopwords and the punctuation 
+        symbols are not taken into account) and the bag-of-words corpus, from the lemmas get_terms_frequency read.
+        The bag-of-words corpus is streamed to an MmCorpus file (LSI) or to the Tf-Idf model, so it is never held in memory.
+        With several processes, the texts are converted to bag-of-words by a pool, in order.
+        :param remove_hl: Boolean varible that tells whether the hapax legomenon are removed from the documents files,
+        in that case the documents without them are written in data/clean_texts and they are used to build the model
+        :param texts: List with the rewritten lemmas of each file of self.files, returned by get_terms_frequency
+        :return: 
+            dct: Dictionary with all the corpus terms
+            files_dir: The files directory which the model is built from
+            doc_index: dictionary with the file of each document identifier
+            tfidf: The Tf-Idf model if it is the one being built, None otherwise
+        '''
+        print('\tBuilding the dictionary and the corpus...')
+        language = self.language
+        files_dir = self.files_dir[language]
+        if remove_hl:
+            files_dir = join(self.project_dir, 'data/clean_texts/' + self.ext_lang[language])
+            os.makedirs(files_dir, exist_ok=True)
+        dct = corpora.Dictionary()
+        dct.token2id = {term: i for i, term in enumerate(sorted(term for term, freq in self.frequency[language].items() if freq > 1))}
+        doc_index = {}
+        tfidf = None
+        if self.model_name == 'tfidf':
+            tfidf = SparseTfIdf() if self.tfidf_backend == 'sparse' else TfIdf()
+        elif self.model_name == 'bm25':
+            tfidf = BM25()
+        state = {'token2id': dct.token2id,
+                 'clean_dir': files_dir if remove_hl else None,
+                 'keep_text': tfidf is not None,
+                 'multiwords': self.multiwords}
+
+        def stream(documents):
+            for i, (file_path, bow, text) in enumerate(documents):
+                doc_index[i] = file_path
+                dct.num_docs += 1
+                for term_id, freq in bow:
+                    dct.dfs[term_id] = dct.dfs.get(term_id, 0) + 1
+                    dct.cfs[term_id] = dct.cfs.get(term_id, 0) + freq
+                    dct.num_pos += freq
+                dct.num_nnz += len(bow)
+                if tfidf is not None:
+                    tfidf.add_document(file_path.split('/')[-1], text)
+                yield bow
+
+        def consume(documents):
+            if self.model_name == 'lsi':
+                os.makedirs(self.get_model_dir(language), exist_ok=True)
+                corpora.MmCorpus.serialize(self.get_corpus_path(language), stream(documents))  # text_id token_id token_frequency_in_this_text
+            else:
+                for bow in stream(documents):
+                    pass
+
+        if self.processes > 1:
+            with multiprocessing.Pool(self.processes, initializer=init_worker, initargs=(state,)) as pool:
+                consume(pool.imap(lemma_file_to_bow, zip(self.files[language], texts), chunksize=CHUNK_SIZE))
+        else:
+            init_worker(state)
+            consume(map(lemma_file_to_bow, zip(self.files[language], texts)))
+        return dct, files_dir, doc_index, tfidf
 
 
-    def build_model(self, num_topics):
+    def build_model(self, num_topics, doc_index, tfidf):
         '''
         It builds either a LSI model or a Tf-Idf model
-        :param files_dir: Directory where all the files which will build the model are
         :param num_topics: Number of topics for the model
-        :return: The model index
+        :param doc_index: dictionary with the file of each document identifier
+        :param tfidf: The Tf-Idf model built by build_corpus
+        :return: The model, the index and the doc_index
         '''
         print('\tBuilding the model...')
-        files = [join(self.files_dir[self.language], f) for f in listdir(self.files_dir[self.language]) if isfile(join(self.files_dir[self.language], f))]
         if self.model_name == 'lsi':
-            return self.build_lsi_model(files, num_topics)
-        elif self.model_name == 'tfidf':
-            return self.build_tfidf_model(files), None, None # The None values are set to return the same format as the LSI model
+            lsi, index = self.build_lsi_model(num_topics)
+            return lsi, index, doc_index
+        elif self.model_name in TERM_MODELS:
+            return tfidf, None, None # The None values are set to return the same format as the LSI model
 
 
-    def build_tfidf_model(self, files):
+    def build_lsi_model(self, num_topics):
         '''
-        It builds the Tf-Idf model
-        :param files: List of files of the corpora
-        :return: A Tf-Idf object with the model loaded
+        It builds the LSI model streaming the corpus from the MmCorpus file (see lsi_training.py), and its index
+        (a dense MatrixSimilarity or, with lsi_index='sharded', a Similarity written in shards next to the model)
+        :param num_topics: Number of topics for the model
+        :return: The model and its index
         '''
-        tfidf = TfIdf()
-        for file_path in files:
-            with open(file_path) as f:
-                doc_name = file_path.split('/')[-1]
-                doc_text = f.readline().split()
-                tfidf.add_document(doc_name, doc_text)
-        return tfidf
+        corpus_path = self.get_corpus_path(self.language)
+        lsi = train_lsi(corpus_path, self.dct[self.language], num_topics, self.lsi_chunksize, self.lsi_power_iters,
+                        self.lsi_extra_samples, self.lsi_onepass, self.lsi_workers)
+        corpus = corpora.MmCorpus(corpus_path)
+        if self.lsi_index == 'sharded':
+            index = build_sharded_index(join(self.get_model_dir(self.language), 'index'), lsi, corpus, self.lsi_shard_size)
+        else:
+            index = similarities.MatrixSimilarity(lsi[corpus], num_features=lsi.num_topics)
+        return lsi, index
 
 
-    def build_lsi_model(self, files, num_topics):
+    def get_lsi_vectors(self, language):
         '''
-        It builds the LSI model
-        :param files_dir: Directory where all the files which will build the model are
-        :param num_topics: Number of topics for the model
-        :return: The model index
+        It gets the unit vectors of the documents of the LSI index of the given language
+        :param language: String with the language of the model
+        :return: Numpy array (documents x topics), or a SimilarityVectors which reads the shards of a sharded index
         '''
-        doc_index = {}
-        corpus = []
-        for i, file_path in enumerate(files):
-            doc_index[i] = file_path
-            with open(file_path) as f:
-                text = f.readline()
-                corpus.append(self.dct[self.language].doc2bow(text.split()))  # token_id token_frequency_in_this_text
-        corpora.MmCorpus.serialize('corpus_' + self.ext_lang[self.language] + '.mm',
-                                   corpus)  # text_id token_id(alphabetically_sorted) token_frequency_in_this_text
-
-        lsi = models.LsiModel(corpus, id2word=self.dct[self.language], num_topics=num_topics)
-        index = similarities.MatrixSimilarity(lsi[corpus])
-        return lsi, index, doc_index
+        index = self.index[language]
+        if isinstance(index, similarities.Similarity):
+            return SimilarityVectors(index)
+        return index.index
 
 
     def clean_query(self, query):
@@ -428,16 +1739,63 @@ class SkyScanner:
         :param query: The query to be adapted
         :return: The properly format query
         '''
+        return self.parse_query(query)[0]
+
+
+    def parse_query(self, query):
+        '''
+        It lemmatizes the given query and gets its terms and its quoted phrases
+        :param query: The query to be adapted
+        :return: The terms and the phrases returned by parse_lemmatized_query
+        '''
         query = query.replace("’", "'")
         query = self.lemmatize_text(query)
-        query = query.replace("crowd funding", "crowd_funding")
-        query = query.replace("crowdfunding", "crowd_funding")
-        query = query.replace("crowd fund", "crowd_fund")
-        query = query.replace("crowdfund", "crowd_fund")
-        query = query.replace("setup", "set up")
-        query = query.replace("set-up", "set up")
-        query = [term for term in query.split() if term not in self.stopWords[self.language] and term not in self.punctSym[self.language]]
-        return query
+        return self.parse_lemmatized_query(query, self.language)
+
+
+    def clean_lemmatized_query(self, query, language):
+        '''
+        It adapts the given lemmatized query to the corpus terms
+        :param query: String with the lemmatized query
+        :param language: String with the language of the query
+        :return: The properly format query
+        '''
+        return self.parse_lemmatized_query(query, language)[0]
+
+
+    def parse_lemmatized_query(self, query, language):
+        '''
+        It rewrites the multiwords of the given lemmatized query and gets its terms (without stopwords nor punctuation
+        symbols) and its quoted phrases. An unclosed quote takes the rest of the query
+        :param query: String with the lemmatized query
+        :param language: String with the language of the query
+        :return:
+            terms: List with the terms of the query, the ones of the phrases included
+            phrases: Tuple with a tuple of (offset, term) tuples for each phrase, where the offset is the position of
+            the term in the phrase (the stopwords and the punctuation symbols are counted, as in the documents)
+        '''
+        with self.metrics.stage('clean_query'):
+            terms = []
+            phrases = []
+            phrase = None
+            offset = 0
+            for term in self.multiwords.apply(query.split()):
+                if term in QUOTES:
+                    if phrase is None:
+                        phrase, offset = [], 0
+                    else:
+                        if phrase:
+                            phrases.append(tuple(phrase))
+                        phrase = None
+                    continue
+                if term not in self.stopWords[language] and term not in self.punctSym[language]:
+                    terms.append(term)
+                    if phrase is not None:
+                        phrase.append((offset, term))
+                offset += 1
+            if phrase:
+                phrases.append(tuple(phrase))
+        return terms, tuple(phrases)
 
 
     def get_output_as_list_dict(self, json):
@@ -465,29 +1823,17 @@ class SkyScanner:
         return output
 
 
-    def lemmatize_text(self, text):
+    def lemmatize_text(self, text, language=None):
         '''
         It gets all the lemmas of a given text.
         You'll need to have FreeLing running in the server in the same port (analyze -f es.cfg --server --port 50005 &)
         :param text: Text to be lemmatized
+        :param language: String with the language of the text (the language of the last query if it is None)
         :return: A string with the text lemmatized
         '''
-        if self.language == 'english':
-            bashCommand = "echo \"" + text + "\" | analyzer_client 50005"
-        elif self.language == 'spanish':
-            bashCommand = "echo \"" + text + "\" | analyzer_client 50006"
-        process = subprocess.Popen(bashCommand, stdout=subprocess.PIPE, shell=True)
-        output = process.communicate()
-        terms = str(output[0][:-1]).split('\\n')
-        lemmatized = ""
-        for term in terms:
-            part = term.split()
-            if len(part) == 4:
-                if part[2] == 'W':
-                    lemmatized += part[0] + ' '
-                else:
-                    lemmatized += part[1] + ' '
-        return lemmatized[:-1]
+        self.metrics.count('freeling_calls')
+        with self.metrics.stage('lemmatize_text'):
+            return self.freeling[language or self.language].lemmatize(text)
 
 
     def get_positions(self, query, text):
@@ -548,28 +1894,62 @@ class SkyScanner:
         return snippet
 
 
-    def get_snippet(self, file_path, l_query):
+    def get_snippet(self, file_path, l_query, language=None):
         '''
-        It builds the snippets from the given document which best match with the given query
+        It builds the snippets from the given document which best match with the given query.
+        If the document is in the sentence store, no file is read and nothing is lemmatized.
+        The snippets are cached
         :param file_path: Local path where the text document is
         :param l_query: String with the lemmatized query
+        :param language: String with the language of the document (the language of the last query if it is None)
         :return: A string with the n best sentences concatenated separating them by ellipsis
         '''
-        with open(file_path) as f:
-            lines = f.readlines()
-            if len(lines) == 3:
-                text = lines[2]  # read only the body of the document
-            else:
-                text = ' '.join(lines)
-            sent_tokenize_list = sent_tokenize(text)
-            terms_pos = []
-            for sentence in sent_tokenize_list:
-                l_sent = self.lemmatize_text(sentence)
-                pos = self.get_positions(l_query, l_sent)
-                terms_pos.append(pos)
-            n = 3
+        key = (file_path, ' '.join(l_query.split()))
+        snippet = self.snippet_cache.get(key)
+        if snippet is None:
+            snippet = self.build_snippet(file_path, l_query, language or self.language)
+            self.snippet_cache.put(key, snippet)
+        return snippet
+
+
+    def build_snippet(self, file_path, l_query, language):
+        '''
+        It builds the snippet returned by get_snippet
+        :param file_path: Local path where the text document is
+        :param l_query: String with the lemmatized query
+        :param language: String with the language of the document
+        :return: A string with the n best sentences concatenated separating them by ellipsis
+        '''
+        n = 3
+        doc_name = file_path.split('/')[-1]
+        store = self.sentence_store.get(language)
+        if store is not None and doc_name in store:
+            self.metrics.count('snippets_from_store')
+            terms_pos = store.get_terms_pos(doc_name, l_query)
             best = self.get_n_best_sentences(terms_pos, n)
-            return self.get_text(sent_tokenize_list, best)
+            return self.get_text(store.get_sentences(doc_name), best)
+
+        docstore = self.docstore.get(language)
+        doc = docstore.find(doc_name) if docstore is not None else None
+        if doc is not None:
+            text = docstore.get_field(doc, 'body')
+        else:
+            self.metrics.count('files_opened')
+            with open(file_path) as f:
+                lines = f.readlines()
+                if len(lines) == 3:
+                    text = lines[2]  # read only the body of the document
+                else:
+                    text = ' '.join(lines)
+        sent_tokenize_list = sent_tokenize(text)
+        self.metrics.count('sentences_lemmatized', len(sent_tokenize_list))
+        terms_pos = []
+        for sentence in sent_tokenize_list:
+            l_sent = self.lemmatize_text(sentence, language)
+            pos = self.get_positions(l_query, l_sent)
+            terms_pos.append(pos)
+        best = self.get_n_best_sentences(terms_pos, n)
+        return self.get_text(sent_tokenize_list, best)
 
 
     def get_snippets(self, retrievals, query):
@@ -592,3 +1972,34 @@ class SkyScanner:
                 snippet = self.get_snippet(file_path, l_query)
                 snippets.append(snippet)
         return snippets
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Builds the SkyScanner models')
+    parser.add_argument('--project-dir', default='/home/peregfe/projects/Entrepreneur')
+    parser.add_argument('--model', default='lsi', choices=['lsi', 'tfidf', 'bm25'])
+    parser.add_argument('--num-topics', type=int, default=100)
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(), help='processes used to build the models')
+    parser.add_argument('--retrain', action='store_true', help='rebuild the models from scratch even if the saved ones are valid')
+    parser.add_argument('--add', nargs='+', metavar='LEMMA_FILE', help='add these lemma files to the saved model')
+    parser.add_argument('--language', default='english', choices=['english', 'spanish'], help='language of the files given with --add')
+    parser.add_argument('--lsi-chunksize', type=int, default=20000, help='documents decomposed at once by the LSI training')
+    parser.add_argument('--lsi-power-iters', type=int, default=2, help='power iterations of the randomized SVD')
+    parser.add_argument('--lsi-extra-samples', type=int, default=100, help='samples taken besides the topics by the randomized SVD')
+    parser.add_argument('--lsi-multipass', action='store_true', help='train the LSI model with the multi-pass randomized algorithm')
+    parser.add_argument('--lsi-workers', type=int, default=1, help='processes which decompose the corpus (one-pass algorithm only)')
+    parser.add_argument('--lsi-index', default='matrix', choices=['matrix', 'sharded'], help='how the LSI vectors are stored')
+    parser.add_argument('--lsi-shard-size', type=int, default=32768, help='documents of each shard of the sharded LSI index')
+    args = parser.parse_args()
+    se = SkyScanner(project_dir=args.project_dir, num_topics=args.num_topics, model_name=args.model,
+                    use_saved_models=not args.retrain, check_corpus=not args.add, processes=args.processes, lsi_chunksize=args.lsi_chunksize,
+                    lsi_power_iters=args.lsi_power_iters, lsi_extra_samples=args.lsi_extra_samples,
+                    lsi_onepass=not args.lsi_multipass, lsi_workers=args.lsi_workers, lsi_index=args.lsi_index,
+                    lsi_shard_size=args.lsi_shard_size)
+    if args.add:
+        se.add_documents(args.language, args.add)
+    for language, stats in se.build_stats.items():
+        print('Built the %s model in %.1fs (corpus %.1fs, model %.1fs), peak memory %.0fMB (workers %.0fMB)'
+              % (language, stats['total_s'], stats['corpus_s'], stats['model_s'], stats['peak_rss_mb'],
+                 stats['workers_peak_rss_mb']))
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+
+'''
+Approximate nearest neighbour index for the LSI vectors (IVF-PQ, written with NumPy).
+
+The unit vectors of the documents are clustered with k-means in nlist lists (the inverted file), and the
+residual of each vector to the centroid of its list is compressed with product quantization: the dimensions
+are split in m groups and each group is replaced by the byte of its nearest sub-centroid. A query only scans
+the nprobe lists whose centroids are the closest to it, scoring their documents with lookup tables
+(q . v ~ q . centroid + sum of q_j . subcentroid_j), and the best rerank candidates are scored again with
+their exact vectors, so only those rows of the (memory-mapped) exact index are read.
+
+nprobe and rerank trade recall for latency: nprobe = nlist and rerank >= number of documents give the exact
+results.
+'''
+
+import numpy
+
+
+def kmeans(data, k, iterations=20, seed=0, batch_size=65536):
+    '''
+    It clusters the given vectors with Lloyd's algorithm (euclidean distance)
+    :param data: Numpy array (n x d) with the vectors
+    :param k: Integer with the number of clusters
+    :param iterations: Integer with the number of iterations
+    :param seed: Integer with the random seed used to choose the initial centroids
+    :param batch_size: Integer with the number of vectors assigned at once, to bound the memory
+    :return: Numpy array (k x d) with the centroids
+    '''
+    rnd = numpy.random.RandomState(seed)
+    centroids = data[rnd.choice(len(data), k, replace=False)].astype(numpy.float32)
+    for _ in range(iterations):
+        labels = assign(data, centroids, batch_size)
+        sums = numpy.stack([numpy.bincount(labels, weights=data[:, j], minlength=k) for j in range(data.shape[1])], axis=1)
+        counts = numpy.bincount(labels, minlength=k)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():  # the empty clusters are moved to random vectors
+            centroids[empty] = data[rnd.choice(len(data), int(empty.sum()), replace=False)]
+    return centroids
+
+
+def assign(data, centroids, batch_size=65536):
+    '''
+    It gets the nearest centroid of each vector
+    :return: Numpy array with the position of the nearest centroid of each vector
+    '''
+    sq_norms = (centroids ** 2).sum(axis=1)
+    labels = numpy.empty(len(data), dtype=numpy.int64)
+    for start in range(0, len(data), batch_size):
+        batch = data[start:start + batch_size]
+        labels[start:start + batch_size] = numpy.argmin(sq_norms - 2 * batch.dot(centroids.T), axis=1)
+    return labels
+
+
+class IVFPQIndex:
+    '''
+    Inverted file of product-quantized vectors, scored by inner product
+    '''
+
+    def __init__(self, nlist=None, m=None, nprobe=16, rerank=100, seed=0):
+        '''
+        Class contructor
+        :param nlist: Integer with the number of lists (4 * sqrt(number of documents) by default)
+        :param m: Integer with the number of bytes of each compressed vector (a quarter of the dimensions by default)
+        :param nprobe: Integer with the number of lists scanned by a query
+        :param rerank: Integer with the number of candidates scored with their exact vectors
+        :param seed: Integer with the random seed of k-means
+        '''
+        self.nlist = nlist
+        self.m = m
+        self.nprobe = nprobe
+        self.rerank = rerank
+        self.seed = seed
+        self.centroids = None
+        self.codebooks = None
+        self.groups = None
+        self.lists = []
+        self.codes = []
+        self.size = 0
+
+
+    def __len__(self):
+        return self.size
+
+
+    def train(self, vectors, sample_size=100000):
+        '''
+        It learns the coarse centroids and the codebooks of the residuals, and adds the given vectors
+        :param vectors: Numpy array (documents x topics) with the unit vectors of the documents
+        :param sample_size: Integer with the maximum number of vectors used to learn the centroids
+        :return: self
+        '''
+        vectors = numpy.asarray(vectors, dtype=numpy.float32)
+        n, d = vectors.shape
+        if not self.nlist:
+            self.nlist = int(4 * numpy.sqrt(n))
+        self.nlist = max(1, min(self.nlist, n))
+        if not self.m:
+            self.m = max(1, d // 4)
+        self.m = max(1, min(self.m, d))
+        self.groups = numpy.array_split(numpy.arange(d), self.m)
+
+        rnd = numpy.random.RandomState(self.seed)
+        sample = vectors[rnd.choice(n, sample_size, replace=False)] if n > sample_size else vectors
+        self.centroids = kmeans(sample, self.nlist, seed=self.seed)
+        # 64 vectors per sub-centroid are enough to learn the codebooks
+        residuals = sample[:64 * 256] - self.centroids[assign(sample[:64 * 256], self.centroids)]
+        ksub = min(256, len(residuals))
+        self.codebooks = [kmeans(numpy.ascontiguousarray(residuals[:, group]), ksub, iterations=10, seed=self.seed)
+                          for group in self.groups]
+
+        self.lists = [numpy.empty(0, dtype=numpy.int32) for _ in range(self.nlist)]
+        self.codes = [numpy.empty((0, self.m), dtype=numpy.uint8) for _ in range(self.nlist)]
+        self.size = 0
+        self.add(vectors)
+        return self
+
+
+    def add(self, vectors):
+        '''
+        It appends the given vectors to the index, with the next document identifiers. The centroids are not updated
+        :param vectors: Numpy array (documents x topics) with the unit vectors of the new documents
+        :return: None
+        '''
+        vectors = numpy.asarray(vectors, dtype=numpy.float32)
+        if len(vectors) == 0:
+            return
+        labels = assign(vectors, self.centroids)
+        residuals = vectors - self.centroids[labels]
+        codes = numpy.empty((len(vectors), self.m), dtype=numpy.uint8)
+        for j, group in enumerate(self.groups):
+            codes[:, j] = assign(residuals[:, group], self.codebooks[j])
+        ids = numpy.arange(self.size, self.size + len(vectors), dtype=numpy.int32)
+        order = numpy.argsort(labels, kind='stable')
+        bounds = numpy.searchsorted(labels[order], numpy.arange(self.nlist + 1))
+        for l in range(self.nlist):
+            chosen = order[bounds[l]:bounds[l + 1]]
+            if len(chosen):
+                self.lists[l] = numpy.concatenate([self.lists[l], ids[chosen]])
+                self.codes[l] = numpy.vstack([self.codes[l], codes[chosen]])
+        self.size += len(vectors)
+
+
+    def search(self, query, top_k, vectors=None, nprobe=None, rerank=None):
+        '''
+        It gets the documents whose vectors have the highest inner product with the query
+        :param query: Numpy array with the unit vector of the query
+        :param top_k: Integer with the number of documents to retrieve
+        :param vectors: Numpy array (documents x topics) with the exact vectors, used to rerank the candidates.
+        If it is None, the approximate scores are returned
+        :param nprobe: Integer with the number of lists to scan (self.nprobe by default)
+        :param rerank: Integer with the number of candidates to rerank (self.rerank by default)
+        :return: Numpy arrays with the identifiers and the scores of the documents, sorted by score
+        '''
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        rerank = max(rerank or self.rerank, top_k)
+        query = numpy.asarray(query, dtype=numpy.float32)
+        coarse = self.centroids.dot(query)
+        probes = numpy.argpartition(-coarse, nprobe - 1)[:nprobe] if nprobe < self.nlist else numpy.arange(self.nlist)
+        probes = [l for l in probes if len(self.lists[l])]
+        if top_k <= 0 or not probes:
+            return numpy.empty(0, dtype=numpy.int32), numpy.empty(0, dtype=numpy.float32)
+
+        # lookup table with the inner product of each part of the query with each sub-centroid
+        tables = numpy.stack([numpy.pad(codebook.dot(query[group]), (0, 256 - len(codebook)))
+                              for group, codebook in zip(self.groups, self.codebooks)])
+        ids = numpy.concatenate([self.lists[l] for l in probes])
+        codes = numpy.vstack([self.codes[l] for l in probes])
+        scores = numpy.repeat(coarse[probes], [len(self.lists[l]) for l in probes])
+        scores += tables[numpy.arange(self.m), codes].sum(axis=1)
+
+        if len(ids) > rerank:
+            best = numpy.argpartition(-scores, rerank - 1)[:rerank]
+            ids, scores = ids[best], scores[best]
+        if vectors is not None:
+            ids = numpy.sort(ids)  # the rows are read in order from the memory-mapped index
+            scores = numpy.asarray(vectors[ids]).dot(query.astype(vectors.dtype))
+        order = numpy.argsort(-scores, kind='stable')[:top_k]
+        return ids[order], scores[order]
+
+
+    def save(self, file_path):
+        '''
+        It saves the index in a NumPy .npz file
+        :param file_path: String with the path of the file
+        :return: None
+        '''
+        sizes = numpy.array([len(ids) for ids in self.lists], dtype=numpy.int64)
+        with open(file_path, 'wb') as f:
+            numpy.savez(f,
+                        params=numpy.array([self.nlist, self.m, self.nprobe, self.rerank, self.seed, self.size]),
+                        group_sizes=numpy.array([len(group) for group in self.groups]),
+                        centroids=self.centroids,
+                        codebooks=numpy.concatenate(self.codebooks, axis=1),
+                        sizes=sizes,
+                        ids=numpy.concatenate(self.lists),
+                        codes=numpy.vstack(self.codes))
+
+
+    @staticmethod
+    def load(file_path):
+        '''
+        It loads an index saved with save
+        :param file_path: String with the path of the file
+        :return: IVFPQIndex
+        '''
+        with numpy.load(file_path) as data:
+            nlist, m, nprobe, rerank, seed, size = [int(value) for value in data['params']]
+            index = IVFPQIndex(nlist, m, nprobe, rerank, seed)
+            bounds = numpy.cumsum(data['group_sizes'])
+            index.groups = numpy.split(numpy.arange(bounds[-1]), bounds[:-1])
+            index.centroids = data['centroids']
+            index.codebooks = numpy.split(data['codebooks'], bounds[:-1], axis=1)
+            starts = numpy.concatenate([[0], numpy.cumsum(data['sizes'])])
+            ids, codes = data['ids'], data['codes']
+            index.lists = [ids[starts[l]:starts[l + 1]] for l in range(nlist)]
+            index.codes = [codes[starts[l]:starts[l + 1]] for l in range(nlist)]
+            index.size = size
+        return index
@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+
+'''
+Benchmark of SkyScanner over a synthetic bilingual corpus, with a local FreeLing stub (freeling_stub.py),
+so it does not need the original corpus nor the FreeLing servers (NLTK's stopwords and punkt data are needed).
+
+For each corpus size and model name, it measures:
+    build: time to build the models from scratch
+    startup: time to load the saved models
+    query: latency of run_query with top_k (mean, p50, p99)
+    batch: throughput of run_queries
+    snippets: time of get_results (titles and snippets of the top 10 documents)
+    pruning (bm25): documents scored, postings visited and latency of the top 10 with and without MaxScore
+    segment (tfidf, bm25): size of the postings segment of each language, time to open it and decode speed
+    ann (with --ann-nprobe): recall@10 and latency of the approximate LSI index for each nprobe, against the
+    exact results of MatrixSimilarity
+    lsi_training (with --lsi-configs): build time and peak memory of the LSI model with each training configuration,
+    each one built in a new process so its peak is not the one of the previous builds
+The results are written as JSON, so different runs can be compared.
+
+python benchmark.py --docs 1000 10000 --models lsi tfidf --output bench.json
+python benchmark.py --docs 100000 --models lsi --ann-nprobe 1 4 16 64
+python benchmark.py --docs 100000 --models lsi --lsi-configs workers=1 workers=4,index=sharded onepass=0,power_iters=4
+'''
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import tempfile
+import time
+from os.path import join
+from freeling_stub import FreeLingStub
+from SkyScanner import SkyScanner
+from segment import segment_stats
+
+
+STOPWORDS = {'en': ['the', 'of', 'and', 'to', 'in', 'a'],
+             'es': ['el', 'de', 'la', 'que', 'y', 'en']}
+
+
+def zipf_vocabulary(language, size, seed):
+    '''
+    It builds a vocabulary of synthetic lemmas and their cumulative Zipf weights
+    :param language: String with the ISO code of the language, used as prefix of the lemmas
+    :param size: Integer with the number of lemmas
+    :param seed: Integer with the random seed
+    :return: List of lemmas and list of cumulative weights
+    '''
+    lemmas = ['%s%d' % (language, i) for i in range(size)]
+    random.Random(seed).shuffle(lemmas)
+    weights = []
+    total = 0.0
+    for rank in range(1, size + 1):
+        total += 1.0 / rank
+        weights.append(total)
+    return lemmas, weights
+
+
+def generate_corpus(project_dir, num_docs, vocabulary_size=50000, doc_length=(50, 400), seed=0):
+    '''
+    It writes a synthetic corpus in the layout SkyScanner expects: data/lemmas/<language> with the lemmas of
+    each document in one line, and data/documents/<language>/article with the title, the intro and the body
+    :param project_dir: String with the directory where the corpus is written
+    :param num_docs: Integer with the number of documents of each language
+    :param vocabulary_size: Integer with the number of lemmas of each language
+    :param doc_length: Tuple with the minimum and maximum number of terms of a document
+    :param seed: Integer with the random seed
+    :return: dictionary with the vocabulary (lemmas, cumulative weights) of each language
+    '''
+    rnd = random.Random(seed)
+    vocabularies = {}
+    for language in ('en', 'es'):
+        lemmas, weights = vocabularies[language] = zipf_vocabulary(language, vocabulary_size, seed)
+        lemmas_dir = join(project_dir, 'data/lemmas', language)
+        documents_dir = join(project_dir, 'data/documents', language, 'article')
+        os.makedirs(lemmas_dir, exist_ok=True)
+        os.makedirs(documents_dir, exist_ok=True)
+        for i in range(num_docs):
+            terms = rnd.choices(lemmas, cum_weights=weights, k=rnd.randint(*doc_length))
+            terms += rnd.choices(STOPWORDS[language], k=len(terms) // 5)
+            rnd.shuffle(terms)
+            sentences = [' '.join(terms[j:j + 15]).capitalize() + '.' for j in range(0, len(terms), 15)]
+            doc_name = 'doc-%d.txt' % i
+            with open(join(lemmas_dir, doc_name), 'w') as f:
+                f.write(' '.join(terms) + ' .' * len(sentences))
+            with open(join(documents_dir, doc_name), 'w') as f:
+                f.write('Document %d\n%s\n%s' % (i, sentences[0], ' '.join(sentences)))
+    return vocabularies
+
+
+def generate_queries(vocabularies, num_queries, seed=1):
+    '''
+    It builds random queries of 1 to 4 lemmas, half of them in each language
+    :return: List of strings with the queries
+    '''
+    rnd = random.Random(seed)
+    queries = []
+    for i in range(num_queries):
+        language = ('en', 'es')[i % 2]
+        lemmas, weights = vocabularies[language]
+        terms = rnd.choices(lemmas[:2000], k=rnd.randint(1, 4))
+        queries.append(' '.join([rnd.choice(STOPWORDS[language])] + terms))
+    return queries
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def latency_stats(values):
+    return {'mean_ms': 1000.0 * sum(values) / len(values),
+            'p50_ms': 1000.0 * percentile(values, 50),
+            'p99_ms': 1000.0 * percentile(values, 99),
+            'count': len(values)}
+
+
+def run_scenarios(project_dir, model_name, queries, params):
+    '''
+    It runs all the timed scenarios for one model
+    :param project_dir: String with the directory of the corpus
+    :param model_name: String with one of these values: 'lsi', 'tfidf' or 'bm25'
+    :param queries: List of strings with the queries
+    :param params: dictionary with other parameters for the SkyScanner constructor
+    :return: dictionary with the results of each scenario
+    '''
+    results = {}
+    start = time.perf_counter()
+    SkyScanner(project_dir=project_dir, model_name=model_name, use_saved_models=False, **params)
+    results['build_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    se = SkyScanner(project_dir=project_dir, model_name=model_name, **params)
+    results['startup_s'] = time.perf_counter() - start
+
+    latencies = []
+    snippets = []
+    for query in queries:
+        start = time.perf_counter()
+        sims = se.run_query(query, top_k=10)
+        latencies.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        se.get_results(sims, query, se.language)
+        snippets.append(time.perf_counter() - start)
+    results['query'] = latency_stats(latencies)
+    results['snippets'] = latency_stats(snippets)
+
+    start = time.perf_counter()
+    se.run_queries(queries, top_k=10)
+    elapsed = time.perf_counter() - start
+    results['batch'] = {'queries': len(queries), 'total_s': elapsed, 'queries_per_s': len(queries) / elapsed}
+    if model_name == 'bm25':
+        results['pruning'] = run_pruning(se, queries)
+    if model_name in ('tfidf', 'bm25'):
+        results['segment'] = {language: segment_stats(join(se.get_model_dir(language), model_name + '.seg'))
+                              for language in se.model}
+    return results
+
+
+def run_pruning(se, queries, top_k=10):
+    '''
+    It compares the BM25 top_k queries with and without MaxScore pruning
+    :param se: SkyScanner with the BM25 model loaded
+    :param queries: List of strings with the queries
+    :param top_k: Integer with the number of documents retrieved by each query
+    :return: dictionary with the documents scored, the postings visited and the latency of each mode
+    '''
+    cleaned = []
+    for query in queries:
+        language = se.guess_language(query)
+        cleaned.append((language, se.clean_lemmatized_query(se.lemmatize_text(query, language), language)))
+    results = {}
+    for mode, prune in (('exhaustive', False), ('maxscore', True)):
+        latencies = []
+        scored = postings = 0
+        for language, query in cleaned:
+            stats = {}
+            start = time.perf_counter()
+            se.model[language].top_k(query, top_k, 0.0, prune, stats)
+            latencies.append(time.perf_counter() - start)
+            scored += stats['scored']
+            postings += stats['postings']
+        results[mode] = dict(latency_stats(latencies), docs_scored_per_query=scored / float(len(cleaned)),
+                             postings_per_query=postings / float(len(cleaned)))
+    results['docs_scored_ratio'] = (results['maxscore']['docs_scored_per_query']
+                                    / max(1e-9, results['exhaustive']['docs_scored_per_query']))
+    return results
+
+
+def run_ann_recall(project_dir, queries, params, nprobes, top_k=10):
+    '''
+    It measures the recall and the latency of the approximate nearest neighbour index of the LSI model
+    :param project_dir: String with the directory of the corpus
+    :param queries: List of strings with the queries
+    :param params: dictionary with other parameters for the SkyScanner constructor
+    :param nprobes: List with the number of lists scanned by the queries in each measure
+    :param top_k: Integer with the number of documents retrieved by each query
+    :return: dictionary with the results of the exact search and of each nprobe
+    '''
+    start = time.perf_counter()
+    se = SkyScanner(project_dir=project_dir, model_name='lsi', ann=True, **params)
+    results = {'startup_s': time.perf_counter() - start,
+               'nlist': {language: index.nlist for language, index in se.ann.items()}}
+
+    def measure():
+        latencies = []
+        sims = []
+        for query in queries:
+            start = time.perf_counter()
+            sims.append([doc for doc, score in se.run_query(query, top_k=top_k, min_score=-1.0)])
+            latencies.append(time.perf_counter() - start)
+        return sims, latency_stats(latencies)
+
+    ann, se.ann = se.ann, {}
+    exact, results['exact'] = measure()
+    se.ann = ann
+    for nprobe in nprobes:
+        se.ann_nprobe = nprobe
+        approximate, stats = measure()
+        hits = sum(len(set(a) & set(e)) for a, e in zip(approximate, exact))
+        stats['recall'] = hits / float(max(1, sum(len(e) for e in exact)))
+        results['nprobe_%d' % nprobe] = stats
+    return results
+
+
+def parse_lsi_config(text):
+    '''
+    It parses a LSI training configuration: comma-separated key=value pairs with the lsi_* parameters of the
+    SkyScanner constructor without the prefix, e.g. "workers=4,chunksize=5000,index=sharded"
+    :param text: String with the configuration
+    :return: dictionary with the parameters
+    '''
+    config = {}
+    for item in text.split(','):
+        key, value = item.split('=')
+        if key == 'index':
+            config['lsi_index'] = value
+        elif key == 'onepass':
+            config['lsi_onepass'] = value.lower() in ('1', 'true', 'yes')
+        elif key in ('chunksize', 'power_iters', 'extra_samples', 'workers', 'shard_size'):
+            config['lsi_' + key] = int(value)
+        else:
+            raise ValueError('Unknown LSI training parameter: ' + key)
+    return config
+
+
+def build_lsi_config(project_dir, params, queue):
+    '''
+    It builds the LSI models from scratch and sends their build stats. It is run in its own process by run_lsi_training
+    :param project_dir: String with the directory of the corpus
+    :param params: dictionary with the parameters for the SkyScanner constructor
+    :param queue: multiprocessing.Queue where the results are sent
+    :return: None
+    '''
+    start = time.perf_counter()
+    se = SkyScanner(project_dir=project_dir, model_name='lsi', use_saved_models=False, **params)
+    queue.put({'build_s': time.perf_counter() - start,
+               'languages': se.build_stats,  # empty when each language is built by its own process
+               'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2.0 ** 10,
+               'workers_peak_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 2.0 ** 10})
+
+
+def run_lsi_training(project_dir, params, configs):
+    '''
+    It measures the build time and the peak memory of the LSI models with several training configurations
+    :param project_dir: String with the directory of the corpus
+    :param params: dictionary with other parameters for the SkyScanner constructor
+    :param configs: List of strings with the configurations (see parse_lsi_config)
+    :return: List with the results of each configuration
+    '''
+    results = []
+    for text in configs:
+        print('Building the LSI models with %s...' % text)
+        queue = multiprocessing.Queue()
+        builder = multiprocessing.Process(target=build_lsi_config,
+                                          args=(project_dir, dict(params, **parse_lsi_config(text)), queue))
+        builder.start()
+        result = queue.get()
+        builder.join()
+        results.append(dict(result, config=text))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SkyScanner benchmark over a synthetic corpus')
+    parser.add_argument('--docs', type=int, nargs='+', default=[1000], help='documents per language of each corpus')
+    parser.add_argument('--models', nargs='+', default=['lsi', 'tfidf'], choices=['lsi', 'tfidf', 'bm25'])
+    parser.add_argument('--vocabulary', type=int, default=50000, help='lemmas per language')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--num-topics', type=int, default=100)
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--shards', type=int, default=1, help='shards of each model, searched in parallel')
+    parser.add_argument('--ann-nprobe', type=int, nargs='*', default=[],
+                        help='measure the recall of the approximate LSI index scanning these numbers of lists')
+    parser.add_argument('--lsi-configs', nargs='*', default=[],
+                        help='measure the LSI build with these training configurations, e.g. workers=4,index=sharded')
+    parser.add_argument('--work-dir', help='directory where the corpora are generated (a temporary one by default)')
+    parser.add_argument('--keep', action='store_true', help='do not delete the generated corpora')
+    parser.add_argument('--output', default='bench_output.json')
+    args = parser.parse_args()
+    for text in args.lsi_configs:
+        try:
+            parse_lsi_config(text)
+        except ValueError:
+            parser.error('invalid LSI training configuration: ' + text)
+
+    stubs = {'english': FreeLingStub().start(), 'spanish': FreeLingStub().start()}
+    params = {'num_topics': args.num_topics,
+              'processes': args.processes,
+              'shards': args.shards,
+              'cache_size': 0,  # every query pays its whole cost
+              'threshold': 0.0,  # so every query renders its 10 results
+              'freeling_ports': {language: stub.port for language, stub in stubs.items()}}
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='skyscanner-bench-')
+    report = {'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python': platform.python_version(),
+              'machine': platform.machine(),
+              'cpus': os.cpu_count(),
+              'params': {'vocabulary': args.vocabulary, 'queries': args.queries,
+                         'num_topics': args.num_topics, 'processes': args.processes, 'shards': args.shards,
+                         'ann_nprobe': args.ann_nprobe, 'lsi_configs': args.lsi_configs},
+              'runs': []}
+    try:
+        for num_docs in args.docs:
+            project_dir = join(work_dir, 'corpus-%d' % num_docs)
+            print('Generating a corpus of %d documents per language in %s...' % (num_docs, project_dir))
+            start = time.perf_counter()
+            vocabularies = generate_corpus(project_dir, num_docs, args.vocabulary)
+            generation = time.perf_counter() - start
+            queries = generate_queries(vocabularies, args.queries)
+            for model_name in args.models:
+                print('Benchmarking %s over %d documents...' % (model_name, num_docs))
+                run = {'docs_per_language': num_docs, 'model_name': model_name, 'generation_s': generation}
+                run.update(run_scenarios(project_dir, model_name, queries, params))
+                if model_name == 'lsi' and args.ann_nprobe:
+                    print('Measuring the recall of the approximate index over %d documents...' % num_docs)
+                    run['ann'] = run_ann_recall(project_dir, queries, params, args.ann_nprobe)
+                if model_name == 'lsi' and args.lsi_configs:
+                    run['lsi_training'] = run_lsi_training(project_dir, params, args.lsi_configs)
+                report['runs'].append(run)
+            if not args.keep:
+                shutil.rmtree(project_dir)
+    finally:
+        for stub in stubs.values():
+            stub.stop()
+        if not args.keep and not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('Results written to ' + args.output)
+
+
+if __name__ == '__main__':
+    main()
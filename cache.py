@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+'''
+Bounded cache with LRU eviction and an optional time to live, used by SkyScanner to avoid
+lemmatizing the same queries, scoring them and building their snippets again.
+'''
+
+import collections
+import threading
+import time
+
+
+class LRUCache:
+    '''
+    Thread safe least recently used cache. The entries older than ttl seconds are treated as missing
+    '''
+
+    def __init__(self, maxsize=1024, ttl=None):
+        '''
+        Class contructor
+        :param maxsize: Integer with the maximum number of entries (0 disables the cache)
+        :param ttl: Float with the seconds an entry is valid (None to keep the entries until they are evicted)
+        '''
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+
+    def get(self, key, default=None):
+        '''
+        It gets the value of the given key, marking it as the most recently used
+        :param key: The key of the entry
+        :param default: The value returned when the key is not in the cache or it has expired
+        :return: The cached value or default
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and (self.ttl is None or time.monotonic() - entry[0] < self.ttl):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return default
+
+
+    def put(self, key, value):
+        '''
+        It stores the given value, evicting the least recently used entry if the cache is full
+        :param key: The key of the entry
+        :param value: The value to be cached
+        :return: None
+        '''
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+    def stats(self):
+        '''
+        It gives the cache counters
+        :return: dictionary with the number of entries, hits and misses
+        '''
+        with self.lock:
+            return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+'''
+Per language store with the metadata of every document of the model, built at index time, so the results
+can be rendered without opening the articles nor guessing their paths and urls.
+
+A store directory has two files:
+    docs.dat: the UTF-8 fields of all the documents (name, url, title, path and body), one after the other
+    docs.idx: a record of six little-endian int64 per document, with the offset where each field starts
+    in docs.dat plus the offset where the last one ends
+Both files are memory-mapped. The document identifiers are the positions of the documents in the model.
+'''
+
+import mmap
+import struct
+from os import makedirs
+from os.path import join, isfile
+
+
+FIELDS = ('name', 'url', 'title', 'path', 'body')
+RECORD = struct.Struct('<%dq' % (len(FIELDS) + 1))
+
+
+class DocumentStoreWriter:
+    '''
+    It writes the documents of a store, one at a time
+    '''
+
+    def __init__(self, store_dir, append=False):
+        '''
+        Class contructor
+        :param store_dir: String with the directory where the store is written
+        :param append: Boolean variable that tells whether the documents are added to the existing store
+        '''
+        makedirs(store_dir, exist_ok=True)
+        mode = 'ab' if append else 'wb'
+        self.data_file = open(join(store_dir, 'docs.dat'), mode)
+        self.index_file = open(join(store_dir, 'docs.idx'), mode)
+        self.offset = self.data_file.tell()
+
+
+    def add_document(self, name, url, title, path, body):
+        '''
+        It appends a document to the store
+        :return: None
+        '''
+        offsets = []
+        for field in (name, url, title, path, body):
+            offsets.append(self.offset)
+            data = field.encode('utf-8')
+            self.data_file.write(data)
+            self.offset += len(data)
+        offsets.append(self.offset)
+        self.index_file.write(RECORD.pack(*offsets))
+
+
+    def close(self):
+        self.data_file.close()
+        self.index_file.close()
+
+
+class DocumentStore:
+    '''
+    Memory-mapped reader of a document store
+    '''
+
+    def __init__(self, store_dir, language):
+        '''
+        Class contructor
+        :param store_dir: String with the directory where the store is
+        :param language: String with the language of the documents
+        '''
+        self.store_dir = store_dir
+        self.language = language
+        self.data = self.map_file('docs.dat')
+        self.index = self.map_file('docs.idx')
+        self.size = len(self.index) // RECORD.size
+        self.names = None
+
+
+    def map_file(self, file_name):
+        with open(join(self.store_dir, file_name), 'rb') as f:
+            try:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty files can not be mapped
+                return b''
+
+
+    @staticmethod
+    def exists(store_dir):
+        return isfile(join(store_dir, 'docs.idx')) and isfile(join(store_dir, 'docs.dat'))
+
+
+    def __len__(self):
+        return self.size
+
+
+    def get_field(self, doc, field):
+        '''
+        It reads one field of a document
+        :param doc: Integer with the document identifier
+        :param field: String with one of the FIELDS
+        :return: String with the value of the field
+        '''
+        i = FIELDS.index(field)
+        offsets = RECORD.unpack_from(self.index, doc * RECORD.size)
+        return self.data[offsets[i]:offsets[i + 1]].decode('utf-8')
+
+
+    def get(self, doc, body=False):
+        '''
+        It reads the metadata of a document
+        :param doc: Integer with the document identifier
+        :param body: Boolean variable that tells whether the body of the document is read too
+        :return: dictionary with the name, url, title, path, language (and body) of the document
+        '''
+        offsets = RECORD.unpack_from(self.index, doc * RECORD.size)
+        fields = FIELDS if body else FIELDS[:-1]
+        meta = {field: self.data[offsets[i]:offsets[i + 1]].decode('utf-8') for i, field in enumerate(fields)}
+        meta['language'] = self.language
+        return meta
+
+
+    def find(self, name):
+        '''
+        It gets the identifier of the document with the given name. The table of names is built the first time
+        :param name: String with the name of the document file
+        :return: Integer with the document identifier or None
+        '''
+        if self.names is None:
+            self.names = {self.get_field(doc, 'name'): doc for doc in range(self.size)}
+        return self.names.get(name)
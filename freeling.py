@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+
+'''
+Persistent client for the FreeLing analyzer server (analyze -f es.cfg --server --port 50005 &).
+It speaks the same socket protocol as analyzer_client, but keeps a pool of open connections
+so a text can be analyzed without spawning a shell and a new process each time.
+The server reads a single message at a time and drops whatever follows it in the same read, so a connection
+never sends a message until the response of the previous one has arrived. Several texts are analyzed
+in parallel over several connections of the pool.
+'''
+
+import socket
+import threading
+import queue
+
+
+SERVER_READY = 'FL-SERVER-READY'
+DEFAULT_TIMEOUT = 60.0  # seconds, a server which lost a message never answers it
+RESET_STATS = 'RESET_STATS'
+FLUSH_BUFFER = 'FLUSH_BUFFER'
+
+
+def parse_line(line):
+    '''
+    It gets the lemma of a line of the FreeLing output (form lemma tag probability)
+    :param line: String with the line
+    :return: A string with the lemma, or None if the line is not a token
+    '''
+    part = line.split()
+    if len(part) == 4:
+        if part[2] == 'W':  # when it is a date, we take the date as it is
+            return part[0]
+        return part[1]
+    return None
+
+
+def parse_lemmas(output):
+    '''
+    It gets all the lemmas from the FreeLing output (one token per line: form lemma tag probability)
+    :param output: String with the FreeLing output
+    :return: A string with the lemmas separated by spaces
+    '''
+    lemmas = [parse_line(line) for line in output.split('\n')]
+    return ' '.join(lemma for lemma in lemmas if lemma is not None)
+
+
+class FreeLingConnection:
+    '''
+    A single socket connected to a FreeLing server. Every message is a string ended by a zero byte.
+    '''
+
+    def __init__(self, host, port, timeout=DEFAULT_TIMEOUT):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.buffer = b''
+        self.send(RESET_STATS)
+        self.receive()
+
+
+    def send(self, message):
+        '''
+        It sends a message to the server
+        :param message: String with the message
+        :return: None
+        '''
+        self.sock.sendall(message.encode('utf-8') + b'\0')
+
+
+    def receive(self):
+        '''
+        It reads the next message sent by the server
+        :return: String with the message
+        '''
+        while b'\0' not in self.buffer:
+            data = self.sock.recv(65536)
+            if not data:
+                raise ConnectionError('FreeLing server closed the connection')
+            self.buffer += data
+        message, self.buffer = self.buffer.split(b'\0', 1)
+        return message.decode('utf-8', errors='replace')
+
+
+    def analyze(self, text):
+        '''
+        It sends the given text to the server line by line, the same way analyzer_client does
+        :param text: String with the text to be analyzed
+        :return: String with the FreeLing output
+        '''
+        output = []
+        for line in text.split('\n') + [FLUSH_BUFFER]:
+            self.send(line if line else FLUSH_BUFFER)
+            response = self.receive()
+            if response != SERVER_READY:
+                output.append(response)
+        return ''.join(output)
+
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class FreeLingClient:
+    '''
+    Thread safe pool of persistent connections to one FreeLing server
+    '''
+
+    def __init__(self, port, host='localhost', pool_size=4, timeout=DEFAULT_TIMEOUT):
+        '''
+        Class contructor
+        :param port: Integer with the port where the FreeLing server is listening
+        :param host: String with the host where the FreeLing server is running
+        :param pool_size: Integer with the maximum number of connections opened at the same time
+        :param timeout: Float with the seconds to wait for the server (None to wait forever)
+        '''
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.idle = queue.LifoQueue()
+        self.opened = 0
+        self.lock = threading.Lock()
+
+
+    def acquire(self):
+        '''
+        It takes an idle connection from the pool, opening a new one if the pool is not full yet
+        :return: A FreeLingConnection
+        '''
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            can_open = self.opened < self.pool_size
+            if can_open:
+                self.opened += 1
+        if not can_open:
+            return self.idle.get()
+        try:
+            return FreeLingConnection(self.host, self.port, self.timeout)
+        except OSError:
+            with self.lock:
+                self.opened -= 1
+            raise
+
+
+    def release(self, connection):
+        self.idle.put(connection)
+
+
+    def discard(self, connection):
+        connection.close()
+        with self.lock:
+            self.opened -= 1
+
+
+    def analyze(self, text):
+        '''
+        It gets the raw FreeLing output of the given text.
+        If the connection is broken it is retried once with a new one
+        :param text: String with the text to be analyzed
+        :return: String with the FreeLing output
+        '''
+        for attempt in range(2):
+            connection = self.acquire()
+            try:
+                output = connection.analyze(text)
+            except OSError:
+                self.discard(connection)
+                if attempt == 1:
+                    raise
+                continue
+            self.release(connection)
+            return output
+
+
+    def analyze_many(self, texts):
+        '''
+        It gets the raw FreeLing output of several texts, spread over up to pool_size connections which analyze
+        them at the same time (each one a text after another). Each text is retried once as in analyze, and the first
+        error of any connection is raised once all of them have finished
+        :param texts: List of strings with the texts to be analyzed
+        :return: List of strings with the FreeLing output of each text
+        '''
+        outputs = [None] * len(texts)
+        num_workers = min(self.pool_size, len(texts))
+        if num_workers < 2:
+            return [self.analyze(text) for text in texts]
+        errors = []
+
+        def work(worker):
+            try:
+                for i in range(worker, len(texts), num_workers):
+                    outputs[i] = self.analyze(texts[i])
+            except Exception as e:  # raised by this thread after the join, not only the broken connections
+                errors.append(e)
+
+        workers = [threading.Thread(target=work, args=(worker,), daemon=True) for worker in range(num_workers)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        if errors:
+            raise errors[0]
+        return outputs
+
+
+    def lemmatize_many(self, texts):
+        '''
+        It gets all the lemmas of several texts, analyzed in parallel by the connections of the pool
+        :param texts: List of strings with the texts to be lemmatized
+        :return: List of strings with each text lemmatized
+        '''
+        return [parse_lemmas(output) for output in self.analyze_many(texts)]
+
+
+    def lemmatize(self, text):
+        '''
+        It gets all the lemmas of a given text
+        :param text: Text to be lemmatized
+        :return: A string with the text lemmatized
+        '''
+        return parse_lemmas(self.analyze(text))
+
+
+    def close(self):
+        '''
+        It closes all the idle connections of the pool
+        :return: None
+        '''
+        while True:
+            try:
+                connection = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(connection)
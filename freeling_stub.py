@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+'''
+Local stand-in for the FreeLing analyzer server. It speaks the same socket protocol as
+"analyze --server" and answers with the same 4-column output (form lemma tag probability),
+taking the lowercase form as the lemma. It reads the messages as the server does (see read_message).
+It is meant for benchmarks and tests, where no real FreeLing server is available.
+
+python freeling_stub.py  # listens on the ports 50005 (English) and 50006 (Spanish)
+'''
+
+import re
+import socketserver
+import threading
+import time
+
+
+TOKEN = re.compile(r"\w+|[^\w\s]")
+DATE = re.compile(r"^\d{1,2}/\d{1,2}/\d{2,4}$")
+
+
+def analyze(tokens):
+    '''
+    It builds the FreeLing output of a sentence
+    :param tokens: List of strings with the tokens of the sentence
+    :return: String with one line per token and an empty line at the end
+    '''
+    lines = []
+    for token in tokens:
+        if DATE.match(token):
+            lines.append('%s [??:%s] W 1' % (token, token))
+        elif TOKEN.match(token) and not token[0].isalnum():
+            lines.append('%s %s Fp 1' % (token, token))
+        else:
+            lines.append('%s %s NC000 1' % (token, token.lower()))
+    return '\n'.join(lines) + '\n\n'
+
+
+def read_message(sock):
+    '''
+    It reads a message the same way the FreeLing server does: the socket is read until a read ends with a zero
+    byte, and the bytes which follow the first zero byte of a read are dropped. So a client which sends
+    a message before the response of the previous one loses it, as with the real server
+    :param sock: The socket of the client
+    :return: Bytes of the message, or None if the client closed the connection
+    '''
+    message = b''
+    while True:
+        data = sock.recv(65536)
+        if not data:
+            return None
+        message += data.split(b'\0', 1)[0]
+        if data.endswith(b'\0'):
+            return message
+
+
+class FreeLingStubHandler(socketserver.BaseRequestHandler):
+    '''
+    It serves one client connection. The tokens of each message are buffered until a FLUSH_BUFFER
+    arrives, as the server does with the sentences which are not finished yet
+    '''
+
+    def handle(self):
+        pending = []
+        while True:
+            message = read_message(self.request)
+            if message is None:
+                return
+            message = message.decode('utf-8')
+            if message == 'RESET_STATS':
+                response = 'FL-SERVER-READY'
+            elif message == 'FLUSH_BUFFER':
+                response = analyze(pending) if pending else 'FL-SERVER-READY'
+                pending = []
+            else:
+                pending.extend(token for part in message.split() for token in
+                               ([part] if DATE.match(part) else TOKEN.findall(part)))
+                response = 'FL-SERVER-READY'
+            self.request.sendall(response.encode('utf-8') + b'\0')
+
+
+class FreeLingStub(socketserver.ThreadingTCPServer):
+    '''
+    Threaded stub server. Use port 0 to get a free port, which is then in stub.port
+    '''
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, port=0, host='localhost'):
+        socketserver.ThreadingTCPServer.__init__(self, (host, port), FreeLingStubHandler)
+        self.port = self.server_address[1]
+        self.thread = None
+
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == '__main__':
+    stubs = [FreeLingStub(port).start() for port in (50005, 50006)]
+    print('FreeLing stub listening on the ports 50005 and 50006')
+    while True:
+        time.sleep(3600)
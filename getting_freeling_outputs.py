@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+'''
+Analyzes the articles (data/documents/<language>/article/<article>) with the FreeLing servers and writes their
+outputs (data/FreeLing_outputs/<language>/<article>), the same ones analyzer_client writes, which are the input
+of getting_lemmas.py. It replaces the loop of getting_lemmas.sh which spawned an analyzer_client per article.
+
+Each article is a task of a pool of in_flight threads, which send them over the persistent connections of
+the FreeLing client: in_flight articles are analyzed at the same time on each server, each one over its own
+connection (the server answers a message before it reads the next one, so the articles are never packed in
+a single request). An article which fails is retried. The articles whose output is newer than the article
+are skipped.
+You'll need to have FreeLing running (analyze -f en.cfg --server --port 50005 &)
+
+python getting_freeling_outputs.py --languages en es --in-flight 4
+'''
+
+import argparse
+import concurrent.futures
+import os
+import sys
+import time
+from os import listdir
+from os.path import isfile, join, getmtime
+from freeling import FreeLingClient
+
+
+PORTS = {'en': 50005, 'es': 50006}
+
+
+def is_up_to_date(input_file, output_file):
+    return isfile(output_file) and getmtime(output_file) >= getmtime(input_file)
+
+
+def write_output(output_file, output):
+    '''
+    It writes a FreeLing output through a temporary file, so an interrupted run never leaves an output
+    which looks up to date
+    :return: None
+    '''
+    with open(output_file + '.tmp', 'w') as f:
+        f.write(output)
+    os.replace(output_file + '.tmp', output_file)
+
+
+def analyze_article(client, text, retries):
+    '''
+    It analyzes an article, retrying it up to retries times (waiting longer after each failure)
+    :param client: FreeLingClient of the language of the article
+    :param text: String with the article
+    :param retries: Integer with the number of times the article is retried
+    :return: String with the FreeLing output, or None if it could not be analyzed
+    '''
+    for attempt in range(retries + 1):
+        try:
+            return client.analyze(text)
+        except OSError as e:
+            print('\tERROR: an article could not be analyzed (%s)' % e)
+            if attempt < retries:
+                time.sleep(0.1 * 2 ** attempt)
+    return None
+
+
+def analyze_file(client, input_file, output_file, retries):
+    '''
+    It analyzes an article and writes its output
+    :param client: FreeLingClient of the language of the article
+    :param input_file: String with the path of the article
+    :param output_file: String with the path of its FreeLing output
+    :param retries: Integer with the number of times the article is retried
+    :return: Tuple with the number of bytes analyzed and a boolean variable that tells whether it was analyzed
+    '''
+    with open(input_file) as f:
+        text = f.read()
+    output = analyze_article(client, text, retries)
+    if output is None:
+        return len(text), False
+    write_output(output_file, output)
+    return len(text), True
+
+
+def get_tasks(documents_dir, output_dir, force=False):
+    '''
+    It gets the articles whose output has to be written
+    :param documents_dir: String with the directory of the articles of a language
+    :param output_dir: String with the directory of the FreeLing outputs of the language
+    :param force: Boolean variable that tells whether the up to date outputs are written again
+    :return: List of (article, output file) tuples and the number of skipped articles
+    '''
+    tasks = []
+    skipped = 0
+    for file_name in sorted(listdir(documents_dir)):
+        input_file = join(documents_dir, file_name)
+        if not isfile(input_file):
+            continue
+        output_file = join(output_dir, file_name)
+        if not force and is_up_to_date(input_file, output_file):
+            skipped += 1
+        else:
+            tasks.append((input_file, output_file))
+    return tasks, skipped
+
+
+def analyze_language(language, documents_dir, output_dir, client, in_flight, retries, force=False):
+    '''
+    It writes the FreeLing outputs of the articles of a language
+    :param client: FreeLingClient of the language, with at least in_flight connections
+    :param in_flight: Integer with the number of articles analyzed at the same time, each one over its own connection
+    :return: List of the articles which could not be analyzed
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    tasks, skipped = get_tasks(documents_dir, output_dir, force)
+    num_docs = len(tasks)
+    print('%s: %d articles to analyze, %d up to date' % (language, num_docs, skipped))
+    start = time.perf_counter()
+    size = 0
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=in_flight) as executor:
+        futures = {executor.submit(analyze_file, client, input_file, output_file, retries): input_file
+                   for input_file, output_file in tasks}
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            article_size, analyzed = future.result()
+            size += article_size
+            if not analyzed:
+                failed.append(futures[future])
+            if done % 1000 == 0:
+                print('\t%d/%d articles' % (done, num_docs))
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print('\t%d articles, %.1f MB in %.2fs: %.1f articles/s, %.2f MB/s, %d failed'
+          % (num_docs, size / 1e6, elapsed, num_docs / elapsed, size / 1e6 / elapsed, len(failed)))
+    return sorted(failed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Analyzes the articles with the FreeLing servers')
+    parser.add_argument('--documents-dir', default='data/documents', help='directory with a folder per language')
+    parser.add_argument('--output-dir', default='data/FreeLing_outputs', help='directory with a folder per language')
+    parser.add_argument('--languages', nargs='+', default=['en', 'es'])
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--ports', nargs='+', default=[], metavar='LANGUAGE=PORT',
+                        help='port of the FreeLing server of each language (en=50005 es=50006 by default)')
+    parser.add_argument('--in-flight', type=int, default=4, help='articles sent at the same time to each server, over their own connections')
+    parser.add_argument('--retries', type=int, default=2, help='times a failed article is retried')
+    parser.add_argument('--timeout', type=float, default=300, help='seconds to wait for a server')
+    parser.add_argument('--force', action='store_true', help='analyze the up to date articles too')
+    args = parser.parse_args()
+
+    ports = dict(PORTS)
+    for item in args.ports:
+        language, port = item.split('=')
+        ports[language] = int(port)
+
+    failed = []
+    for language in args.languages:
+        client = FreeLingClient(ports[language], args.host, pool_size=args.in_flight, timeout=args.timeout)
+        try:
+            failed += analyze_language(language, join(args.documents_dir, language, 'article'),
+                                       join(args.output_dir, language), client,
+                                       args.in_flight, args.retries, args.force)
+        finally:
+            client.close()
+    if failed:
+        print('ERROR: %d articles could not be analyzed:\n%s' % (len(failed), '\n'.join(failed)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
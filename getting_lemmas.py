@@ -1,22 +1,106 @@
+#!/usr/bin/env python
+
+'''
+Extracts the lemmas of the FreeLing outputs (data/FreeLing_outputs/<language>/<article>) into the lemma files
+used by SkyScanner (data/lemmas/<language>/<article>, all the lemmas in one line separated by spaces).
+Each file is processed by a pool of processes, streaming its lines, and the files whose lemma file is newer
+than the FreeLing output are skipped.
+
+python getting_lemmas.py --input-dir data/FreeLing_outputs --output-dir data/lemmas --processes 8
+'''
+
+import argparse
+import multiprocessing
+import os
+import time
 from os import listdir
-from os.path import isfile, join
-
-languages = ['es', 'en']
-for language in languages:
-    files_dir = join('data/FreeLing_outputs', language)
-    output_dir = join('data/lemmas', language)
-    flfiles = [f for f in listdir(files_dir) if isfile(join(files_dir, f))]
-    for flfile in flfiles:
-        print(flfile)
-        output_file = join(output_dir, flfile)
-        output = ''
-        with open(join(files_dir, flfile), 'r') as f:
-            for line in f:
-                part = line.split()
-                if len(part) == 4:
-                    if part[2] == 'W': # when it is a date, we take the date as it is
-                        output += part[0] + ' '
-                    else:
-                        output += part[1] + ' '
-        with open(output_file, 'w') as f:
-            f.write(output[:-1])
\ No newline at end of file
+from os.path import isfile, join, getmtime, getsize
+from freeling import parse_line
+
+
+BUFFER_SIZE = 1 << 20
+
+
+def is_up_to_date(input_file, output_file):
+    return isfile(output_file) and getmtime(output_file) >= getmtime(input_file)
+
+
+def extract_lemmas(task):
+    '''
+    It writes the lemmas of a FreeLing output. They are written in a temporary file which is renamed at the end,
+    so an interrupted run never leaves a lemma file which looks up to date
+    :param task: Tuple with the path of the FreeLing output and the path of the lemma file
+    :return: Tuple with the number of bytes read and the number of lemmas written
+    '''
+    input_file, output_file = task
+    tmp_file = output_file + '.tmp'
+    lemmas = 0
+    with open(input_file, 'r') as f, open(tmp_file, 'w', buffering=BUFFER_SIZE) as out:
+        for line in f:
+            lemma = parse_line(line)
+            if lemma is not None:
+                if lemmas:
+                    out.write(' ')
+                out.write(lemma)
+                lemmas += 1
+    os.replace(tmp_file, output_file)
+    return getsize(input_file), lemmas
+
+
+def get_tasks(input_dir, output_dir, force=False):
+    '''
+    It lists the FreeLing outputs whose lemmas have to be extracted
+    :param input_dir: String with the directory of the FreeLing outputs of a language
+    :param output_dir: String with the directory of the lemma files of the language
+    :param force: Boolean variable that tells whether the up to date lemma files are written again
+    :return: List of (FreeLing output, lemma file) tuples and the number of skipped files
+    '''
+    tasks = []
+    skipped = 0
+    for file_name in sorted(listdir(input_dir)):
+        input_file = join(input_dir, file_name)
+        if not isfile(input_file):
+            continue
+        output_file = join(output_dir, file_name)
+        if not force and is_up_to_date(input_file, output_file):
+            skipped += 1
+        else:
+            tasks.append((input_file, output_file))
+    return tasks, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Extracts the lemmas of the FreeLing outputs')
+    parser.add_argument('--input-dir', default='data/FreeLing_outputs', help='directory with a folder per language')
+    parser.add_argument('--output-dir', default='data/lemmas', help='directory with a folder per language')
+    parser.add_argument('--languages', nargs='+', default=['es', 'en'])
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--force', action='store_true', help='extract the lemmas of the up to date files too')
+    args = parser.parse_args()
+
+    pool = multiprocessing.Pool(args.processes) if args.processes > 1 else None
+    try:
+        for language in args.languages:
+            output_dir = join(args.output_dir, language)
+            os.makedirs(output_dir, exist_ok=True)
+            tasks, skipped = get_tasks(join(args.input_dir, language), output_dir, args.force)
+            print('%s: %d files to process, %d up to date' % (language, len(tasks), skipped))
+            start = time.perf_counter()
+            size = lemmas = 0
+            results = pool.imap_unordered(extract_lemmas, tasks, chunksize=16) if pool else map(extract_lemmas, tasks)
+            for done, (file_size, file_lemmas) in enumerate(results, 1):
+                size += file_size
+                lemmas += file_lemmas
+                if done % 1000 == 0:
+                    print('\t%d/%d files' % (done, len(tasks)))
+            elapsed = max(time.perf_counter() - start, 1e-9)
+            print('\t%d files, %.1f MB, %d lemmas in %.2fs: %.1f files/s, %.1f MB/s, %.0f lemmas/s'
+                  % (len(tasks), size / 1e6, lemmas, elapsed, len(tasks) / elapsed, size / 1e6 / elapsed, lemmas / elapsed))
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+
+if __name__ == '__main__':
+    main()
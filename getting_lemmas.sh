@@ -17,20 +17,9 @@
 
 
 
-declare -a languages=("en" "es")
-for language in "${languages[@]}"
-do
-	echo $language
-	documents_dir=data/documents/$language/article
-	for filename in $documents_dir/*
-	do 
-		echo $(basename $filename)
-		output=data/FreeLing_outputs/$language/$(basename $filename)
-		if [ "$language" == "en" ]
-		then
-			analyzer_client 50005 < $filename > $output
-		else
-			analyzer_client 50006 < $filename > $output
-		fi
-	done
-done
+# The articles are analyzed by getting_freeling_outputs.py, which sends several of them at the same time over
+# persistent connections instead of running analyzer_client once per article
+python getting_freeling_outputs.py --languages en es "$@"
+
+echo "Extracting the lemmas..."
+python getting_lemmas.py --languages en es
@@ -0,0 +1,30 @@
+from os import listdir
+from os.path import isfile, join
+from nltk.tokenize import sent_tokenize
+from freeling import FreeLingClient
+from sentence_store import SentenceStoreWriter
+
+# Builds data/sentences/<language>, the store used by SkyScanner.get_snippet to avoid
+# tokenizing and lemmatizing the retrieved articles at query time.
+# You'll need to have FreeLing running (analyze -f en.cfg --server --port 50005 &)
+
+ports = {'en': 50005, 'es': 50006}
+languages = ['es', 'en']
+for language in languages:
+    files_dir = join('data/documents', language, 'article')
+    output_dir = join('data/sentences', language)
+    client = FreeLingClient(ports[language])
+    store = SentenceStoreWriter(output_dir)
+    docfiles = [f for f in listdir(files_dir) if isfile(join(files_dir, f))]
+    for docfile in docfiles:
+        print(docfile)
+        with open(join(files_dir, docfile)) as f:
+            lines = f.readlines()
+        if len(lines) == 3:
+            text = lines[2]  # only the body of the document is used for the snippets
+        else:
+            text = ' '.join(lines)
+        sentences = sent_tokenize(text)
+        store.add_document(docfile, sentences, [client.lemmatize(sentence) for sentence in sentences])
+    store.close()
+    client.close()
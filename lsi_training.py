@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+'''
+Out-of-core training of the LSI models and sharded similarity indexes, for corpora which do not fit in memory.
+
+The model is trained streaming the MmCorpus file written by SkyScanner.build_corpus, in chunks of chunksize
+documents. With several workers, the corpus is split in contiguous ranges of documents and each range is
+read from the file and decomposed by its own process, chunk by chunk, as the workers of gensim's distributed
+LSI do. Their projections are merged by this process, so only one projection per worker is sent back.
+The multi-pass randomized algorithm (onepass=False) needs the whole corpus in each pass, so it is run by this process.
+
+The sharded index (gensim's Similarity) writes the unit vectors of the documents in shards of shard_size
+documents next to the model (index.0, index.1, ...), which are memory-mapped when they are queried.
+SimilarityVectors reads them as a single documents x topics matrix, like MatrixSimilarity.index.
+
+gensim is imported by the functions, so importing this module does not load it.
+'''
+
+import multiprocessing
+import numpy
+from shards import split_bounds
+
+
+def read_documents(corpus_path, start, end):
+    '''
+    It reads a range of documents of an MmCorpus file, seeking to the first one with the offsets of its index
+    :param corpus_path: String with the path of the MmCorpus file (its .index file is needed)
+    :param start: Integer with the first document
+    :param end: Integer with the document after the last one
+    :return: Generator of the bag-of-words of the documents (the empty ones are skipped)
+    '''
+    from gensim import corpora
+    offsets = corpora.MmCorpus(corpus_path).index[start:end]
+    offsets = offsets[offsets >= 0]  # the empty documents are not in the file
+    if len(offsets) == 0:
+        return
+    with open(corpus_path, 'rb') as f:
+        f.seek(int(offsets[0]))
+        doc, bow = None, []
+        for line in f:
+            doc_id, term_id, value = line.split()
+            doc_id = int(doc_id) - 1  # 1-based
+            if doc_id >= end:
+                break
+            if doc_id != doc:
+                if bow:
+                    yield bow
+                doc, bow = doc_id, []
+            bow.append((int(term_id) - 1, float(value)))
+        if bow:
+            yield bow
+
+
+def train_projection(task):
+    '''
+    It decomposes a range of documents chunk by chunk, merging the projection of each chunk into the previous ones.
+    It is run by the worker processes of train_lsi
+    :param task: Tuple with the path of the MmCorpus file, the first document and the document after the last one,
+    the number of terms and a dictionary with num_topics, chunksize, power_iters, extra_samples and decay
+    :return: The Projection of the documents
+    '''
+    from gensim import matutils, utils
+    from gensim.models.lsimodel import Projection
+    corpus_path, start, end, num_terms, params = task
+    projection = Projection(num_terms, params['num_topics'], power_iters=params['power_iters'],
+                            extra_dims=params['extra_samples'])
+    for chunk in utils.grouper(read_documents(corpus_path, start, end), params['chunksize']):
+        job = matutils.corpus2csc(chunk, num_docs=len(chunk), num_terms=num_terms,
+                                  num_nnz=sum(len(doc) for doc in chunk))
+        update = Projection(num_terms, params['num_topics'], job, power_iters=params['power_iters'],
+                            extra_dims=params['extra_samples'])
+        projection.merge(update, decay=params['decay'])
+    return projection
+
+
+def train_lsi(corpus_path, id2word, num_topics, chunksize=20000, power_iters=2, extra_samples=100, onepass=True,
+              workers=1, decay=1.0):
+    '''
+    It trains a LSI model streaming an MmCorpus file
+    :param corpus_path: String with the path of the MmCorpus file
+    :param id2word: Dictionary of the corpus
+    :param num_topics: Integer with the number of topics
+    :param chunksize: Integer with the number of documents decomposed at once, the more the faster and the more memory
+    :param power_iters: Integer with the number of power iterations of the randomized SVD, the more the more accurate
+    :param extra_samples: Integer with the number of samples taken besides num_topics by the randomized SVD
+    :param onepass: Boolean variable that tells whether the one-pass algorithm is used. Otherwise, the multi-pass
+    randomized one reads the corpus power_iters + 2 times
+    :param workers: Integer with the number of processes which decompose the corpus (one-pass algorithm only)
+    :param decay: Float with the weight of the merged projections relative to the new ones
+    :return: The LsiModel
+    '''
+    from gensim import corpora, models
+    corpus = corpora.MmCorpus(corpus_path)
+    workers = max(1, min(workers, corpus.num_docs))
+    if workers > 1 and not onepass:
+        print('\tThe multi-pass algorithm runs in a single process, the one-pass one is used by the workers')
+        onepass = True
+    lsi = models.LsiModel(id2word=id2word, num_topics=num_topics, chunksize=chunksize, decay=decay, onepass=onepass,
+                          power_iters=power_iters, extra_samples=extra_samples)
+    if workers == 1:
+        lsi.add_documents(corpus)
+        return lsi
+
+    params = {'num_topics': num_topics, 'chunksize': chunksize, 'power_iters': power_iters,
+              'extra_samples': extra_samples, 'decay': decay}
+    bounds = split_bounds(corpus.num_docs, workers)
+    tasks = [(corpus_path, bounds[i], bounds[i + 1], lsi.num_terms, params) for i in range(len(bounds) - 1)]
+    with multiprocessing.Pool(len(tasks)) as pool:
+        for projection in pool.imap(train_projection, tasks):  # in the order of the documents
+            lsi.projection.merge(projection, decay=1.0)
+    lsi.docs_processed = corpus.num_docs
+    return lsi
+
+
+def build_sharded_index(output_prefix, lsi, corpus, shard_size):
+    '''
+    It writes the unit vectors of the documents of a corpus in a sharded similarity index
+    :param output_prefix: String with the path of the index, the shards are written in output_prefix.<shard>
+    :param lsi: LsiModel which projects the documents
+    :param corpus: The bag-of-words corpus, streamed
+    :param shard_size: Integer with the maximum number of documents of a shard
+    :return: The gensim Similarity index, with every document in a shard
+    '''
+    from gensim import similarities
+    index = similarities.Similarity(output_prefix, lsi[corpus], num_features=lsi.num_topics, shardsize=shard_size)
+    index.close_shard()  # the last documents are written too
+    return index
+
+
+def load_sharded_index(output_prefix):
+    '''
+    It loads a sharded similarity index. The shards keep their paths, so they are updated in case the models
+    directory was moved
+    :param output_prefix: String with the path of the index
+    :return: The gensim Similarity index
+    '''
+    from gensim import similarities
+    index = similarities.Similarity.load(output_prefix)
+    index.output_prefix = output_prefix
+    index.check_moved()
+    return index
+
+
+class SimilarityVectors:
+    '''
+    Read-only view of the unit vectors of a sharded similarity index as a documents x topics matrix.
+    Only the rows which are read are copied, the shards stay memory-mapped
+    '''
+
+    def __init__(self, index):
+        '''
+        Class contructor
+        :param index: The gensim Similarity index, without documents pending to be written in a shard
+        '''
+        self.shards = [shard.get_index().index for shard in index.shards]
+        self.bounds = [0]
+        for vectors in self.shards:
+            self.bounds.append(self.bounds[-1] + len(vectors))
+        self.dtype = self.shards[0].dtype if self.shards else numpy.dtype(numpy.float32)
+        self.shape = (self.bounds[-1], index.num_features)
+
+
+    def __len__(self):
+        return self.shape[0]
+
+
+    def __getitem__(self, docs):
+        '''
+        It gets the vectors of some documents
+        :param docs: Slice or array of document identifiers
+        :return: Numpy array with a row per document
+        '''
+        if isinstance(docs, slice):
+            docs = range(*docs.indices(len(self)))
+        docs = numpy.asarray(docs, dtype=numpy.int64)
+        vectors = numpy.empty((len(docs), self.shape[1]), dtype=self.dtype)
+        shard_ids = numpy.searchsorted(self.bounds, docs, side='right') - 1
+        for shard in numpy.unique(shard_ids):
+            rows = shard_ids == shard
+            vectors[rows] = self.shards[shard][docs[rows] - self.bounds[shard]]
+        return vectors
+
+
+    def __array__(self, dtype=None, copy=None):
+        vectors = self[:]
+        return vectors if dtype is None else vectors.astype(dtype)
+
+
+    def dot(self, other):
+        '''
+        It multiplies the vectors by a matrix, shard by shard
+        :param other: Numpy array (topics x queries)
+        :return: Numpy array (documents x queries)
+        '''
+        if not self.shards:
+            return numpy.zeros((0,) + numpy.shape(other)[1:], dtype=self.dtype)
+        return numpy.concatenate([numpy.dot(vectors, other) for vectors in self.shards])
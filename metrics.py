@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+'''
+Opt-in instrumentation of the query hot path. Each query records the wall time of its stages
+(language guessing, lemmatization, LSI transform, similarity scan...) and some counters (FreeLing calls,
+files opened, sentences lemmatized), which are aggregated in histograms. The queries slower than a
+threshold are logged with their breakdown. When it is disabled, every call returns a shared no-op object.
+'''
+
+import bisect
+import collections
+import json
+import logging
+import threading
+import time
+
+
+BUCKETS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+class NullTimer:
+    '''
+    It does nothing, it is used when the metrics are disabled
+    '''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class Histogram:
+    '''
+    Histogram of durations with fixed buckets (in milliseconds)
+    '''
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+
+    def add(self, ms):
+        self.counts[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+
+    def percentile(self, p):
+        '''
+        It estimates the given percentile with the upper bound of its bucket
+        :param p: Float from 0 to 100
+        :return: Float with the milliseconds
+        '''
+        rank = p / 100.0 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return BUCKETS_MS[i] if i < len(BUCKETS_MS) else self.max_ms
+        return 0.0
+
+
+    def to_dict(self):
+        return {'count': self.count,
+                'mean_ms': self.total_ms / self.count if self.count else 0.0,
+                'p50_ms': self.percentile(50),
+                'p99_ms': self.percentile(99),
+                'max_ms': self.max_ms,
+                'buckets': {('le_%s' % bound): count for bound, count in zip(BUCKETS_MS + ['inf'], self.counts)}}
+
+
+class StageTimer:
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+
+    def __exit__(self, *exc):
+        self.metrics.add_stage(self.name, (time.perf_counter() - self.start) * 1000.0)
+        return False
+
+
+class QueryTrace:
+    '''
+    It collects the stages and the counters of one query. The traces opened inside another one are ignored,
+    so a query calling other instrumented entry points is recorded once
+    '''
+
+    def __init__(self, metrics, name, text):
+        self.metrics = metrics
+        self.name = name
+        self.text = text
+        self.stages = collections.OrderedDict()
+        self.counters = collections.Counter()
+        self.nested = False
+
+
+    def __enter__(self):
+        local = self.metrics.local
+        if getattr(local, 'trace', None) is not None:
+            self.nested = True
+        else:
+            local.trace = self
+            self.start = time.perf_counter()
+        return self
+
+
+    def __exit__(self, *exc):
+        if not self.nested:
+            self.metrics.local.trace = None
+            self.metrics.add_query(self, (time.perf_counter() - self.start) * 1000.0)
+        return False
+
+
+class QueryMetrics:
+    '''
+    Aggregated metrics of all the queries. It is thread safe
+    '''
+
+    def __init__(self, enabled=False, slow_query_ms=None, logger=None):
+        '''
+        Class contructor
+        :param enabled: Boolean variable that tells whether anything is recorded
+        :param slow_query_ms: Float with the milliseconds above which a query is logged (None to log nothing)
+        :param logger: logging.Logger where the slow queries are logged
+        '''
+        self.enabled = enabled
+        self.slow_query_ms = slow_query_ms
+        self.logger = logger or logging.getLogger('SkyScanner')
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.reset()
+
+
+    def reset(self):
+        with self.lock:
+            self.queries = collections.defaultdict(Histogram)
+            self.stages = collections.defaultdict(Histogram)
+            self.counters = collections.Counter()
+
+
+    def query(self, name, text=None):
+        '''
+        It opens the trace of a query: with metrics.query('run_query', query): ...
+        :param name: String with the name of the entry point
+        :param text: String with the query, to be shown in the slow query log
+        :return: A context manager
+        '''
+        if not self.enabled:
+            return NULL_TIMER
+        return QueryTrace(self, name, text)
+
+
+    def stage(self, name):
+        '''
+        It times a stage of the current query: with metrics.stage('similarity'): ...
+        :param name: String with the name of the stage
+        :return: A context manager
+        '''
+        if not self.enabled:
+            return NULL_TIMER
+        return StageTimer(self, name)
+
+
+    def count(self, name, n=1):
+        '''
+        It increases a counter of the current query
+        :param name: String with the name of the counter
+        :param n: Integer to add
+        :return: None
+        '''
+        if not self.enabled:
+            return
+        trace = getattr(self.local, 'trace', None)
+        if trace is not None:
+            trace.counters[name] += n
+        else:
+            with self.lock:
+                self.counters[name] += n
+
+
+    def add_stage(self, name, ms):
+        trace = getattr(self.local, 'trace', None)
+        if trace is not None:
+            trace.stages[name] = trace.stages.get(name, 0.0) + ms
+        else:
+            with self.lock:
+                self.stages[name].add(ms)
+
+
+    def add_query(self, trace, ms):
+        with self.lock:
+            self.queries[trace.name].add(ms)
+            for name, stage_ms in trace.stages.items():
+                self.stages[name].add(stage_ms)
+            self.counters.update(trace.counters)
+        if self.slow_query_ms is not None and ms > self.slow_query_ms:
+            stages = ', '.join('%s=%.1fms' % item for item in trace.stages.items())
+            counters = ', '.join('%s=%d' % item for item in trace.counters.items())
+            self.logger.warning('Slow %s (%.1fms) %r: %s; %s', trace.name, ms, trace.text, stages, counters)
+
+
+    def snapshot(self):
+        '''
+        It gives the aggregated metrics
+        :return: dictionary with the histogram of each entry point and stage and the total of each counter
+        '''
+        with self.lock:
+            return {'queries': {name: hist.to_dict() for name, hist in self.queries.items()},
+                    'stages': {name: hist.to_dict() for name, hist in self.stages.items()},
+                    'counters': dict(self.counters)}
+
+
+    def dump(self, file_path):
+        '''
+        It writes the aggregated metrics in a JSON file
+        :param file_path: String with the path of the file
+        :return: None
+        '''
+        with open(file_path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
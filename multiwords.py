@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+'''
+Table of multiword rewrites (multiwords.txt by default), applied to the lemmas of the documents and of the queries.
+Each rule replaces a sequence of lemmas (the variant) by another one (the canonical form), e.g. "crowd funding"
+and "crowdfunding" by "crowd_funding". The rules are matched on whole lemmas, the longest variant first.
+'''
+
+import hashlib
+from os.path import dirname, join, abspath
+
+
+DEFAULT_FILE = join(dirname(abspath(__file__)), 'multiwords.txt')
+
+
+class MultiwordTable:
+    '''
+    Rewrites of sequences of lemmas
+    '''
+
+    def __init__(self, rules=()):
+        '''
+        Class contructor
+        :param rules: List of (variant, canonical form) tuples of strings with the lemmas separated by spaces
+        '''
+        self.rules = {}
+        for variant, canonical in rules:
+            self.rules[tuple(variant.split())] = canonical.split()
+        self.first = {variant[0] for variant in self.rules}
+        self.longest = max([len(variant) for variant in self.rules] or [0])
+
+
+    @staticmethod
+    def load(file_path=None):
+        '''
+        It reads a table: one rule per line, the variant and the canonical form separated by a tab.
+        The empty lines and the ones which start with # are skipped
+        :param file_path: String with the path of the table (DEFAULT_FILE if it is None)
+        :return: MultiwordTable
+        '''
+        rules = []
+        with open(file_path or DEFAULT_FILE) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    variant, canonical = line.split('\t')
+                    rules.append((variant, canonical))
+        return MultiwordTable(rules)
+
+
+    def fingerprint(self):
+        '''
+        It identifies the rules of the table, so the models built with other rules are not loaded
+        :return: String with the SHA-1 of the rules
+        '''
+        rules = sorted('%s\t%s' % (' '.join(variant), ' '.join(canonical)) for variant, canonical in self.rules.items())
+        return hashlib.sha1('\n'.join(rules).encode('utf-8')).hexdigest()
+
+
+    def apply(self, terms):
+        '''
+        It rewrites the variants found in a list of lemmas
+        :param terms: List of strings with the lemmas
+        :return: List of strings with the rewritten lemmas
+        '''
+        if not self.rules or not self.first.intersection(terms):
+            return terms
+        output = []
+        i = 0
+        while i < len(terms):
+            if terms[i] in self.first:
+                for size in range(min(self.longest, len(terms) - i), 0, -1):
+                    canonical = self.rules.get(tuple(terms[i:i + size]))
+                    if canonical is not None:
+                        output.extend(canonical)
+                        i += size
+                        break
+                else:
+                    output.append(terms[i])
+                    i += 1
+            else:
+                output.append(terms[i])
+                i += 1
+        return output
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+'''
+Positional index over the lemma files, for quoted phrase queries and proximity boosting. The position of a term
+is its place among all the lemmas of the document (stopwords and punctuation symbols included, so a phrase query
+skips the same words as the document), but only the other terms are indexed.
+
+An index has these files in the model directory:
+    positions.bin: for each term, three varint streams one after the other: the gaps between its documents,
+    the number of positions in each document and the gaps between the positions in each document
+    (the first position of a document is not a gap)
+    positions.idx.npy: int64 table with a row per term (and one at the end), with the offset of its streams
+    in positions.bin and the size of the first two of them
+    positions.terms: the terms, one per line, in the order of the table
+    positions.json: the manifest of the model the index was built for
+positions.bin is memory-mapped and the decoded postings of the most recent terms are cached.
+Phrases and windows are found by intersecting the position lists, the documents are never read.
+'''
+
+import json
+import mmap
+from array import array
+from os.path import join, isfile
+import numpy
+from cache import LRUCache
+from segment import encode_varints, decode_varints
+
+
+def get_document_terms(file_path, multiwords):
+    '''
+    It reads the lemmas of a lemma file, lowercased and with the multiwords rewritten
+    :param file_path: String with the path of the lemma file
+    :param multiwords: MultiwordTable
+    :return: List of strings with the lemmas
+    '''
+    try:
+        with open(file_path) as f:
+            return multiwords.apply(f.readline().lower().split())
+    except IOError:
+        return []
+
+
+def write_positional_index(model_dir, files, stop_words, punct_sym, multiwords, manifest):
+    '''
+    It builds the positional index of the documents of a model
+    :param model_dir: String with the directory where the index is written
+    :param files: List with the path of the lemma file of each document, in the order of the document identifiers
+    :param stop_words: Set of the stopwords, which are not indexed
+    :param punct_sym: The punctuation symbols, which are not indexed
+    :param multiwords: MultiwordTable applied to the lemmas
+    :param manifest: dictionary with the manifest of the model, written in positions.json
+    :return: None
+    '''
+    docs, counts, positions = {}, {}, {}
+    for doc, file_path in enumerate(files):
+        doc_positions = {}
+        for position, term in enumerate(get_document_terms(file_path, multiwords)):
+            if term not in stop_words and term not in punct_sym:
+                doc_positions.setdefault(term, []).append(position)
+        for term, term_positions in doc_positions.items():
+            if term not in docs:
+                docs[term], counts[term], positions[term] = array('i'), array('i'), array('i')
+            docs[term].append(doc)
+            counts[term].append(len(term_positions))
+            positions[term].extend(term_positions)
+
+    terms = sorted(docs)
+    table = numpy.zeros((len(terms) + 1, 3), dtype=numpy.int64)
+    offset = 0
+    with open(join(model_dir, 'positions.bin'), 'wb') as f:
+        for i, term in enumerate(terms):
+            term_docs = numpy.frombuffer(docs[term], dtype=numpy.int32)
+            term_counts = numpy.frombuffer(counts[term], dtype=numpy.int32)
+            term_positions = numpy.frombuffer(positions[term], dtype=numpy.int32)
+            gaps = numpy.diff(term_positions, prepend=0)
+            starts = numpy.cumsum(term_counts) - term_counts
+            gaps[starts] = term_positions[starts]
+            streams = [encode_varints(numpy.diff(term_docs, prepend=0)), encode_varints(term_counts), encode_varints(gaps)]
+            table[i] = (offset, len(streams[0]), len(streams[1]))
+            for stream in streams:
+                f.write(stream)
+                offset += len(stream)
+    table[-1, 0] = offset
+    numpy.save(join(model_dir, 'positions.idx.npy'), table)
+    with open(join(model_dir, 'positions.terms'), 'w') as f:
+        f.write('\n'.join(terms))
+    with open(join(model_dir, 'positions.json'), 'w') as f:  # the last one, an interrupted build is never valid
+        json.dump(manifest, f)
+
+
+class PositionalIndex:
+    '''
+    Memory-mapped reader of a positional index
+    '''
+
+    def __init__(self, model_dir, cache_size=1024):
+        '''
+        Class contructor
+        :param model_dir: String with the directory of the index
+        :param cache_size: Integer with the number of terms whose decoded postings are kept
+        '''
+        with open(join(model_dir, 'positions.bin'), 'rb') as f:
+            try:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty files can not be mapped
+                self.data = b''
+        self.table = numpy.load(join(model_dir, 'positions.idx.npy'), mmap_mode='r')
+        with open(join(model_dir, 'positions.terms')) as f:
+            text = f.read()
+        self.term_ids = {term: i for i, term in enumerate(text.split('\n'))} if text else {}
+        self.cache = LRUCache(cache_size)
+
+
+    @staticmethod
+    def is_valid(model_dir, manifest):
+        '''
+        It tells whether there is an index built for the model with the given manifest
+        '''
+        manifest_path = join(model_dir, 'positions.json')
+        if not isfile(manifest_path) or not isfile(join(model_dir, 'positions.bin')):
+            return False
+        with open(manifest_path) as f:
+            try:
+                return json.load(f) == manifest
+            except ValueError:
+                return False
+
+
+    def postings(self, term):
+        '''
+        It decodes the postings of a term
+        :param term: String with the term
+        :return: Tuple of Numpy arrays with its documents, the first position of each document in the positions and
+        the positions, or None if the term is not in the index
+        '''
+        postings = self.cache.get(term)
+        if postings is not None:
+            return postings
+        i = self.term_ids.get(term)
+        if i is None:
+            return None
+        offset, docs_size, counts_size = (int(value) for value in self.table[i])
+        end = int(self.table[i + 1, 0])
+        data = numpy.frombuffer(self.data, dtype=numpy.uint8, count=end - offset, offset=offset)
+        docs = numpy.cumsum(decode_varints(data[:docs_size]))
+        counts = decode_varints(data[docs_size:docs_size + counts_size])
+        gaps = decode_varints(data[docs_size + counts_size:])
+        starts = numpy.cumsum(counts) - counts
+        sums = numpy.cumsum(gaps)
+        positions = sums - numpy.repeat(sums[starts] - gaps[starts], counts)
+        postings = (docs, numpy.append(starts, len(positions)), positions)
+        self.cache.put(term, postings)
+        return postings
+
+
+    def get_positions(self, term, doc):
+        '''
+        It gets the positions of a term in a document
+        :return: Numpy array with the positions (empty if the term is not in the document)
+        '''
+        postings = self.postings(term)
+        if postings is None:
+            return numpy.empty(0, dtype=numpy.int64)
+        docs, starts, positions = postings
+        i = numpy.searchsorted(docs, doc)
+        if i == len(docs) or docs[i] != doc:
+            return numpy.empty(0, dtype=numpy.int64)
+        return positions[starts[i]:starts[i + 1]]
+
+
+    def phrase_documents(self, phrase):
+        '''
+        It finds the documents which contain a phrase, intersecting the position lists of its terms
+        :param phrase: Tuple of (offset, term) tuples, where the offset is the position of the term in the phrase
+        :return: Numpy array with the sorted document identifiers
+        '''
+        keys = None  # the (document, position) pairs where the phrase can start, as single integers
+        for offset, term in phrase:
+            postings = self.postings(term)
+            if postings is None:
+                return numpy.empty(0, dtype=numpy.int64)
+            docs, starts, positions = postings
+            term_keys = (numpy.repeat(docs, numpy.diff(starts)) << 32) + positions
+            if keys is None:
+                keys = term_keys[positions >= offset] - offset
+            else:
+                keys = keys[numpy.isin(keys + offset, term_keys)]
+            if len(keys) == 0:
+                break
+        return numpy.unique(keys >> 32)
+
+
+    def window(self, terms, doc):
+        '''
+        It finds the smallest window of a document which contains all the given terms found in it
+        :param terms: List of distinct terms
+        :param doc: Integer with the document identifier
+        :return: Tuple with the number of terms found in the document and the size of the window (in lemmas)
+        '''
+        events = []
+        for label, term in enumerate(terms):
+            for position in self.get_positions(term, doc).tolist():
+                events.append((position, label))
+        found = len({label for position, label in events})
+        if found < 2:
+            return found, found
+        events.sort()
+        best = None
+        last = {}
+        for position, label in events:
+            last[label] = position
+            if len(last) == found:
+                size = position - min(last.values()) + 1
+                if best is None or size < best:
+                    best = size
+        return found, best
@@ -1,10 +1,35 @@
 import scrapy
 import os
+import re
+import json
+import time
+import hashlib
+
+# scrapy crawl entrepreneur_scrapper -a lang=en -a sitemaps=2018/January,2018/February
+#   -a output_dir=data/documents/new -a state_dir=data/crawl -a recheck_days=7
+# Without sitemaps, the articles of start_urls are crawled.
+# The state of the crawled articles (ETag, Last-Modified, hash of the text) is kept in <state_dir>/<lang>/state.json,
+# so a rerun only downloads the new articles and the ones which changed, and the documents written by each run
+# are appended to <state_dir>/<lang>/changed.txt (one path per line) for the lemma and index stages. Each path is
+# appended as soon as its document is written, so an interrupted crawl which is resumed does not lose any.
+
+ARTICLE_ID = re.compile(r'/article/(\d+)')
+BASE_URL = 'https://www.entrepreneur.com'
 
 
 class Entrepreneur(scrapy.Spider):
   lang = 'en'
   name = "entrepreneur_scrapper"
+  handle_httpstatus_list = [304]  # answer to the conditional requests of the articles which did not change
+  custom_settings = {
+    'CONCURRENT_REQUESTS': 32,
+    'CONCURRENT_REQUESTS_PER_DOMAIN': 16,
+    'AUTOTHROTTLE_ENABLED': True,
+    'AUTOTHROTTLE_START_DELAY': 0.5,
+    'AUTOTHROTTLE_MAX_DELAY': 10,
+    'AUTOTHROTTLE_TARGET_CONCURRENCY': 8,
+    'RETRY_TIMES': 3,
+  }
   start_urls = [
     # 'https://www.entrepreneur.com/sitemaps/2018/January/us'
     # , 'https://www.entrepreneur.com/sitemaps/2018/February/us'
@@ -101,6 +126,77 @@ class Entrepreneur(scrapy.Spider):
     , 'https://www.entrepreneur.com/article/237678'
                 ]
 
+  def __init__(self, lang=None, sitemaps=None, output_dir='data/documents/new', state_dir='data/crawl',
+               recheck_days=7, *args, **kwargs):
+    super(Entrepreneur, self).__init__(*args, **kwargs)
+    if lang:
+      self.lang = lang
+    self.sitemaps = sitemaps.split(',') if sitemaps else []
+    self.output_dir = os.path.join(output_dir, self.lang)
+    self.state_dir = os.path.join(state_dir, self.lang)
+    self.recheck_seconds = float(recheck_days) * 86400
+    os.makedirs(self.output_dir, exist_ok=True)
+    os.makedirs(self.state_dir, exist_ok=True)
+    self.state = self.loadState()
+    self.scheduled = set()
+    self.changed = []
+    self.unchanged = 0
+    self.processed = 0
+
+  def loadState(self):
+    statePath = os.path.join(self.state_dir, 'state.json')
+    if not os.path.isfile(statePath):
+      return {}
+    with open(statePath) as f:
+      return json.load(f)
+
+  def saveState(self):
+    statePath = os.path.join(self.state_dir, 'state.json')
+    with open(statePath + '.tmp', 'w') as f:
+      json.dump(self.state, f)
+    os.replace(statePath + '.tmp', statePath)
+
+  def recordChanged(self, filePath):
+    self.changed.append(filePath)
+    with open(os.path.join(self.state_dir, 'changed.txt'), 'a') as f:
+      f.write(filePath + '\n')
+
+  def getArticleId(self, url):
+    match = ARTICLE_ID.search(url)
+    return match.group(1) if match else None
+
+  def articleRequest(self, url):
+    """
+    It builds the request of an article, or None if it was already requested in this crawl or it was checked
+    less than recheck_days ago. The articles which were saved before are requested with If-None-Match and
+    If-Modified-Since, so the server answers 304 when they did not change
+    """
+    articleId = self.getArticleId(url)
+    if articleId in self.scheduled:
+      return None
+    self.scheduled.add(articleId)
+    known = self.state.get(articleId)
+    headers = {}
+    if known and os.path.isfile(known['path']):
+      if time.time() - known['checked'] < self.recheck_seconds:
+        return None
+      if known.get('etag'):
+        headers['If-None-Match'] = known['etag']
+      if known.get('last_modified'):
+        headers['If-Modified-Since'] = known['last_modified']
+    return scrapy.Request(BASE_URL + '/article/' + articleId, callback=self.parseArticle, headers=headers,
+                          meta={'article_id': articleId})
+
+  def start_requests(self):
+    suffix = 'us' if self.lang == 'en' else self.lang
+    for sitemap in self.sitemaps:
+      yield scrapy.Request(BASE_URL + '/sitemaps/' + sitemap.strip('/') + '/' + suffix, callback=self.parse)
+    if not self.sitemaps:
+      for url in self.start_urls:
+        request = self.articleRequest(url) if self.getArticleId(url) else scrapy.Request(url, callback=self.parse)
+        if request:
+          yield request
+
   def getWebPageText(self, response):
     title_css = '.headline::text'
     title = response.css(title_css).extract_first().strip()
@@ -130,15 +226,47 @@ class Entrepreneur(scrapy.Spider):
 
     if my_list:
       for article_name in my_list.xpath('li/a'):
-        next_page = 'https://www.entrepreneur.com' + article_name.xpath('@href').extract_first().strip()
-        if next_page:
-          yield scrapy.Request(
-            response.urljoin(next_page),
-            callback=self.parse
-          )
+        href = article_name.xpath('@href').extract_first()
+        if href:
+          next_page = response.urljoin(href.strip())
+          if self.getArticleId(next_page):
+            request = self.articleRequest(next_page)
+          else:
+            request = scrapy.Request(next_page, callback=self.parse)
+          if request:
+            yield request
+    elif self.getArticleId(response.url):
+      for item in self.parseArticle(response):
+        yield item
+
+  def parseArticle(self, response):
+    articleId = response.meta.get('article_id') or self.getArticleId(response.url)
+    record = dict(self.state.get(articleId, {}), url=response.url, checked=time.time())
+    if response.status == 304:
+      self.unchanged += 1
     else:
       title, intro, body = self.getWebPageText(response)
-      filePath = os.path.join('/home/peregfe/projects/Entrepreneur/data/documents/new/' + self.lang, response.url.split('/')[-1] + '.txt')
-      with open(filePath, 'w') as f:
-        f.write(title + '\n' + intro + '\n' + body)
-      self.log('Saved file %s' % filePath)
\ No newline at end of file
+      text = title + '\n' + intro + '\n' + body
+      digest = hashlib.sha1(text.encode('utf-8')).hexdigest()
+      filePath = os.path.join(self.output_dir, articleId + '.txt')
+      if digest != record.get('sha1') or not os.path.isfile(filePath):
+        with open(filePath, 'w') as f:
+          f.write(text)
+        self.recordChanged(filePath)
+        self.log('Saved file %s' % filePath)
+      else:
+        self.unchanged += 1
+      etag = response.headers.get('ETag')
+      lastModified = response.headers.get('Last-Modified')
+      record.update(path=filePath, sha1=digest,
+                    etag=etag.decode('latin-1') if etag else None,
+                    last_modified=lastModified.decode('latin-1') if lastModified else None)
+    self.state[articleId] = record
+    self.processed += 1
+    if self.processed % 100 == 0:  # so an interrupted crawl can be resumed
+      self.saveState()
+    return []
+
+  def closed(self, reason):
+    self.saveState()
+    self.log('%d new or changed articles, %d unchanged (%s)' % (len(self.changed), self.unchanged, reason))
\ No newline at end of file
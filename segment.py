@@ -0,0 +1,734 @@
+#!/usr/bin/env python
+
+'''
+Compressed on-disk segment with the inverted index of a term model (BM25, TfIdf or SparseTfIdf), read through
+mmap, so a serving process opens it in milliseconds and the workers share the pages of the OS cache.
+
+A segment file has these sections, each one starting at a multiple of 8 bytes:
+    header: magic (MAGIC for BM25, TFIDF_MAGIC for Tf-Idf), number of documents, terms and blocks, total length
+    of the documents, offset of every section, k1 and b (little-endian, 0 in a Tf-Idf segment)
+    names: num_docs + 1 int64 offsets followed by the UTF-8 names of the documents
+    lengths: int32 length of each document
+    postings: for each term, its document identifiers (the first one and then the gaps between them) as varints,
+    followed by one byte per posting with its quantized term frequency (BM25) or by its exact counts as varints
+    (Tf-Idf)
+    dictionary: the terms sorted by their UTF-8 bytes, each one as a varint with its length, its bytes, and varints
+    with its document frequency, its collection frequency, the offset of its postings and the size of its
+    identifiers, followed by its BM25 upper bound as a float64 (BM25) or by the size of its counts as a varint
+    (Tf-Idf)
+    blocks: int64 offset in the dictionary of every BLOCK_SIZE-th term, the sparse lookup table where a term is
+    searched by bisection before scanning its block
+
+The term frequencies up to 128 are exact, the higher ones are rounded to 4% steps (they barely change
+a BM25 score). The upper bounds are computed with the quantized frequencies, so MaxScore stays exact.
+A Tf-Idf segment keeps the counts and the lengths of the documents, which are normalized when the queries
+are scored, so its scores are the ones of the model it was written from.
+
+python segment.py data/models/en/bm25.seg
+python segment.py data/models/en/tfidf.seg
+'''
+
+import argparse
+import collections
+import mmap
+import os
+import pickle
+import struct
+import sys
+import time
+from array import array
+import numpy
+from cache import LRUCache
+from tfidf import BM25, SparseTfIdf, TfIdf
+
+
+MAGIC = b'SKYSEG01'
+TFIDF_MAGIC = b'SKYTFI01'
+HEADER = struct.Struct('<8s9q2d')
+BLOCK_SIZE = 32
+TF_EXACT = 128
+TF_STEP = 1.04
+# term frequency of each quantized byte: 1..128, then 4% steps
+TF_TABLE = numpy.concatenate([numpy.arange(1, TF_EXACT + 1, dtype=numpy.float64),
+                              numpy.round(TF_EXACT * TF_STEP ** numpy.arange(1, 256 - TF_EXACT + 1))])
+TF_VALUES = TF_TABLE.tolist()
+SMALL_POSTINGS = 128  # lists of identifiers up to this size (in bytes) are decoded without NumPy
+
+
+def quantize_tf(tfs):
+    '''
+    It compresses term frequencies (>= 1) in one byte each
+    :param tfs: Numpy array with the term frequencies
+    :return: Numpy array of bytes, whose term frequencies are TF_TABLE[bytes]
+    '''
+    tfs = numpy.asarray(tfs, dtype=numpy.float64)
+    steps = numpy.ceil(numpy.log(numpy.maximum(tfs, TF_EXACT) / TF_EXACT) / numpy.log(TF_STEP) - 1e-9)
+    codes = numpy.where(tfs <= TF_EXACT, tfs - 1, TF_EXACT - 1 + steps)
+    codes = numpy.clip(codes, 0, 255).astype(numpy.uint8)
+    # the closest of the two candidate bytes
+    lower = numpy.maximum(codes.astype(numpy.int64) - 1, 0)
+    closer = numpy.abs(TF_TABLE[lower] - tfs) < numpy.abs(TF_TABLE[codes] - tfs)
+    codes[closer] = lower[closer]
+    return codes
+
+
+def encode_varints(values):
+    '''
+    It encodes non-negative integers as varints (7 bits per byte, the high bit set in all the bytes but the last one)
+    :param values: Numpy array with the integers
+    :return: bytes with the encoded integers
+    '''
+    values = numpy.asarray(values, dtype=numpy.uint64)
+    if len(values) == 0:
+        return b''
+    sizes = numpy.ones(len(values), dtype=numpy.int64)
+    for shift in range(7, 64, 7):
+        sizes += values >= numpy.uint64(1 << shift)
+    starts = numpy.cumsum(sizes) - sizes
+    out = numpy.empty(int(sizes.sum()), dtype=numpy.uint8)
+    for j in range(int(sizes.max())):
+        chosen = numpy.flatnonzero(sizes > j)
+        chunk = (values[chosen] >> numpy.uint64(7 * j)) & numpy.uint64(0x7f)
+        more = (sizes[chosen] > j + 1).astype(numpy.uint64) << numpy.uint64(7)
+        out[starts[chosen] + j] = chunk | more
+    return out.tobytes()
+
+
+def decode_varints(data):
+    '''
+    It decodes a sequence of varints
+    :param data: Numpy array of bytes with the encoded integers
+    :return: Numpy array (int64) with the integers
+    '''
+    last = data < 128
+    if last.all():  # every integer has one byte
+        return data.astype(numpy.int64)
+    ends = numpy.flatnonzero(last)
+    starts = numpy.concatenate([[0], ends[:-1] + 1])
+    group = numpy.cumsum(last) - last
+    shifts = (numpy.arange(len(data)) - starts[group]) * 7
+    return numpy.add.reduceat((data & 0x7f).astype(numpy.int64) << shifts, starts)
+
+
+def decode_gaps(data):
+    '''
+    It decodes a short sequence of varints with the gaps between document identifiers. It is faster than
+    decode_varints for the lists of a few postings, which are most of them
+    :param data: bytes with the encoded gaps
+    :return: List with the document identifiers
+    '''
+    ids = []
+    value = shift = total = 0
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        if byte < 128:
+            total += value
+            ids.append(total)
+            value = shift = 0
+        else:
+            shift += 7
+    return ids
+
+
+def read_varint(buf, pos):
+    '''
+    It decodes the varint which starts at the given position
+    :return: Tuple with the integer and the position after it
+    '''
+    value = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 128:
+            return value, pos
+        shift += 7
+
+
+def write_varint(value):
+    out = bytearray()
+    while value >= 128:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def decode_segment(model):
+    '''
+    It gets the in-memory model of a segment, which documents can be added to
+    :param model: A model read from a segment (SegmentBM25, SegmentTfIdf or SegmentSparseTfIdf) or an in-memory one
+    :return: BM25, TfIdf or SparseTfIdf (the given model if it is not a segment)
+    '''
+    if isinstance(model, SegmentBM25):
+        return model.to_bm25()
+    if isinstance(model, (SegmentTfIdf, SegmentSparseTfIdf)):
+        return model.to_tfidf()
+    return model
+
+
+def term_counts(model):
+    '''
+    It gets the postings of every term of an in-memory model
+    :param model: BM25, TfIdf or SparseTfIdf
+    :return: dictionary with the Numpy arrays (int64) of the document identifiers and of the counts of each term
+    '''
+    if isinstance(model, BM25):
+        return {w: (numpy.frombuffer(ids, dtype=numpy.int32).astype(numpy.int64),
+                    numpy.frombuffer(model.tfs[w], dtype=numpy.int32).astype(numpy.int64))
+                for w, ids in model.doc_ids.items()}
+    if isinstance(model, SparseTfIdf):
+        matrix = model.build_matrix()
+        counts = numpy.rint(matrix.data).astype(numpy.int64)
+        return {w: (matrix.indices[matrix.indptr[i]:matrix.indptr[i + 1]].astype(numpy.int64),
+                    counts[matrix.indptr[i]:matrix.indptr[i + 1]])
+                for i, w in enumerate(model.vocabulary)}
+    return {w: (numpy.array([doc_id for doc_id, count in postings], dtype=numpy.int64),
+                numpy.array([count for doc_id, count in postings], dtype=numpy.int64))
+            for w, postings in model.postings.items()}
+
+
+def write_segment(file_path, model):
+    '''
+    It writes the inverted index of a term model in a segment file: a BM25 model with its quantized frequencies
+    and upper bounds, a Tf-Idf one (TfIdf or SparseTfIdf) with its exact counts. The file is written through
+    a temporary file, so the processes which have the previous segment mapped keep reading it
+    :param file_path: String with the path of the segment
+    :param model: The term model (or the segment model it was read into)
+    :return: None
+    '''
+    model = decode_segment(model)
+    bm25 = isinstance(model, BM25)
+    num_docs = len(model.documents)
+    doc_len = numpy.frombuffer(model.doc_len, dtype=numpy.int32) if num_docs else numpy.zeros(0, dtype=numpy.int32)
+    if bm25:
+        model.update_statistics()
+        norms = numpy.frombuffer(model.norms, dtype=numpy.float64) if num_docs else numpy.zeros(0)
+    postings = term_counts(model)
+    terms = sorted(postings, key=lambda w: w.encode('utf-8'))
+    names = [name.encode('utf-8') for name in model.documents]
+
+    def pad(f):
+        f.write(b'\0' * (-f.tell() % 8))
+        return f.tell()
+
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(b'\0' * HEADER.size)
+        names_offset = f.tell()
+        f.write(numpy.concatenate([[0], numpy.cumsum([len(name) for name in names], dtype=numpy.int64)])
+                .astype('<i8').tobytes())
+        f.write(b''.join(names))
+        lengths_offset = pad(f)
+        f.write(doc_len.astype('<i4').tobytes())
+
+        postings_offset = pad(f)
+        dictionary = bytearray()
+        blocks = []
+        for i, w in enumerate(terms):
+            ids, tfs = postings[w]
+            encoded = encode_varints(numpy.diff(ids, prepend=0))
+            offset = f.tell() - postings_offset
+            f.write(encoded)
+            if bm25:
+                codes = quantize_tf(tfs)
+                quantized = TF_TABLE[codes]
+                idf = model.idf[w]
+                upper_bound = (idf * quantized * (model.k1 + 1) / (quantized + norms[ids])).max() * (1 + 1e-9)
+                f.write(codes.tobytes())
+            else:
+                counts = encode_varints(tfs)
+                f.write(counts)
+            if i % BLOCK_SIZE == 0:
+                blocks.append(len(dictionary))
+            term = w.encode('utf-8')
+            dictionary += write_varint(len(term)) + term
+            for value in (len(ids), int(tfs.sum()), offset, len(encoded)):
+                dictionary += write_varint(value)
+            dictionary += struct.pack('<d', upper_bound) if bm25 else write_varint(len(counts))
+
+        dictionary_offset = pad(f)
+        f.write(dictionary)
+        blocks_offset = pad(f)
+        f.write(numpy.array(blocks, dtype='<i8').tobytes())
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC if bm25 else TFIDF_MAGIC, num_docs, len(terms), len(blocks), int(doc_len.sum()),
+                            names_offset, lengths_offset, postings_offset, dictionary_offset, blocks_offset,
+                            model.k1 if bm25 else 0.0, model.b if bm25 else 0.0))
+    os.replace(tmp_path, file_path)
+
+
+class SegmentNames:
+    '''
+    Sequence with the names of the documents of a segment, decoded when they are read
+    '''
+
+    def __init__(self, buf, offset, size):
+        self.buf = buf
+        self.offsets = numpy.frombuffer(buf, dtype='<i8', count=size + 1, offset=offset)
+        self.start = offset + 8 * (size + 1)
+        self.size = size
+
+
+    def __len__(self):
+        return self.size
+
+
+    def __getitem__(self, doc):
+        if isinstance(doc, slice):
+            return [self[i] for i in range(*doc.indices(self.size))]
+        if doc < 0:
+            doc += self.size
+        if not 0 <= doc < self.size:
+            raise IndexError('document out of range')
+        begin, end = self.offsets[doc:doc + 2]
+        return self.buf[self.start + int(begin):self.start + int(end)].decode('utf-8')
+
+
+    def __iter__(self):
+        return (self[doc] for doc in range(self.size))
+
+
+class Segment:
+    '''
+    Memory-mapped reader of a segment file
+    '''
+
+    def __init__(self, file_path):
+        '''
+        Class contructor
+        :param file_path: String with the path of the segment
+        '''
+        self.file_path = file_path
+        with open(file_path, 'rb') as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.num_docs, self.num_terms, num_blocks, self.total_len, names_offset, lengths_offset,
+         self.postings_offset, self.dictionary_offset, blocks_offset, self.k1, self.b) = HEADER.unpack_from(self.buf)
+        if magic not in (MAGIC, TFIDF_MAGIC):
+            raise ValueError('%s is not a segment file' % file_path)
+        self.exact = magic == TFIDF_MAGIC  # the counts are varints, not quantized bytes
+        self.names = SegmentNames(self.buf, names_offset, self.num_docs)
+        self.doc_len = numpy.frombuffer(self.buf, dtype='<i4', count=self.num_docs, offset=lengths_offset)
+        self.blocks = numpy.frombuffer(self.buf, dtype='<i8', count=num_blocks, offset=blocks_offset)
+
+
+    @staticmethod
+    def exists(file_path):
+        return os.path.isfile(file_path)
+
+
+    def read_entry(self, pos):
+        '''
+        It decodes the dictionary entry which starts at the given position (relative to the dictionary)
+        :return: Tuple with the term (as bytes), the document frequency, the collection frequency, the offset of
+        the postings, the size of the identifiers, the upper bound (0 in a Tf-Idf segment), the size of the
+        frequencies and the position of the next entry
+        '''
+        buf = self.buf
+        pos += self.dictionary_offset
+        size, pos = read_varint(buf, pos)
+        term = buf[pos:pos + size]
+        pos += size
+        df, pos = read_varint(buf, pos)
+        cf, pos = read_varint(buf, pos)
+        offset, pos = read_varint(buf, pos)
+        ids_size, pos = read_varint(buf, pos)
+        if self.exact:
+            tfs_size, pos = read_varint(buf, pos)
+            return term, df, cf, offset, ids_size, 0.0, tfs_size, pos - self.dictionary_offset
+        upper_bound, = struct.unpack_from('<d', buf, pos)
+        return term, df, cf, offset, ids_size, upper_bound, df, pos + 8 - self.dictionary_offset
+
+
+    def read_term(self, pos):
+        size, pos = read_varint(self.buf, pos + self.dictionary_offset)
+        return self.buf[pos:pos + size]
+
+
+    def lookup(self, term):
+        '''
+        It searches a term: the block is found by bisection over the first terms of the blocks, and then it is scanned
+        :param term: String with the term
+        :return: The entry of the term (see read_entry) or None if it is not in the segment
+        '''
+        key = term.encode('utf-8')
+        low, high = 0, len(self.blocks)
+        while low < high:  # the last block whose first term is <= key
+            middle = (low + high) // 2
+            if self.read_term(int(self.blocks[middle])) <= key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == 0:
+            return None
+        pos = int(self.blocks[low - 1])
+        for _ in range(min(BLOCK_SIZE, self.num_terms - (low - 1) * BLOCK_SIZE)):
+            entry = self.read_entry(pos)
+            if entry[0] == key:
+                return entry
+            if entry[0] > key:
+                return None
+            pos = entry[-1]
+        return None
+
+
+    def entries(self):
+        '''
+        It iterates over all the dictionary entries, in the order of the terms
+        '''
+        pos = 0
+        for _ in range(self.num_terms):
+            entry = self.read_entry(pos)
+            yield entry
+            pos = entry[-1]
+
+
+    def decode(self, entry):
+        '''
+        It decodes the postings of a dictionary entry
+        :return: Tuple with an array of the document identifiers and the bytes of the term frequencies
+        (quantized in a BM25 segment, varints in a Tf-Idf one, see counts)
+        '''
+        term, df, cf, offset, ids_size, upper_bound, tfs_size = entry[:7]
+        start = self.postings_offset + offset
+        if ids_size <= SMALL_POSTINGS:
+            ids = array('i', decode_gaps(self.buf[start:start + ids_size]))
+        else:
+            data = numpy.frombuffer(self.buf, dtype=numpy.uint8, count=ids_size, offset=start)
+            ids = array('i', numpy.cumsum(decode_varints(data)).astype(numpy.int32).tobytes())
+        return ids, self.buf[start + ids_size:start + ids_size + tfs_size]
+
+
+    def counts(self, data):
+        '''
+        It decodes the term frequencies returned by decode
+        :return: Numpy array (float64) with the frequency of each posting
+        '''
+        codes = numpy.frombuffer(data, dtype=numpy.uint8)
+        if self.exact:
+            return decode_varints(codes).astype(numpy.float64)
+        return TF_TABLE[codes]
+
+
+    def postings(self, term):
+        '''
+        It gets the postings of a term
+        :return: Numpy arrays with the document identifiers and the term frequencies, empty if the term is missing
+        '''
+        entry = self.lookup(term)
+        if entry is None:
+            return numpy.empty(0, dtype=numpy.int64), numpy.empty(0)
+        ids, data = self.decode(entry)
+        return numpy.array(ids, dtype=numpy.int64), self.counts(data)
+
+
+class SegmentBM25(BM25):
+    '''
+    BM25 model whose inverted index is read from a segment. The decoded postings of the most recent terms are cached
+    '''
+
+    def __init__(self, file_path, cache_size=4096):
+        '''
+        Class contructor
+        :param file_path: String with the path of the segment
+        :param cache_size: Integer with the number of terms whose decoded postings are kept
+        '''
+        self.segment = Segment(file_path)
+        if self.segment.exact:
+            raise ValueError('%s is not a BM25 segment' % file_path)
+        BM25.__init__(self, self.segment.k1, self.segment.b)
+        self.documents = self.segment.names
+        self.doc_len = self.segment.doc_len
+        self.total_len = self.segment.total_len
+        avg_len = self.total_len / float(len(self.documents)) if len(self.documents) else 1.0
+        norms = self.k1 * (1.0 - self.b + self.b * self.doc_len / max(avg_len, 1e-9))
+        self.norms = array('d', norms.astype(numpy.float64).tobytes())
+        self.terms = LRUCache(cache_size)
+        self.dirty = False
+
+
+    def get_term(self, w):
+        '''
+        It gets the idf, the upper bound and the postings of a term, from the cache or from the segment
+        :return: Tuple as term_postings or False if the term is not in the segment
+        '''
+        cached = self.terms.get(w)
+        if cached is not None:
+            return cached
+        entry = self.segment.lookup(w)
+        if entry is None:
+            cached = False
+        else:
+            ids, codes = self.segment.decode(entry)
+            df = entry[1]
+            num_docs = len(self.documents)
+            idf = float(numpy.log(1.0 + (num_docs - df + 0.5) / (df + 0.5)))
+            cached = (idf, entry[5], ids, [TF_VALUES[code] for code in codes])
+        self.terms.put(w, cached)
+        return cached
+
+
+    def has_term(self, w):
+        return self.get_term(w) is not False
+
+
+    def term_postings(self, w):
+        return self.get_term(w)
+
+
+    def update_statistics(self):
+        pass
+
+
+    def add_document(self, doc_name, list_of_words):
+        raise TypeError('a segment is read-only, add the documents to the model returned by to_bm25')
+
+
+    def __getstate__(self):
+        raise TypeError('a segment can not be pickled, use write_segment')
+
+
+    def to_bm25(self):
+        '''
+        It decodes the whole segment in an in-memory BM25 model (the quantized term frequencies are rounded)
+        :return: BM25
+        '''
+        model = BM25(self.k1, self.b)
+        model.documents = list(self.documents)
+        model.doc_len = array('i', self.doc_len.astype(numpy.int32).tobytes())
+        model.total_len = self.total_len
+        for entry in self.segment.entries():
+            ids, codes = self.segment.decode(entry)
+            w = entry[0].decode('utf-8')
+            model.doc_ids[w] = ids
+            model.tfs[w] = array('i', [int(TF_VALUES[code]) for code in codes])
+        return model
+
+
+def open_tfidf_segment(file_path):
+    '''
+    It opens a Tf-Idf segment
+    :param file_path: String with the path of the segment
+    :return: Segment
+    '''
+    segment = Segment(file_path)
+    if not segment.exact:
+        raise ValueError('%s is not a Tf-Idf segment' % file_path)
+    return segment
+
+
+class SegmentTfIdf(TfIdf):
+    '''
+    TfIdf model whose postings are read from a segment. The decoded postings of the most recent terms are cached
+    '''
+
+    def __init__(self, file_path, cache_size=4096):
+        '''
+        Class contructor
+        :param file_path: String with the path of the segment
+        :param cache_size: Integer with the number of terms whose decoded postings are kept
+        '''
+        TfIdf.__init__(self)
+        self.segment = open_tfidf_segment(file_path)
+        self.documents = self.segment.names
+        self.doc_len = array('i', self.segment.doc_len.astype(numpy.int32).tobytes())  # plain integers are faster
+        self.terms = LRUCache(cache_size)
+
+
+    def term_postings(self, w):
+        '''
+        It gets the corpus frequency and the (doc_id, count) postings of a term, from the cache or from the segment
+        :return: Tuple as TfIdf.term_postings or None if the term is not in the segment
+        '''
+        cached = self.terms.get(w)
+        if cached is not None:
+            return cached or None
+        entry = self.segment.lookup(w)
+        if entry is None:
+            cached = False
+        else:
+            ids, data = self.segment.decode(entry)
+            cached = (float(entry[2]), list(zip(ids, self.segment.counts(data).astype(numpy.int64).tolist())))
+        self.terms.put(w, cached)
+        return cached or None
+
+
+    def add_document(self, doc_name, list_of_words):
+        raise TypeError('a segment is read-only, add the documents to the model returned by to_tfidf')
+
+
+    def __getstate__(self):
+        raise TypeError('a segment can not be pickled, use write_segment')
+
+
+    def to_tfidf(self):
+        '''
+        It decodes the whole segment in an in-memory TfIdf model
+        :return: TfIdf
+        '''
+        model = TfIdf()
+        model.documents = list(self.documents)
+        model.doc_len = array('i', self.doc_len)
+        for entry in self.segment.entries():
+            ids, data = self.segment.decode(entry)
+            w = entry[0].decode('utf-8')
+            model.corpus_dict[w] = float(entry[2])
+            model.postings[w] = list(zip(ids, self.segment.counts(data).astype(numpy.int64).tolist()))
+        return model
+
+
+class SegmentSparseTfIdf(SparseTfIdf):
+    '''
+    SparseTfIdf model whose postings are read from a segment: the queries are scored with the decoded postings
+    of their terms instead of the rows of the matrix. The decoded postings of the most recent terms are cached
+    '''
+
+    def __init__(self, file_path, scoring='compat', cache_size=4096):
+        '''
+        Class contructor
+        :param file_path: String with the path of the segment
+        :param scoring: String with the scoring of SparseTfIdf ('compat' or 'tfidf')
+        :param cache_size: Integer with the number of terms whose decoded postings are kept
+        '''
+        SparseTfIdf.__init__(self, scoring)
+        self.segment = open_tfidf_segment(file_path)
+        self.documents = self.segment.names
+        self.doc_len = array('i', self.segment.doc_len.astype(numpy.int32).tobytes())
+        self.terms = LRUCache(cache_size)
+
+
+    def get_term(self, w):
+        '''
+        It gets the statistics and the postings of a term, from the cache or from the segment
+        :return: Tuple with the document frequency, the corpus frequency, the document identifiers and the
+        normalized term frequencies, or False if the term is not in the segment
+        '''
+        cached = self.terms.get(w)
+        if cached is not None:
+            return cached
+        entry = self.segment.lookup(w)
+        if entry is None:
+            cached = False
+        else:
+            ids, data = self.segment.decode(entry)
+            ids = numpy.array(ids, dtype=numpy.int64)
+            cached = (entry[1], float(entry[2]), ids, self.segment.counts(data) / self.segment.doc_len[ids])
+        self.terms.put(w, cached)
+        return cached
+
+
+    def scores(self, list_of_words, doc_ids=None):
+        '''
+        It scores the documents as SparseTfIdf.scores, adding up the postings of the query terms
+        :return: Numpy array with the score of every document, or only of the documents in doc_ids
+        '''
+        scores = numpy.zeros(len(self.documents))
+        counts = collections.Counter(w for w in list_of_words if self.get_term(w) is not False)
+        for w, count in counts.items():
+            df, cf, ids, weights = self.get_term(w)
+            query_tf = count / float(len(list_of_words))
+            if self.scoring == 'compat':
+                scores[ids] += weights / cf + query_tf / cf
+            else:
+                idf = numpy.log(len(self.documents) / float(df))
+                scores[ids] += weights * query_tf * idf * idf
+        return scores if doc_ids is None else scores[numpy.asarray(doc_ids, dtype=numpy.int64)]
+
+
+    def add_document(self, doc_name, list_of_words):
+        raise TypeError('a segment is read-only, add the documents to the model returned by to_tfidf')
+
+
+    def __getstate__(self):
+        raise TypeError('a segment can not be pickled, use write_segment')
+
+
+    def to_tfidf(self):
+        '''
+        It decodes the whole segment in an in-memory SparseTfIdf model
+        :return: SparseTfIdf
+        '''
+        model = SparseTfIdf(self.scoring)
+        model.documents = list(self.documents)
+        model.doc_len = array('i', self.doc_len)
+        for entry in self.segment.entries():
+            ids, data = self.segment.decode(entry)
+            term_id = len(model.vocabulary)
+            w = entry[0].decode('utf-8')
+            model.term_ids[w] = term_id
+            model.vocabulary.append(w)
+            model.corpus_freq.append(float(entry[2]))
+            model.doc_freq.append(entry[1])
+            model.new_rows.extend([term_id] * len(ids))
+            model.new_cols.extend(ids)
+            model.new_data.extend(self.segment.counts(data).tolist())
+        return model
+
+
+def load_segment(file_path):
+    '''
+    It opens a segment with the model it was written from
+    :param file_path: String with the path of the segment
+    :return: SegmentBM25 or SegmentTfIdf
+    '''
+    if Segment(file_path).exact:
+        return SegmentTfIdf(file_path)
+    return SegmentBM25(file_path)
+
+
+def segment_stats(file_path):
+    '''
+    It measures the size of a segment (BM25 or Tf-Idf), the time to open it and the time to decode all its postings
+    :param file_path: String with the path of the segment
+    :return: dictionary with the measures
+    '''
+    start = time.perf_counter()
+    model = load_segment(file_path)
+    open_time = time.perf_counter() - start
+    segment = model.segment
+
+    start = time.perf_counter()
+    num_postings = ids_bytes = 0
+    for entry in segment.entries():
+        ids, codes = segment.decode(entry)
+        num_postings += len(ids)
+        ids_bytes += entry[4]
+    decode_time = max(time.perf_counter() - start, 1e-9)
+
+    postings_bytes = segment.dictionary_offset - segment.postings_offset
+    return {'model': 'tfidf' if segment.exact else 'bm25',
+            'documents': segment.num_docs,
+            'terms': segment.num_terms,
+            'postings': num_postings,
+            'size_bytes': os.path.getsize(file_path),
+            'pickled_bytes': len(pickle.dumps(decode_segment(model), protocol=pickle.HIGHEST_PROTOCOL)),
+            'postings_bytes': postings_bytes,
+            'bytes_per_posting': postings_bytes / max(num_postings, 1),
+            'id_bytes_per_posting': ids_bytes / max(num_postings, 1),
+            'open_ms': open_time * 1000,
+            'decode_s': decode_time,
+            'postings_per_s': num_postings / decode_time,
+            'decode_mb_per_s': postings_bytes / decode_time / 1e6}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reports the size and the decode speed of a segment')
+    parser.add_argument('segment', help='path of the segment file (data/models/<language>/<bm25|tfidf>.seg)')
+    args = parser.parse_args()
+    if not Segment.exists(args.segment):
+        print('ERROR: ' + args.segment + ' does not exist')
+        sys.exit()
+
+    stats = segment_stats(args.segment)
+    print('%(model)s: %(documents)d documents, %(terms)d terms, %(postings)d postings' % stats)
+    print('segment: %.2f MB (pickled model: %.2f MB), postings %.2f MB: %.2f bytes per posting '
+          '(%.2f for the identifiers, %.2f for the frequency)'
+          % (stats['size_bytes'] / 1e6, stats['pickled_bytes'] / 1e6, stats['postings_bytes'] / 1e6,
+             stats['bytes_per_posting'], stats['id_bytes_per_posting'],
+             stats['bytes_per_posting'] - stats['id_bytes_per_posting']))
+    print('open: %.2f ms, decode: %.2fs, %.1f M postings/s, %.1f MB/s'
+          % (stats['open_ms'], stats['decode_s'], stats['postings_per_s'] / 1e6, stats['decode_mb_per_s']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+'''
+Per language store with the sentences of every document and their lemmas, built offline by getting_sentences.py,
+so the snippets can be generated at query time without reading the articles or calling NLTK and FreeLing.
+
+A store directory has these files:
+    text.bin: the UTF-8 text of all the sentences, one after the other
+    lemmas.bin: the lemma identifiers of all the sentences as little-endian int32
+    sentences.bin: a record of four little-endian int64 per sentence (text offset, text length, lemmas offset, lemmas count)
+    docs.tsv: one line per document with its name, its first sentence and its number of sentences
+    vocab.txt: one lemma per line, its identifier is the line number
+The three .bin files are memory-mapped, so only the pages of the documents being rendered are loaded.
+'''
+
+import mmap
+import struct
+import collections
+from os import makedirs
+from os.path import join, isfile
+
+
+SENTENCE_RECORD = struct.Struct('<4q')
+LEMMA_ID = struct.Struct('<i')
+
+
+class SentenceStoreWriter:
+    '''
+    It writes a sentence store, one document at a time
+    '''
+
+    def __init__(self, store_dir):
+        '''
+        Class contructor
+        :param store_dir: String with the directory where the store will be written
+        '''
+        makedirs(store_dir, exist_ok=True)
+        self.store_dir = store_dir
+        self.vocab = {}
+        self.docs = []
+        self.n_sentences = 0
+        self.text_offset = 0
+        self.lemmas_offset = 0
+        self.text_file = open(join(store_dir, 'text.bin'), 'wb')
+        self.lemmas_file = open(join(store_dir, 'lemmas.bin'), 'wb')
+        self.sentences_file = open(join(store_dir, 'sentences.bin'), 'wb')
+
+
+    def add_document(self, doc_name, sentences, lemmatized_sentences):
+        '''
+        It appends a document to the store
+        :param doc_name: String with the name of the document file
+        :param sentences: List of strings with the original sentences of the document
+        :param lemmatized_sentences: List of strings with the lemmas of each sentence separated by spaces
+        :return: None
+        '''
+        self.docs.append((doc_name, self.n_sentences, len(sentences)))
+        for sentence, lemmas in zip(sentences, lemmatized_sentences):
+            text = sentence.encode('utf-8')
+            ids = [self.vocab.setdefault(lemma, len(self.vocab)) for lemma in lemmas.split()]
+            self.text_file.write(text)
+            self.lemmas_file.write(struct.pack('<%di' % len(ids), *ids))
+            self.sentences_file.write(SENTENCE_RECORD.pack(self.text_offset, len(text), self.lemmas_offset, len(ids)))
+            self.text_offset += len(text)
+            self.lemmas_offset += len(ids)
+            self.n_sentences += 1
+
+
+    def close(self):
+        '''
+        It writes the documents table and the vocabulary and closes the store
+        :return: None
+        '''
+        self.text_file.close()
+        self.lemmas_file.close()
+        self.sentences_file.close()
+        with open(join(self.store_dir, 'docs.tsv'), 'w') as f:
+            for doc_name, first, count in self.docs:
+                f.write('%s\t%d\t%d\n' % (doc_name, first, count))
+        with open(join(self.store_dir, 'vocab.txt'), 'w') as f:
+            for lemma in sorted(self.vocab, key=self.vocab.get):
+                f.write(lemma + '\n')
+
+
+class SentenceStore:
+    '''
+    Memory-mapped reader of a sentence store
+    '''
+
+    def __init__(self, store_dir):
+        '''
+        Class contructor
+        :param store_dir: String with the directory where the store is
+        '''
+        self.store_dir = store_dir
+        self.docs = {}
+        with open(join(store_dir, 'docs.tsv')) as f:
+            for line in f:
+                doc_name, first, count = line.rstrip('\n').split('\t')
+                self.docs[doc_name] = (int(first), int(count))
+        with open(join(store_dir, 'vocab.txt')) as f:
+            self.vocab = {lemma.rstrip('\n'): i for i, lemma in enumerate(f)}
+        self.text = self.map_file('text.bin')
+        self.lemmas = self.map_file('lemmas.bin')
+        self.sentences = self.map_file('sentences.bin')
+
+
+    def map_file(self, file_name):
+        '''
+        It maps the given file of the store into memory
+        :param file_name: String with the name of the file
+        :return: A read only mmap of the file (an empty bytes object if the file is empty)
+        '''
+        with open(join(self.store_dir, file_name), 'rb') as f:
+            try:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty files can not be mapped
+                return b''
+
+
+    @staticmethod
+    def exists(store_dir):
+        return isfile(join(store_dir, 'docs.tsv'))
+
+
+    def __contains__(self, doc_name):
+        return doc_name in self.docs
+
+
+    def records(self, doc_name):
+        first, count = self.docs[doc_name]
+        for i in range(first, first + count):
+            yield SENTENCE_RECORD.unpack_from(self.sentences, i * SENTENCE_RECORD.size)
+
+
+    def get_sentences(self, doc_name):
+        '''
+        It gets the original sentences of a document
+        :param doc_name: String with the name of the document file
+        :return: List of strings with the sentences
+        '''
+        return [self.text[offset:offset + length].decode('utf-8') for offset, length, _, _ in self.records(doc_name)]
+
+
+    def get_lemma_ids(self, doc_name):
+        '''
+        It gets the lemma identifiers of every sentence of a document
+        :param doc_name: String with the name of the document file
+        :return: List with a tuple of lemma identifiers for each sentence
+        '''
+        return [struct.unpack_from('<%di' % count, self.lemmas, offset * LEMMA_ID.size)
+                for _, _, offset, count in self.records(doc_name)]
+
+
+    def get_terms_pos(self, doc_name, l_query):
+        '''
+        It finds, for each sentence of a document, the positions of the lemmas which match with the query terms.
+        A lemma is repeated as many times as it appears in the query, as SkyScanner.get_positions does
+        :param doc_name: String with the name of the document file
+        :param l_query: String with the lemmatized query
+        :return: Two-dimensional list where the first dimension represent each sentence and the second the
+        positions of the lemmas which matched with the query
+        '''
+        query_ids = collections.Counter(self.vocab[term] for term in l_query.split() if term in self.vocab)
+        terms_pos = []
+        for ids in self.get_lemma_ids(doc_name):
+            terms_pos.append([i for i, lemma_id in enumerate(ids) for _ in range(query_ids.get(lemma_id, 0))])
+        return terms_pos
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+'''
+HTTP search service. It loads the SkyScanner models once and serves them with an asyncio front end:
+    GET /search?q=<query>&lang=<en|es|english|spanish>&k=<number of results>
+    GET /health
+    GET /metrics (the histograms of the query stages, with --metrics, the cache counters and the load stats
+    of the languages)
+The queries are run by a pool of threads (FreeLing calls and scoring never block the event loop)
+and the results are returned as JSON: {"query": ..., "language": ..., "results": [{"url", "title", "snippet", "score"}]}
+
+python server.py --project-dir /home/peregfe/projects/Entrepreneur --port 8080
+'''
+
+import asyncio
+import argparse
+import json
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+from SkyScanner import SkyScanner
+
+
+MAX_RESULTS = 100
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class SearchServer:
+    '''
+    asyncio HTTP server which runs the queries of a SkyScanner in a pool of threads
+    '''
+
+    def __init__(self, search_engine, workers=8):
+        '''
+        Class contructor
+        :param search_engine: SkyScanner instance with the models loaded
+        :param workers: Integer with the number of threads which run the queries
+        '''
+        self.search_engine = search_engine
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.languages = dict(search_engine.ext_lang)
+        self.languages.update({code: language for language, code in search_engine.ext_lang.items()})
+
+
+    async def handle(self, reader, writer):
+        '''
+        It serves one HTTP request and closes the connection
+        :param reader: asyncio.StreamReader of the connection
+        :param writer: asyncio.StreamWriter of the connection
+        :return: None
+        '''
+        try:
+            request_line = await reader.readline()
+            while True:  # the headers are not used
+                header = await reader.readline()
+                if header in (b'\r\n', b'\n', b''):
+                    break
+            parts = request_line.decode('latin-1').split()
+            if len(parts) != 3:
+                status, body = 400, {'error': 'malformed request'}
+            elif parts[0] != 'GET':
+                status, body = 405, {'error': 'only GET is allowed'}
+            else:
+                status, body = await self.route(parts[1])
+        except Exception as e:
+            status, body = 500, {'error': str(e)}
+        data = json.dumps(body).encode('utf-8')
+        writer.write(('HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: close\r\n\r\n'
+                      % (status, REASONS[status], len(data))).encode('latin-1') + data)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+    async def route(self, target):
+        '''
+        It runs the endpoint of the given request target
+        :param target: String with the path and the query string of the request
+        :return: The HTTP status and the object to be sent as JSON
+        '''
+        url = urlsplit(target)
+        if url.path == '/health':
+            return 200, {'status': 'ok'}
+        if url.path == '/metrics':
+            return 200, dict(self.search_engine.metrics.snapshot(), caches=self.search_engine.cache_stats(),
+                             languages=self.search_engine.language_stats())
+        if url.path != '/search':
+            return 404, {'error': 'unknown path ' + url.path}
+
+        params = parse_qs(url.query)
+        query = params.get('q', [''])[0].strip()
+        if not query:
+            return 400, {'error': 'the q parameter is required'}
+        language = params.get('lang', [None])[0]
+        if language is not None:
+            if language not in self.languages:
+                return 400, {'error': 'unknown language ' + language}
+            language = language if language in self.search_engine.ext_lang else self.languages[language]
+        try:
+            top_k = int(params.get('k', ['10'])[0])
+        except ValueError:
+            return 400, {'error': 'k has to be an integer'}
+        top_k = max(0, min(top_k, MAX_RESULTS))
+
+        loop = asyncio.get_running_loop()
+        search = functools.partial(self.search_engine.search, query, language, top_k)
+        language, results = await loop.run_in_executor(self.executor, search)
+        return 200, {'query': query, 'language': language, 'results': results}
+
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port)
+        print('Serving on http://%s:%d' % (host, port))
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='SkyScanner HTTP search service')
+    parser.add_argument('--project-dir', default='/home/peregfe/projects/Entrepreneur')
+    parser.add_argument('--model', default='lsi', choices=['lsi', 'tfidf', 'bm25'])
+    parser.add_argument('--num-topics', type=int, default=100)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=8, help='threads which run the queries')
+    parser.add_argument('--metrics', action='store_true', help='record the time of each stage of the queries')
+    parser.add_argument('--slow-query-ms', type=float, help='log the queries slower than this')
+    parser.add_argument('--lazy', action='store_true', help='load the model of each language with its first query')
+    parser.add_argument('--preload', nargs='+', default=[], help='languages loaded at startup with --lazy')
+    parser.add_argument('--positional', action='store_true', help='quoted phrase queries and proximity boost')
+    parser.add_argument('--multiwords', help='multiword table applied to the documents and the queries')
+    parser.add_argument('--lsi-index', default='matrix', choices=['matrix', 'sharded'], help='how the LSI vectors are stored')
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s')
+    se = SkyScanner(project_dir=args.project_dir, num_topics=args.num_topics, model_name=args.model,
+                    freeling_pool_size=args.workers, metrics=args.metrics, slow_query_ms=args.slow_query_ms,
+                    lazy=args.lazy, preload=args.preload, positional=args.positional, multiwords=args.multiwords,
+                    lsi_index=args.lsi_index)
+    asyncio.run(SearchServer(se, args.workers).serve(args.host, args.port))
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+
+'''
+Sharded similarity search. The documents of a model are split in N shards of consecutive document identifiers,
+each one with its own files, and the queries are scattered to all the shards in a pool of processes
+(or in the calling process), which return their own top_k documents. The results are gathered and merged
+in the global ranking.
+
+LSI shards keep the unit vectors of their documents (shard-<i>.npy), so the query is projected once
+with the global LSI model and every shard scores it with a matrix product.
+Tf-Idf shards keep the postings of their documents (a CSR matrix of terms x documents split in
+shard-<i>.data.npy, shard-<i>.indices.npy and shard-<i>.indptr.npy), over the global vocabulary. The weights
+of the query terms are computed from the global statistics (vocabulary.txt and stats.npz), so the scores of
+all the shards are comparable.
+All the files are memory-mapped, so the workers share the same pages.
+'''
+
+import json
+import heapq
+import operator
+import multiprocessing
+import numpy
+from os import makedirs
+from os.path import join, isfile
+from scipy import sparse
+from segment import decode_segment
+
+
+worker_shards = {}
+
+
+def load_shards(shards_dir):
+    '''
+    It memory-maps all the shards of a directory
+    :param shards_dir: String with the directory of the shards
+    :return: dictionary with the description of the shards (shards.json) and the list of shards
+    '''
+    with open(join(shards_dir, 'shards.json')) as f:
+        info = json.load(f)
+    shards = []
+    for i in range(len(info['bounds']) - 1):
+        prefix = join(shards_dir, 'shard-%d' % i)
+        if info['kind'] == 'lsi':
+            shards.append(numpy.load(prefix + '.npy', mmap_mode='r'))
+        else:
+            arrays = [numpy.load(prefix + '.%s.npy' % name, mmap_mode='r') for name in ('data', 'indices', 'indptr')]
+            size = info['bounds'][i + 1] - info['bounds'][i]
+            shards.append(sparse.csr_matrix(tuple(arrays), shape=(info['num_terms'], size), copy=False))
+    return {'info': info, 'shards': shards}
+
+
+def init_shard_worker(shards_dir):
+    worker_shards.update(load_shards(shards_dir))
+
+
+def top_k_pairs(scores, first, top_k, min_score):
+    '''
+    It selects the top_k documents of a shard whose score is above min_score
+    :param scores: Numpy array with the score of each document of the shard
+    :param first: Integer with the global identifier of the first document of the shard
+    :return: List of (document, score) tuples, with the global document identifiers
+    '''
+    candidates = numpy.flatnonzero(scores > min_score)
+    if len(candidates) > top_k:
+        candidates = candidates[numpy.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+    return [(first + int(doc), float(scores[doc])) for doc in candidates]
+
+
+def search_shard(task, state=None):
+    '''
+    It scores several queries against one shard
+    :param task: Tuple with the shard number, the queries, top_k and min_score. The LSI queries are a Numpy array
+    (topics x queries) of unit vectors, the Tf-Idf ones a list of (term identifiers, weights of the postings,
+    weights of the matches) tuples
+    :param state: dictionary returned by load_shards (the one of the worker process if it is None)
+    :return: List with the top_k (document, score) tuples of each query
+    '''
+    state = state or worker_shards
+    shard_id, queries, top_k, min_score = task
+    shard = state['shards'][shard_id]
+    first = state['info']['bounds'][shard_id]
+    if state['info']['kind'] == 'lsi':
+        scores = numpy.asarray(shard.dot(queries.astype(shard.dtype)))  # documents x queries
+        return [top_k_pairs(scores[:, i], first, top_k, min_score) for i in range(scores.shape[1])]
+    results = []
+    for ids, tf_weights, match_weights in queries:
+        if len(ids) == 0:
+            results.append([])
+            continue
+        postings = shard[ids]  # rows of the query terms
+        scores = postings.T.dot(tf_weights) + (postings != 0).T.dot(match_weights)
+        results.append(top_k_pairs(scores, first, top_k, min_score))
+    return results
+
+
+def split_bounds(num_docs, num_shards):
+    '''
+    It splits the document identifiers in num_shards ranges of similar size
+    :return: List with the first identifier of each shard and the number of documents at the end
+    '''
+    num_shards = max(1, min(num_shards, num_docs))
+    return [int(bound) for bound in numpy.linspace(0, num_docs, num_shards + 1).round()]
+
+
+def write_lsi_shards(shards_dir, vectors, num_shards):
+    '''
+    It writes the unit vectors of the documents of a LSI model in num_shards shards
+    :param shards_dir: String with the directory where the shards are written
+    :param vectors: Numpy array (documents x topics) with the unit vectors, as MatrixSimilarity.index
+    :param num_shards: Integer with the number of shards
+    :return: None
+    '''
+    makedirs(shards_dir, exist_ok=True)
+    bounds = split_bounds(len(vectors), num_shards)
+    for i in range(len(bounds) - 1):
+        numpy.save(join(shards_dir, 'shard-%d.npy' % i), numpy.asarray(vectors[bounds[i]:bounds[i + 1]]))
+    with open(join(shards_dir, 'shards.json'), 'w') as f:
+        json.dump({'kind': 'lsi', 'bounds': bounds}, f)
+
+
+def write_tfidf_shards(shards_dir, model, num_shards):
+    '''
+    It writes the postings of a Tf-Idf model (TfIdf or SparseTfIdf) in num_shards shards, and its global statistics
+    :param shards_dir: String with the directory where the shards are written
+    :param model: The Tf-Idf model (or the segment model it was read into)
+    :param num_shards: Integer with the number of shards
+    :return: None
+    '''
+    makedirs(shards_dir, exist_ok=True)
+    model = decode_segment(model)
+    if hasattr(model, 'build_matrix'):
+        matrix = model.weights().tocsc()
+        vocabulary, scoring = model.vocabulary, model.scoring
+        corpus_freq = numpy.frombuffer(model.corpus_freq, dtype=numpy.float64)
+        doc_freq = numpy.frombuffer(model.doc_freq, dtype=numpy.int32)
+    else:
+        vocabulary, scoring = list(model.postings.keys()), 'compat'
+        rows, cols, data = [], [], []
+        for term_id, term in enumerate(vocabulary):
+            for doc_id, count in model.postings[term]:
+                rows.append(term_id)
+                cols.append(doc_id)
+                data.append(count / model.doc_len[doc_id])
+        matrix = sparse.csc_matrix((numpy.array(data, dtype=numpy.float32), (rows, cols)),
+                                   shape=(len(vocabulary), len(model.documents)))
+        corpus_freq = numpy.array([model.corpus_dict[term] for term in vocabulary], dtype=numpy.float64)
+        doc_freq = numpy.array([len(model.postings[term]) for term in vocabulary], dtype=numpy.int32)
+
+    bounds = split_bounds(len(model.documents), num_shards)
+    for i in range(len(bounds) - 1):
+        shard = matrix[:, bounds[i]:bounds[i + 1]].tocsr()
+        # the indices and indptr need the same type, otherwise scipy copies them when they are loaded
+        index_type = numpy.int32 if shard.nnz < 2 ** 31 else numpy.int64
+        prefix = join(shards_dir, 'shard-%d' % i)
+        numpy.save(prefix + '.data.npy', shard.data.astype(numpy.float32))
+        numpy.save(prefix + '.indices.npy', shard.indices.astype(index_type))
+        numpy.save(prefix + '.indptr.npy', shard.indptr.astype(index_type))
+    with open(join(shards_dir, 'vocabulary.txt'), 'w') as f:
+        f.write('\n'.join(vocabulary))
+    with open(join(shards_dir, 'stats.npz'), 'wb') as f:
+        numpy.savez(f, corpus_freq=corpus_freq, doc_freq=doc_freq)
+    with open(join(shards_dir, 'shards.json'), 'w') as f:
+        json.dump({'kind': 'tfidf', 'bounds': bounds, 'num_terms': len(vocabulary), 'scoring': scoring}, f)
+
+
+class ShardedIndex:
+    '''
+    Scatter-gather searcher over the shards of a directory
+    '''
+
+    def __init__(self, shards_dir, processes=None):
+        '''
+        Class contructor
+        :param shards_dir: String with the directory of the shards
+        :param processes: Integer with the number of worker processes (one per shard by default).
+        If it is lower than 2, the shards are searched in the calling process
+        '''
+        self.shards_dir = shards_dir
+        self.state = load_shards(shards_dir)
+        self.info = self.state['info']
+        self.num_shards = len(self.info['bounds']) - 1
+        self.size = self.info['bounds'][-1]
+        if self.info['kind'] == 'tfidf':
+            with open(join(shards_dir, 'vocabulary.txt')) as f:
+                self.term_ids = {term: i for i, term in enumerate(f.read().split('\n'))} if self.info['num_terms'] else {}
+            with numpy.load(join(shards_dir, 'stats.npz')) as stats:
+                self.corpus_freq = stats['corpus_freq']
+                self.doc_freq = stats['doc_freq']
+        processes = self.num_shards if processes is None else processes
+        self.pool = None
+        if processes > 1:
+            self.pool = multiprocessing.Pool(processes, initializer=init_shard_worker, initargs=(shards_dir,))
+
+
+    @staticmethod
+    def exists(shards_dir):
+        return isfile(join(shards_dir, 'shards.json'))
+
+
+    @staticmethod
+    def describe(shards_dir):
+        '''
+        It reads the description of the shards of a directory
+        :return: dictionary with the kind of model, the bounds of the shards...
+        '''
+        with open(join(shards_dir, 'shards.json')) as f:
+            return json.load(f)
+
+
+    def __len__(self):
+        return self.size
+
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+
+    def tfidf_query(self, list_of_words):
+        '''
+        It computes the weights of the query terms with the global statistics, as SparseTfIdf.scores
+        :param list_of_words: Cleaned query (list of terms)
+        :return: Tuple with the term identifiers, the weights of the postings and the weights of the matches
+        '''
+        counts = {}
+        for w in list_of_words:
+            if w in self.term_ids:
+                counts[w] = counts.get(w, 0) + 1
+        ids = numpy.array([self.term_ids[w] for w in counts], dtype=numpy.int64)
+        query_tf = numpy.array(list(counts.values()), dtype=numpy.float64) / max(1, len(list_of_words))
+        if self.info['scoring'] == 'compat':
+            cf = self.corpus_freq[ids]
+            return ids, 1.0 / cf, query_tf / cf
+        idf = numpy.log(self.size / self.doc_freq[ids].astype(numpy.float64))
+        return ids, query_tf * idf * idf, numpy.zeros(len(ids))
+
+
+    def search(self, queries, top_k, min_score):
+        '''
+        It scatters the queries to all the shards and merges their top_k documents
+        :param queries: The LSI queries as a Numpy array (topics x queries) of unit vectors, or the Tf-Idf queries
+        as a list of cleaned queries (lists of terms)
+        :param top_k: Integer with the maximum number of documents to retrieve for each query
+        :param min_score: Float with the minimum score (excluded) a document needs to be retrieved
+        :return: List with the (document, score) tuples of each query, sorted by score
+        '''
+        if self.info['kind'] == 'tfidf':
+            queries = [self.tfidf_query(query) for query in queries]
+            num_queries = len(queries)
+        else:
+            num_queries = queries.shape[1]
+        if top_k <= 0:
+            return [[] for _ in range(num_queries)]
+        tasks = [(i, queries, top_k, min_score) for i in range(self.num_shards)]
+        if self.pool is not None:
+            shard_results = self.pool.map(search_shard, tasks)
+        else:
+            shard_results = [search_shard(task, self.state) for task in tasks]
+        return [heapq.nlargest(top_k, (pair for results in shard_results for pair in results[i]),
+                               key=operator.itemgetter(1))
+                for i in range(num_queries)]
@@ -0,0 +1,78 @@
+'''
+Fixtures shared by the tests: a small synthetic corpus (the same generator as benchmark.py) and local FreeLing stubs,
+so the tests need neither the original corpus nor the FreeLing servers. The NLTK stopwords are replaced by the
+ones of the synthetic corpus, so the NLTK data is not needed either.
+'''
+
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import STOPWORDS, generate_corpus
+from freeling_stub import FreeLingStub
+
+
+def write_stopwords():
+    '''
+    It writes the stopwords of the synthetic corpus in the layout of the NLTK stopwords corpus
+    :return: String with the NLTK data directory
+    '''
+    nltk_dir = tempfile.mkdtemp(prefix='skyscanner-nltk-')
+    os.makedirs(os.path.join(nltk_dir, 'corpora', 'stopwords'))
+    for language, code in (('english', 'en'), ('spanish', 'es')):
+        with open(os.path.join(nltk_dir, 'corpora', 'stopwords', language), 'w') as f:
+            f.write('\n'.join(STOPWORDS[code]))
+    return nltk_dir
+
+
+NLTK_DIR = write_stopwords()
+os.environ['NLTK_DATA'] = NLTK_DIR
+import nltk  # noqa: E402 (after NLTK_DATA is set)
+nltk.data.path.insert(0, NLTK_DIR)
+
+
+NUM_DOCS = 60
+
+
+@pytest.fixture(scope='session')
+def freeling_ports():
+    stubs = {'english': FreeLingStub().start(), 'spanish': FreeLingStub().start()}
+    yield {language: stub.port for language, stub in stubs.items()}
+    for stub in stubs.values():
+        stub.stop()
+
+
+@pytest.fixture(scope='session')
+def corpus_dir(tmp_path_factory):
+    project_dir = str(tmp_path_factory.mktemp('corpus'))
+    generate_corpus(project_dir, NUM_DOCS, vocabulary_size=500, doc_length=(20, 80))
+    return project_dir
+
+
+@pytest.fixture
+def project_dir(corpus_dir, tmp_path):
+    '''
+    A copy of the corpus which the test can modify, without any model built yet
+    '''
+    project_dir = str(tmp_path / 'project')
+    shutil.copytree(corpus_dir, project_dir)
+    return project_dir
+
+
+@pytest.fixture
+def engine(freeling_ports):
+    '''
+    Factory of SkyScanner instances over a project directory, with small models
+    '''
+    from SkyScanner import SkyScanner
+
+    def make(project_dir, **params):
+        params = dict({'num_topics': 10, 'cache_size': 0, 'threshold': 0.0,
+                       'freeling_ports': freeling_ports}, **params)
+        return SkyScanner(project_dir=project_dir, **params)
+    return make
@@ -0,0 +1,70 @@
+'''
+Tests of the IVF-PQ approximate index (ann.py) against the exact inner products
+'''
+
+import numpy
+import pytest
+
+from ann import IVFPQIndex
+
+
+def unit_vectors(n, d=32, clusters=20, seed=0):
+    '''
+    Clustered random unit vectors, as the LSI vectors of documents about a few topics
+    '''
+    rnd = numpy.random.RandomState(seed)
+    centers = rnd.randn(clusters, d)
+    vectors = centers[rnd.randint(clusters, size=n)] + 0.5 * rnd.randn(n, d)
+    return (vectors / numpy.linalg.norm(vectors, axis=1, keepdims=True)).astype(numpy.float32)
+
+
+def exact_top_k(vectors, query, top_k):
+    return numpy.argsort(-vectors.dot(query), kind='stable')[:top_k]
+
+
+@pytest.fixture(scope='module')
+def trained():
+    vectors = unit_vectors(3050)  # the last ones are the queries, about the same topics
+    return vectors[:3000], IVFPQIndex(nprobe=8, rerank=100).train(vectors[:3000]), vectors[3000:]
+
+
+def test_full_scan_with_rerank_is_exact(trained):
+    vectors, index, queries = trained
+    for query in queries[:20]:
+        ids, scores = index.search(query, 10, vectors, nprobe=index.nlist, rerank=len(vectors))
+        assert ids.tolist() == exact_top_k(vectors, query, 10).tolist()
+        assert scores == pytest.approx(vectors[ids].dot(query), abs=1e-6)
+
+
+def test_recall_of_the_default_search(trained):
+    vectors, index, queries = trained
+    found = 0
+    for query in queries:
+        ids, scores = index.search(query, 10, vectors)
+        found += len(set(ids.tolist()) & set(exact_top_k(vectors, query, 10).tolist()))
+        assert (numpy.diff(scores) <= 0).all()
+    assert found / (10.0 * len(queries)) >= 0.9
+    approx_ids, approx_scores = index.search(queries[0], 10)  # without vectors, the quantized scores
+    assert len(approx_ids) == 10 and numpy.abs(approx_scores - vectors[approx_ids].dot(queries[0])).max() < 0.2
+
+
+def test_added_vectors_get_the_next_identifiers(trained):
+    vectors, index, queries = trained
+    index = IVFPQIndex(nprobe=8, rerank=100).train(vectors[:2000])
+    index.add(vectors[2000:])
+    index.add(vectors[:0])
+    assert len(index) == 3000
+    for doc in (2000, 2500, 2999):
+        ids, scores = index.search(vectors[doc], 1, vectors)
+        assert ids.tolist() == [doc] and scores[0] == pytest.approx(1.0, abs=1e-5)
+
+
+def test_saved_index_searches_the_same(trained, tmp_path):
+    vectors, index, queries = trained
+    index.save(str(tmp_path / 'ann.npz'))
+    loaded = IVFPQIndex.load(str(tmp_path / 'ann.npz'))
+    assert len(loaded) == len(index) and (loaded.nlist, loaded.m) == (index.nlist, index.m)
+    for query in queries[:10]:
+        for expected, found in zip(index.search(query, 10, vectors), loaded.search(query, 10, vectors)):
+            assert found.tolist() == expected.tolist()
+    assert loaded.search(vectors[0], 0)[0].tolist() == []
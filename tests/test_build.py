@@ -0,0 +1,116 @@
+'''
+Tests of how the models are built, saved and loaded by SkyScanner
+'''
+
+import os
+import shutil
+
+import pytest
+
+
+def test_languages_built_by_processes_are_loaded(project_dir, engine):
+    se = engine(project_dir, model_name='tfidf', use_saved_models=False, processes=2)
+    assert se.built == {'english', 'spanish'}
+    assert se.build_stats == {}  # nothing was built again by this process
+    assert len(se.model['english'].documents) == 60
+    assert len(se.model['spanish'].documents) == 60
+
+
+def add_article(project_dir):
+    '''
+    It copies the lemmas of a document of the corpus to a new lemma file, as a new article of the crawl
+    :return: String with the path of the new lemma file
+    '''
+    lemmas_dir = os.path.join(project_dir, 'data/lemmas/en')
+    documents_dir = os.path.join(project_dir, 'data/documents/en/article')
+    shutil.copy(os.path.join(lemmas_dir, 'doc-1.txt'), os.path.join(lemmas_dir, 'new-article.txt'))
+    shutil.copy(os.path.join(documents_dir, 'doc-1.txt'), os.path.join(documents_dir, 'new-article.txt'))
+    return os.path.join(lemmas_dir, 'new-article.txt')
+
+
+@pytest.mark.parametrize('model_name', ['lsi', 'tfidf', 'bm25'])
+def test_add_file_already_in_lemmas(project_dir, engine, model_name):
+    engine(project_dir, model_name=model_name, languages=['english'])
+    path = add_article(project_dir)
+
+    se = engine(project_dir, model_name=model_name, languages=['english'], check_corpus=False)
+    assert se.build_stats == {}  # the saved model was loaded although data/lemmas changed
+    se.add_documents('english', [path])
+    names = se.get_document_names('english')
+    assert len(names) == 61 and names.count('new-article.txt') == 1
+
+    se.add_documents('english', [path])  # already in the model
+    assert len(se.get_document_names('english')) == 61
+
+    se = engine(project_dir, model_name=model_name, languages=['english'])
+    assert se.build_stats == {}  # the manifest covers the new file
+    assert len(se.get_document_names('english')) == 61
+
+
+@pytest.mark.parametrize('clean', [False, True])
+def test_capitalized_multiword_is_in_the_bag_of_words(tmp_path, clean):
+    from multiwords import MultiwordTable
+    from SkyScanner import init_worker, count_terms, lemma_file_to_bow
+
+    lemma_file = tmp_path / 'article.txt'
+    lemma_file.write_text('Crowd Funding for a startup , crowd funding\n')
+    init_worker({'stopwords': {'for', 'a'}, 'punct': {','}, 'multiwords': MultiwordTable([('crowd funding', 'crowd_funding')]),
+                 'token2id': {'crowd_funding': 0, 'startup': 1}, 'keep_text': True,
+                 'clean_dir': str(tmp_path / 'clean') if clean else None})
+    (tmp_path / 'clean').mkdir()
+    frequency, texts = count_terms([str(lemma_file)])
+    assert frequency == {'crowd_funding': 2, 'startup': 1}
+    assert lemma_file_to_bow((str(lemma_file), texts[0]))[1] == [(0, 2), (1, 1)]
+
+
+@pytest.mark.parametrize('model_name, remove_hl', [('lsi', True), ('tfidf', False)])
+def test_lemma_files_are_read_once(project_dir, engine, monkeypatch, model_name, remove_hl):
+    import SkyScanner
+
+    lemmas_dir = os.path.join(project_dir, 'data/lemmas/en')
+    opened = []
+
+    def counting_open(file, *args, **kwargs):
+        if os.path.dirname(str(file)) == lemmas_dir:
+            opened.append(os.path.basename(file))
+        return open(file, *args, **kwargs)
+    monkeypatch.setattr(SkyScanner, 'open', counting_open, raising=False)
+    se = engine(project_dir, model_name=model_name, languages=['english'], remove_hl=remove_hl)
+    assert sorted(opened) == sorted(os.listdir(lemmas_dir))
+    assert len(se.get_document_names('english')) == 60
+
+
+@pytest.mark.parametrize('model_name, tfidf_backend', [('tfidf', 'dict'), ('tfidf', 'sparse'), ('bm25', 'dict')])
+def test_added_document_is_scored_as_a_rebuilt_one(project_dir, engine, model_name, tfidf_backend):
+    lemmas_dir = os.path.join(project_dir, 'data/lemmas/en')
+    shutil.move(os.path.join(lemmas_dir, 'doc-5.txt'), os.path.join(project_dir, 'doc-5.txt'))
+    se = engine(project_dir, model_name=model_name, tfidf_backend=tfidf_backend, languages=['english'], remove_hl=False)
+    shutil.move(os.path.join(project_dir, 'doc-5.txt'), os.path.join(lemmas_dir, 'doc-5.txt'))
+    se.add_documents('english', [os.path.join(lemmas_dir, 'doc-5.txt')])
+    rebuilt = engine(project_dir, model_name=model_name, tfidf_backend=tfidf_backend, languages=['english'],
+                     remove_hl=False, use_saved_models=False)
+    added, expected = se.model['english'], rebuilt.model['english']
+    if model_name == 'bm25':  # the stopwords and the punctuation symbols are counted as in the build
+        added_docs, expected_docs = list(added.documents), list(expected.documents)
+        assert added.doc_len[added_docs.index('doc-5.txt')] == expected.doc_len[expected_docs.index('doc-5.txt')]
+    with open(os.path.join(lemmas_dir, 'doc-5.txt')) as f:
+        lemmas = f.read().lower().split()
+    for query in (lemmas[:1], lemmas[2:5], ['en1', 'en3', 'unknown']):
+        sims = dict(added.similarities(query))
+        assert sims.keys() == dict(expected.similarities(query)).keys()
+        assert [sims[doc] for doc, score in expected.similarities(query)] == \
+            pytest.approx([score for doc, score in expected.similarities(query)])
+
+
+def test_added_document_keeps_the_terms_of_the_dictionary(project_dir, engine):
+    se = engine(project_dir, model_name='tfidf', languages=['english'], remove_hl=True)
+    token2id = dict(se.dct['english'].token2id)
+    path = add_article(project_dir)
+    with open(path, 'a') as f:
+        f.write(' zzz_hapax')
+    se.add_documents('english', [path])
+    with open(os.path.join(se.files_dir['english'], 'new-article.txt')) as f:
+        terms = f.read().split()
+    with open(path) as f:
+        assert terms == [term for term in f.read().lower().split() if term in token2id]
+    assert 'zzz_hapax' not in se.model['english'].similarities(['zzz_hapax'])
@@ -0,0 +1,68 @@
+'''
+Tests of the LRU cache (cache.py) and of how SkyScanner caches the retrieved documents
+'''
+
+import pytest
+
+from cache import LRUCache
+
+
+QUERY = 'the en1 of en2 and en3'
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1  # 'b' is now the least recently used
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats() == {'size': 2, 'hits': 3, 'misses': 1}
+
+
+def test_expired_entries_are_missing(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('cache.time.monotonic', lambda: now[0])
+    cache = LRUCache(10, ttl=5)
+    cache.put('a', 1)
+    now[0] += 4.9
+    assert cache.get('a') == 1
+    now[0] += 0.2
+    assert cache.get('a', 'missing') == 'missing'
+    assert cache.stats()['size'] == 0
+
+
+def test_disabled_cache_keeps_nothing():
+    cache = LRUCache(0)
+    cache.put('a', 1)
+    assert cache.get('a') is None and cache.stats()['size'] == 0
+
+
+@pytest.fixture
+def cached_engine(project_dir, engine, monkeypatch):
+    se = engine(project_dir, model_name='tfidf', languages=['english'], cache_size=16)
+    monkeypatch.setattr(se, 'get_snippet', lambda file_path, l_query, language=None: '')  # no NLTK sentence tokenizer
+    return se
+
+
+def test_cached_results_can_not_be_changed_by_the_callers(cached_engine):
+    se = cached_engine
+    sims = se.run_query(QUERY, top_k=5)
+    expected = [tuple(sim) for sim in sims]
+    sims.reverse()
+    sims.append(('doc-0.txt', 99.0))
+    cached = se.run_query(QUERY, top_k=5)
+    assert cached == expected
+    cached.clear()
+    assert se.run_query(QUERY, top_k=5) == expected
+    assert se.cache_stats()['results']['hits'] == 2
+
+
+def test_only_top_k_results_are_cached(cached_engine):
+    se = cached_engine
+    se.search(QUERY, 'english', top_k=None)
+    assert se.cache_stats()['results']['size'] == 0
+    language, results = se.search(QUERY, 'english', top_k=3)
+    assert se.cache_stats()['results']['size'] == 1
+    assert se.search(QUERY, 'english', top_k=3) == (language, results)
@@ -0,0 +1,85 @@
+'''
+Tests of the FreeLing client against the stub, which reads the messages as the FreeLing server does
+'''
+
+import socket
+import threading
+
+import pytest
+
+from freeling import FreeLingClient, SERVER_READY
+from freeling_stub import FreeLingStub
+
+
+@pytest.fixture
+def stub():
+    stub = FreeLingStub().start()
+    yield stub
+    stub.stop()
+
+
+def receive(sock):
+    data = b''
+    while not data.endswith(b'\0'):
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    return data[:-1].decode('utf-8')
+
+
+def test_stub_reads_one_message_per_read(stub):
+    with socket.create_connection(('localhost', stub.port), timeout=5) as sock:
+        sock.sendall(b'RESET_STATS\0the cat\0')  # the second message follows the first one in the same read
+        assert receive(sock) == SERVER_READY
+        sock.settimeout(0.5)
+        with pytest.raises(socket.timeout):
+            sock.recv(65536)  # the second message was dropped, it is never answered
+        sock.settimeout(5)
+        sock.sendall(b'FLUSH_BUFFER\0')
+        assert receive(sock) == SERVER_READY  # nothing was buffered from the dropped message
+
+
+def test_analyze_many_spreads_the_texts_over_the_pool(stub):
+    client = FreeLingClient(stub.port, pool_size=3, timeout=5)
+    texts = ['The cat sat.\n\nOn the mat.', 'Crowd funding', '', 'A date 12/05/2019 here.'] * 5
+    try:
+        assert client.analyze_many(texts) == [client.analyze(text) for text in texts]
+        assert client.lemmatize_many(texts[:2]) == ['the cat sat . on the mat .', 'crowd funding']
+        assert client.opened > 1
+    finally:
+        client.close()
+
+
+def test_silent_server_times_out():
+    server = socket.socket()
+    server.bind(('localhost', 0))
+    server.listen(1)
+    accepted = []
+    threading.Thread(target=lambda: accepted.append(server.accept()), daemon=True).start()
+    client = FreeLingClient(server.getsockname()[1], pool_size=1, timeout=0.2)
+    try:
+        with pytest.raises(OSError):
+            client.analyze('the cat')
+    finally:
+        server.close()
+
+
+class BrokenClient(FreeLingClient):
+    '''
+    FreeLingClient which fails with an error which is not a broken connection for one of the texts
+    '''
+
+    def analyze(self, text):
+        if text == 'broken':
+            raise ValueError('unexpected output')
+        return FreeLingClient.analyze(self, text)
+
+
+def test_analyze_many_raises_the_errors_of_the_workers(stub):
+    client = BrokenClient(stub.port, pool_size=3, timeout=5)
+    try:
+        with pytest.raises(ValueError, match='unexpected output'):
+            client.lemmatize_many(['the cat', 'a dog', 'broken', 'crowd funding'])
+    finally:
+        client.close()
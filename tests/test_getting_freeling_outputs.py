@@ -0,0 +1,80 @@
+'''
+Tests of the analysis of the articles (getting_freeling_outputs.py) against the FreeLing stub
+'''
+
+import os
+import threading
+
+import pytest
+
+from freeling import FreeLingClient
+from freeling_stub import FreeLingStub
+from getting_freeling_outputs import analyze_language, get_tasks
+
+
+class FlakyClient(FreeLingClient):
+    '''
+    FreeLingClient whose first calls for some texts fail, as with a broken connection
+    '''
+
+    def __init__(self, port, failures, **kwargs):
+        FreeLingClient.__init__(self, port, **kwargs)
+        self.failures = dict(failures)  # text prefix: number of calls which fail
+        self.calls = 0
+        self.calls_lock = threading.Lock()
+
+
+    def analyze(self, text):
+        with self.calls_lock:
+            self.calls += 1
+            for prefix, count in self.failures.items():
+                if text.startswith(prefix) and count > 0:
+                    self.failures[prefix] = count - 1
+                    raise ConnectionError('connection reset')
+        return FreeLingClient.analyze(self, text)
+
+
+@pytest.fixture
+def stub():
+    stub = FreeLingStub().start()
+    yield stub
+    stub.stop()
+
+
+@pytest.fixture
+def articles(tmp_path):
+    documents_dir = tmp_path / 'documents'
+    documents_dir.mkdir()
+    for i in range(10):
+        (documents_dir / ('article-%d.txt' % i)).write_text('Title %d\nIntro of %d.\nBody of the article %d.' % (i, i, i))
+    return str(documents_dir), str(tmp_path / 'outputs')
+
+
+def test_outputs_are_written_and_skipped_when_up_to_date(stub, articles):
+    documents_dir, output_dir = articles
+    client = FreeLingClient(stub.port, pool_size=3, timeout=5)
+    try:
+        assert analyze_language('en', documents_dir, output_dir, client, 3, 0) == []
+        for i in range(10):
+            with open(os.path.join(documents_dir, 'article-%d.txt' % i)) as f:
+                expected = client.analyze(f.read())
+            with open(os.path.join(output_dir, 'article-%d.txt' % i)) as f:
+                assert f.read() == expected
+    finally:
+        client.close()
+    tasks, skipped = get_tasks(documents_dir, output_dir)
+    assert tasks == [] and skipped == 10
+    assert len(get_tasks(documents_dir, output_dir, force=True)[0]) == 10
+
+
+def test_failed_articles_are_retried(stub, articles):
+    documents_dir, output_dir = articles
+    client = FlakyClient(stub.port, {'Title 3': 2, 'Title 7': 5}, pool_size=2, timeout=5)
+    try:
+        failed = analyze_language('en', documents_dir, output_dir, client, 2, 2)
+    finally:
+        client.close()
+    assert failed == [os.path.join(documents_dir, 'article-7.txt')]  # it failed more times than retried
+    assert os.path.isfile(os.path.join(output_dir, 'article-3.txt'))
+    assert not os.path.isfile(os.path.join(output_dir, 'article-7.txt'))
+    assert client.calls == 10 + 2 + 2
@@ -0,0 +1,103 @@
+'''
+Tests of the out-of-core LSI training and of the sharded similarity index (lsi_training.py)
+'''
+
+import os
+
+import numpy
+import pytest
+
+gensim = pytest.importorskip('gensim')
+from gensim import corpora, similarities  # noqa: E402
+
+from lsi_training import SimilarityVectors, build_sharded_index, load_sharded_index, read_documents, train_lsi  # noqa: E402
+
+
+NUM_TERMS, NUM_DOCS, NUM_TOPICS = 300, 400, 10
+
+
+@pytest.fixture(scope='module')
+def corpus(tmp_path_factory):
+    '''
+    A bag-of-words corpus drawn from NUM_TOPICS topics, with some empty documents, written as an MmCorpus
+    :return: Tuple with the path of the MmCorpus file, its dictionary and its documents
+    '''
+    rnd = numpy.random.RandomState(0)
+    topics = rnd.gamma(0.1, size=(NUM_TOPICS, NUM_TERMS))
+    mix = rnd.dirichlet([0.2] * NUM_TOPICS, size=NUM_DOCS)
+    documents = []
+    for doc in range(NUM_DOCS):
+        p = mix[doc].dot(topics)
+        counts = rnd.multinomial(0 if doc % 50 == 7 else rnd.randint(20, 100), p / p.sum())
+        documents.append([(int(term_id), float(count)) for term_id, count in enumerate(counts) if count])
+    corpus_path = str(tmp_path_factory.mktemp('lsi') / 'corpus.mm')
+    corpora.MmCorpus.serialize(corpus_path, documents)
+    dct = corpora.Dictionary([['t%d' % term_id for term_id in range(NUM_TERMS)]])
+    return corpus_path, dct, documents
+
+
+@pytest.mark.parametrize('start, end', [(0, NUM_DOCS), (0, 1), (5, 60), (57, 58), (390, NUM_DOCS + 10)])
+def test_ranges_are_read_as_the_corpus(corpus, start, end):
+    corpus_path, dct, documents = corpus
+    assert list(read_documents(corpus_path, start, end)) == [doc for doc in documents[start:end] if doc]
+
+
+def exact_singular_values(documents):
+    matrix = numpy.zeros((NUM_TERMS, NUM_DOCS))
+    for doc, bow in enumerate(documents):
+        for term_id, count in bow:
+            matrix[term_id, doc] = count
+    u, s, vt = numpy.linalg.svd(matrix, full_matrices=False)
+    return u, s
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_workers_train_the_same_model(corpus, workers, capsys):
+    corpus_path, dct, documents = corpus
+    u, s = exact_singular_values(documents)
+    lsi = train_lsi(corpus_path, dct, NUM_TOPICS, chunksize=64, workers=workers, onepass=workers == 1)
+    assert lsi.docs_processed == NUM_DOCS
+    if workers > 1:
+        assert 'multi-pass' in capsys.readouterr().out  # the workers use the one-pass algorithm
+    # the one-pass algorithm approximates the main topics
+    top = 5
+    assert lsi.projection.s[:top] == pytest.approx(s[:top], rel=0.03)
+    angles = numpy.linalg.svd(u[:, :top].T.dot(lsi.projection.u[:, :top]), compute_uv=False)
+    assert angles.min() > 0.98
+
+
+def test_sharded_index_scores_as_the_matrix_index(corpus, tmp_path):
+    corpus_path, dct, documents = corpus
+    lsi = train_lsi(corpus_path, dct, NUM_TOPICS, chunksize=64, workers=2)
+    mm = corpora.MmCorpus(corpus_path)
+    matrix = similarities.MatrixSimilarity(lsi[mm], num_features=lsi.num_topics)
+    build_sharded_index(str(tmp_path / 'index'), lsi, mm, shard_size=64).save(str(tmp_path / 'index'))
+    os.rename(str(tmp_path), str(tmp_path) + '-moved')  # the shards are found in the new directory
+    sharded = load_sharded_index(str(tmp_path) + '-moved/index')
+    assert len(sharded.shards) == (NUM_DOCS + 63) // 64
+
+    vectors = SimilarityVectors(sharded)
+    assert vectors.shape == matrix.index.shape and len(vectors) == NUM_DOCS
+    assert numpy.asarray(vectors) == pytest.approx(matrix.index, abs=1e-6)
+    docs = [0, 63, 64, 65, 200, 399, 7]
+    assert vectors[docs] == pytest.approx(matrix.index[docs], abs=1e-6)
+    assert vectors[60:70] == pytest.approx(matrix.index[60:70], abs=1e-6)
+    queries = matrix.index[[3, 100]].T
+    assert vectors.dot(queries) == pytest.approx(matrix.index.dot(queries), abs=1e-5)
+    query = lsi[documents[3]]
+    assert sharded[query] == pytest.approx(matrix[query], abs=1e-5)
+
+
+def test_sharded_engine_with_workers(project_dir, engine):
+    se = engine(project_dir, model_name='lsi', languages=['english'], lsi_workers=2, lsi_index='sharded',
+                lsi_shard_size=16)
+    queries = [['en%d' % i, 'en%d' % (i + 5)] for i in range(1, 30, 4)]
+    expected = [se.model_similarities('english', query, 5) for query in queries]
+    loaded = engine(project_dir, model_name='lsi', languages=['english'], lsi_workers=2, lsi_index='sharded',
+                    lsi_shard_size=16)
+    assert loaded.build_stats == {}
+    assert isinstance(loaded.index['english'], similarities.Similarity)
+    for query, sims in zip(queries, expected):
+        found = loaded.model_similarities('english', query, 5)
+        assert [doc for doc, score in found] == [doc for doc, score in sims]
+        assert [score for doc, score in found] == pytest.approx([score for doc, score in sims], abs=1e-5)
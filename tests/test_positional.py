@@ -0,0 +1,133 @@
+'''
+Tests of the phrase and proximity queries scored with the positional index
+'''
+
+import itertools
+import os
+import random
+
+import pytest
+
+from multiwords import MultiwordTable
+from positional import PositionalIndex, write_positional_index
+from tfidf import BM25, SparseTfIdf, TfIdf
+
+
+STOPWORDS = {'the', 'of'}
+PUNCT = {'.'}
+MULTIWORDS = MultiwordTable([('crowd funding', 'crowd_funding')])
+TERMS = ['a', 'b', 'c', 'd', 'e', 'crowd', 'crowd_funding', 'unknown']
+
+
+@pytest.fixture(scope='module')
+def documents(tmp_path_factory):
+    '''
+    Random lemma files with a small vocabulary, so the phrases and the windows are frequent, and their positional index
+    :return: Tuple with the lemmas of each document, the index and its directory
+    '''
+    rnd = random.Random(0)
+    vocabulary = ['a', 'b', 'c', 'd', 'e', 'crowd', 'funding'] + sorted(STOPWORDS | PUNCT)
+    lemmas_dir = tmp_path_factory.mktemp('lemmas')
+    files, texts = [], []
+    for doc in range(80):
+        lemmas = [rnd.choice(vocabulary) for i in range(rnd.randint(0, 30))]
+        file_path = str(lemmas_dir / ('doc-%d.txt' % doc))
+        with open(file_path, 'w') as f:
+            f.write(' '.join(lemmas).upper() if doc % 10 == 0 else ' '.join(lemmas))
+        files.append(file_path)
+        texts.append(MULTIWORDS.apply(lemmas))
+    files.append(str(lemmas_dir / 'missing.txt'))  # a document without lemma file has no positions
+    texts.append([])
+    write_positional_index(str(lemmas_dir), files, STOPWORDS, PUNCT, MULTIWORDS, {'model': 'test'})
+    return texts, PositionalIndex(str(lemmas_dir), cache_size=2), str(lemmas_dir)
+
+
+def brute_phrase_documents(texts, phrase):
+    size = phrase[-1][0] + 1
+    return [doc for doc, lemmas in enumerate(texts)
+            if any(all(lemmas[start + offset] == term for offset, term in phrase) for start in range(len(lemmas) - size + 1))]
+
+
+def brute_window(lemmas, terms):
+    found = [term for term in terms if term in lemmas]
+    if len(found) < 2:
+        return len(found), len(found)
+    return len(found), min(end - start + 1 for start in range(len(lemmas)) for end in range(start, len(lemmas))
+                           if set(found) <= set(lemmas[start:end + 1]))
+
+
+def test_index_is_valid_for_its_manifest(documents):
+    texts, index, model_dir = documents
+    assert PositionalIndex.is_valid(model_dir, {'model': 'test'})
+    assert not PositionalIndex.is_valid(model_dir, {'model': 'other'})
+
+
+def test_positions_are_the_ones_of_the_lemmas(documents):
+    texts, index, model_dir = documents
+    for doc, lemmas in enumerate(texts):
+        for term in TERMS:
+            assert index.get_positions(term, doc).tolist() == [i for i, lemma in enumerate(lemmas) if lemma == term]
+    for term in STOPWORDS | PUNCT:
+        assert index.postings(term) is None
+
+
+def test_phrase_documents_are_the_brute_force_ones(documents):
+    texts, index, model_dir = documents
+    for size in (1, 2, 3):
+        for phrase_terms in itertools.product(['a', 'b', 'c', 'crowd_funding', 'unknown'], repeat=size):
+            for gap in (0, 1):  # another lemma between the first two terms
+                phrase = tuple((i + (gap if i else 0), term) for i, term in enumerate(phrase_terms))
+                assert index.phrase_documents(phrase).tolist() == brute_phrase_documents(texts, phrase)
+
+
+def test_window_is_the_smallest_one(documents):
+    texts, index, model_dir = documents
+    for terms in (['a', 'b'], ['a', 'b', 'c'], ['c', 'crowd_funding', 'e'], ['a', 'unknown']):
+        for doc, lemmas in enumerate(texts):
+            assert index.window(terms, doc) == brute_window(lemmas, terms)
+
+
+@pytest.mark.parametrize('model_class', [TfIdf, SparseTfIdf, BM25])
+def test_document_scores_are_the_ones_of_the_whole_corpus(documents, model_class):
+    texts, index, model_dir = documents
+    model = model_class()
+    for doc, lemmas in enumerate(texts[:-1]):
+        model.add_document('doc-%d.txt' % doc, lemmas or ['.'])
+    docs = [0, 3, 4, 10, 41, 79]
+    for query in (['a'], ['a', 'b', 'a'], ['crowd_funding', 'e'], ['unknown']):
+        scores = dict(model.similarities(query))
+        expected = [scores.get('doc-%d.txt' % doc, 0.0) for doc in docs]
+        assert list(model.document_scores(query, docs)) == pytest.approx(expected)
+
+
+def get_phrase(se, project_dir, name='doc-1.txt'):
+    '''
+    It takes the first two consecutive terms of a lemma file which are neither stopwords nor punctuation symbols
+    :return: Tuple with the phrase, as parse_lemmatized_query returns it
+    '''
+    with open(os.path.join(project_dir, 'data/lemmas/en', name)) as f:
+        lemmas = f.read().lower().split()
+    skip = se.stopWords['english'] | set(se.punctSym['english'])
+    for first, second in zip(lemmas, lemmas[1:]):
+        if first not in skip and second not in skip:
+            return ((0, first), (1, second))
+    pytest.fail('no phrase in ' + name)
+
+
+@pytest.mark.parametrize('model_name', ['lsi', 'tfidf', 'bm25'])
+def test_phrase_query_scores_only_the_phrase_documents(project_dir, engine, model_name, monkeypatch):
+    se = engine(project_dir, model_name=model_name, languages=['english'], positional=True, proximity_weight=0)
+    phrase = get_phrase(se, project_dir)
+    query = [term for offset, term in phrase]
+    docs = set(se.positions['english'].phrase_documents(phrase).tolist())
+    assert docs
+    expected = sorted(((doc, score) for doc, score in se.model_similarities('english', query)
+                       if se.get_doc_id('english', doc) in docs), key=lambda sim: -sim[1])
+
+    def whole_corpus(*args):
+        raise AssertionError('the whole corpus was scored')
+    monkeypatch.setattr(se, 'model_similarities', whole_corpus)
+    for top_k in (None, 3):
+        sims = se.positional_similarities('english', query, (phrase,), top_k, min_score=-1.0)
+        assert [doc for doc, score in sims] == [doc for doc, score in expected][:top_k]
+        assert [score for doc, score in sims] == pytest.approx([score for doc, score in expected][:top_k])
@@ -0,0 +1,101 @@
+'''
+Tests of the incremental crawl of scrapper.py over a local HTML fixture, without any network access
+'''
+
+import json
+import os
+
+import pytest
+
+scrapy = pytest.importorskip('scrapy')
+from scrapy.http import HtmlResponse, Request  # noqa: E402
+
+from scrapper import Entrepreneur, BASE_URL  # noqa: E402
+
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'article.html')
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    return {'output_dir': str(tmp_path / 'documents'), 'state_dir': str(tmp_path / 'crawl')}
+
+
+def read_fixture():
+    with open(FIXTURE, 'rb') as f:
+        return f.read()
+
+
+def article_response(article_id, status=200, headers=None, body=None):
+    if body is None:
+        body = read_fixture()
+    url = BASE_URL + '/article/' + article_id
+    request = Request(url, meta={'article_id': article_id})
+    return HtmlResponse(url, status=status, headers=headers or {}, body=body if status == 200 else b'',
+                        request=request)
+
+
+def read_changed(spider):
+    path = os.path.join(spider.state_dir, 'changed.txt')
+    if not os.path.isfile(path):
+        return []
+    with open(path) as f:
+        return f.read().split()
+
+
+def test_article_is_saved_with_its_validators(dirs):
+    spider = Entrepreneur(**dirs)
+    spider.parseArticle(article_response('100', headers={'ETag': '"v1"', 'Last-Modified': 'Mon, 01 Jan 2018 00:00:00 GMT'}))
+    record = spider.state['100']
+    assert record['etag'] == '"v1"' and record['last_modified'] == 'Mon, 01 Jan 2018 00:00:00 GMT'
+    with open(record['path']) as f:
+        assert f.read().split('\n')[0] == 'How to fund a startup'
+    assert read_changed(spider) == [record['path']]
+
+
+def test_known_article_is_requested_with_conditional_headers(dirs):
+    spider = Entrepreneur(recheck_days=0, **dirs)
+    spider.parseArticle(article_response('100', headers={'ETag': '"v1"', 'Last-Modified': 'Mon, 01 Jan 2018 00:00:00 GMT'}))
+    spider.closed('finished')
+
+    spider = Entrepreneur(recheck_days=0, **dirs)
+    request = spider.articleRequest(BASE_URL + '/article/100')
+    assert request.headers.get('If-None-Match') == b'"v1"'
+    assert request.headers.get('If-Modified-Since') == b'Mon, 01 Jan 2018 00:00:00 GMT'
+    assert spider.articleRequest(BASE_URL + '/article/100') is None  # once per crawl
+
+    spider.parseArticle(article_response('100', status=304))  # not modified: the document is not written again
+    spider.parseArticle(article_response('100'))  # modified headers but the same text
+    assert spider.unchanged == 2 and spider.changed == []
+    assert len(read_changed(spider)) == 1
+
+
+def test_recently_checked_article_is_skipped(dirs):
+    spider = Entrepreneur(recheck_days=7, **dirs)
+    spider.parseArticle(article_response('100'))
+    spider.closed('finished')
+    assert Entrepreneur(recheck_days=7, **dirs).articleRequest(BASE_URL + '/article/100') is None
+
+
+def test_interrupted_crawl_keeps_the_changed_documents(dirs):
+    spider = Entrepreneur(**dirs)
+    for i in range(100):  # the state is saved after 100 articles
+        spider.parseArticle(article_response(str(i), body=read_fixture().replace(b'startup', b'startup %d' % i)))
+    with open(os.path.join(spider.state_dir, 'state.json')) as f:
+        assert len(json.load(f)) == 100
+    # killed before closed(): the resumed crawl skips the articles of the saved state
+    resumed = Entrepreneur(**dirs)
+    assert all(resumed.articleRequest(BASE_URL + '/article/%d' % i) is None for i in range(100))
+    changed = read_changed(resumed)
+    assert len(changed) == 100
+    assert changed == [os.path.join(spider.output_dir, '%d.txt' % i) for i in range(100)]
+
+
+def test_changed_article_is_written_again(dirs):
+    spider = Entrepreneur(recheck_days=0, **dirs)
+    spider.parseArticle(article_response('100'))
+    body = read_fixture().replace(b'own savings', b'own savings and loans')
+    spider.parseArticle(article_response('100', body=body))
+    with open(spider.state['100']['path']) as f:
+        assert 'and loans' in f.read()
+    assert len(read_changed(spider)) == 2
@@ -0,0 +1,137 @@
+'''
+Tests of the segments (segment.py): the varint codec, the quantized term frequencies, the BM25 and Tf-Idf segments
+and the segment written again by add_documents
+'''
+
+import os
+import random
+
+import numpy
+import pytest
+
+from segment import (SegmentBM25, SegmentSparseTfIdf, SegmentTfIdf, TF_TABLE, TF_EXACT, decode_gaps, decode_varints,
+                     encode_varints, load_segment, quantize_tf, read_varint, segment_stats, write_segment, write_varint)
+from tfidf import BM25, SparseTfIdf, TfIdf
+
+
+VALUES = [0, 1, 127, 128, 255, 16383, 16384, 2 ** 21 - 1, 2 ** 21, 2 ** 35 + 5, 2 ** 63 - 1]
+
+
+def test_varints_round_trip():
+    encoded = encode_varints(VALUES)
+    assert encoded == b''.join(write_varint(value) for value in VALUES)
+    assert decode_varints(numpy.frombuffer(encoded, dtype=numpy.uint8)).tolist() == VALUES[:-1] + [2 ** 63 - 1]
+    pos = 0
+    for value in VALUES:
+        decoded, pos = read_varint(encoded, pos)
+        assert decoded == value
+    assert pos == len(encoded)
+    assert encode_varints([]) == b''
+    assert [len(write_varint(value)) for value in (127, 128, 16383, 16384)] == [1, 2, 2, 3]
+
+
+def test_gaps_are_decoded_as_identifiers():
+    ids = sorted(random.Random(0).sample(range(10 ** 6), 300))
+    encoded = encode_varints(numpy.diff(ids, prepend=0))
+    assert decode_gaps(encoded) == ids
+    assert numpy.cumsum(decode_varints(numpy.frombuffer(encoded, dtype=numpy.uint8))).tolist() == ids
+
+
+def test_term_frequencies_are_quantized_once():
+    tfs = numpy.arange(1, int(TF_TABLE[-1]) + 1)
+    codes = quantize_tf(tfs)
+    assert (TF_TABLE[codes[:TF_EXACT]] == tfs[:TF_EXACT]).all()  # exact up to TF_EXACT
+    assert (numpy.abs(TF_TABLE[codes] - tfs) / tfs < 0.03).all()
+    assert (quantize_tf(TF_TABLE[codes]) == codes).all()  # a segment written again keeps its frequencies
+
+
+def random_model(num_docs=200, vocabulary=300, seed=0, model=None):
+    rnd = random.Random(seed)
+    model = BM25() if model is None else model
+    for doc in range(num_docs):
+        words = ['w%d' % (int(rnd.paretovariate(1.0)) % vocabulary) for i in range(rnd.randint(5, 120))]
+        model.add_document('doc-%d.txt' % doc, words)
+    return model
+
+
+def test_segment_scores_as_the_model(tmp_path):
+    model = random_model()
+    file_path = str(tmp_path / 'bm25.seg')
+    write_segment(file_path, model)
+    segment = SegmentBM25(file_path)
+    assert list(segment.documents) == model.documents
+    rnd = random.Random(1)
+    for i in range(20):
+        query = ['w%d' % rnd.randint(0, 40) for j in range(rnd.randint(1, 4))]
+        sims, expected = segment.top_k(query, 10), model.top_k(query, 10)  # the frequencies are below TF_EXACT
+        assert [doc for doc, score in sims] == [doc for doc, score in expected]
+        assert [score for doc, score in sims] == pytest.approx([score for doc, score in expected])
+    write_segment(str(tmp_path / 'again.seg'), segment)
+    with open(file_path, 'rb') as f, open(str(tmp_path / 'again.seg'), 'rb') as g:
+        assert f.read() == g.read()
+
+
+def test_added_documents_are_written_in_the_segment(project_dir, engine):
+    se = engine(project_dir, model_name='bm25', languages=['english'], remove_hl=False)  # the new term is kept
+    lemmas_dir = os.path.join(project_dir, 'data/lemmas/en')
+    with open(os.path.join(lemmas_dir, 'new-article.txt'), 'w') as f:
+        f.write('en1 en1 en1 en2 zzz_new_term .')
+    se.add_documents('english', [os.path.join(lemmas_dir, 'new-article.txt')])
+    model = se.model['english']
+    assert isinstance(model, SegmentBM25)
+    assert len(model.documents) == 61 and model.has_term('zzz_new_term')
+
+    loaded = engine(project_dir, model_name='bm25', languages=['english'], remove_hl=False)
+    assert loaded.build_stats == {}
+    assert loaded.tfidf_similarities('english', ['zzz_new_term', 'en1'], 5) == model.top_k(['zzz_new_term', 'en1'], 5)
+
+
+@pytest.mark.parametrize('model_class, segment_class, scoring', [(TfIdf, SegmentTfIdf, None),
+                                                                 (SparseTfIdf, SegmentSparseTfIdf, 'compat'),
+                                                                 (SparseTfIdf, SegmentSparseTfIdf, 'tfidf')])
+def test_tfidf_segment_scores_as_the_model(tmp_path, model_class, segment_class, scoring):
+    model = random_model(model=model_class(scoring) if scoring else model_class())
+    model.add_document('doc-many.txt', ['w1'] * 300 + ['w2'])  # a count above TF_EXACT is kept exact
+    model.add_document('doc-empty.txt', [])
+    file_path = str(tmp_path / 'tfidf.seg')
+    write_segment(file_path, model)
+    segment = segment_class(file_path, scoring) if scoring else segment_class(file_path)
+    assert list(segment.documents) == model.documents and isinstance(load_segment(file_path), SegmentTfIdf)
+    with pytest.raises(ValueError):
+        SegmentBM25(file_path)
+    rnd = random.Random(1)
+    docs = [0, 5, 199, 200, 201]
+    for i in range(20):
+        query = ['w%d' % rnd.randint(0, 40) for j in range(rnd.randint(1, 4))] + (['unknown'] if i % 5 == 0 else [])
+        sims, expected = dict(segment.similarities(query)), dict(model.similarities(query))
+        assert sims.keys() == expected.keys()
+        assert [sims[doc] for doc in expected] == pytest.approx(list(expected.values()), rel=1e-6)
+        assert list(segment.document_scores(query, docs)) == pytest.approx(list(model.document_scores(query, docs)), rel=1e-6)
+    write_segment(str(tmp_path / 'again.seg'), segment)
+    with open(file_path, 'rb') as f, open(str(tmp_path / 'again.seg'), 'rb') as g:
+        assert f.read() == g.read()
+    stats = segment_stats(file_path)
+    assert stats['model'] == 'tfidf' and stats['documents'] == 202 and stats['size_bytes'] < stats['pickled_bytes']
+
+
+@pytest.mark.parametrize('tfidf_backend', ['dict', 'sparse'])
+def test_tfidf_model_is_served_from_its_segment(project_dir, engine, tfidf_backend):
+    se = engine(project_dir, model_name='tfidf', tfidf_backend=tfidf_backend, languages=['english'])
+    model_dir = se.get_model_dir('english')
+    assert os.path.isfile(os.path.join(model_dir, 'tfidf.seg')) and not os.path.isfile(os.path.join(model_dir, 'tfidf.pkl'))
+    queries = [['en%d' % i, 'en%d' % (i + 3)] for i in range(1, 30, 4)]
+    expected = [se.tfidf_similarities('english', query, 5) for query in queries]
+    loaded = engine(project_dir, model_name='tfidf', tfidf_backend=tfidf_backend, languages=['english'])
+    assert loaded.build_stats == {}
+    assert isinstance(loaded.model['english'], SegmentSparseTfIdf if tfidf_backend == 'sparse' else SegmentTfIdf)
+    for query, sims in zip(queries, expected):
+        found = loaded.tfidf_similarities('english', query, 5)
+        assert [doc for doc, score in found] == [doc for doc, score in sims]
+        assert [score for doc, score in found] == pytest.approx([score for doc, score in sims])
+
+    lemmas_dir = os.path.join(project_dir, 'data/lemmas/en')
+    with open(os.path.join(lemmas_dir, 'new-article.txt'), 'w') as f:
+        f.write('en1 en1 en2')
+    loaded.add_documents('english', [os.path.join(lemmas_dir, 'new-article.txt')])
+    assert isinstance(loaded.model['english'], SegmentSparseTfIdf if tfidf_backend == 'sparse' else SegmentTfIdf)
+    assert len(loaded.model['english'].documents) == 61
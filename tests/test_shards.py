@@ -0,0 +1,87 @@
+'''
+Tests of the sharded search (shards.py): the merged results of the shards are the ones of the whole model
+'''
+
+import random
+
+import numpy
+import pytest
+
+from shards import ShardedIndex, split_bounds, write_lsi_shards, write_tfidf_shards
+from tfidf import SparseTfIdf, TfIdf
+
+
+QUERIES = [['w1'], ['w2', 'w5', 'w2'], ['w0', 'w3', 'w17', 'unknown'], ['unknown']]
+
+
+def test_bounds_cover_the_documents():
+    assert split_bounds(10, 3) == [0, 3, 7, 10]
+    assert split_bounds(2, 5) == [0, 1, 2]
+    assert split_bounds(0, 4) == [0, 0]
+
+
+def assert_same_results(sims, expected):
+    assert [doc for doc, score in sims] == [doc for doc, score in expected]
+    assert [score for doc, score in sims] == pytest.approx([score for doc, score in expected], rel=1e-5)
+
+
+def exact_top_k(scores, top_k, min_score):
+    order = [doc for doc in numpy.argsort(-scores, kind='stable') if scores[doc] > min_score]
+    return [(int(doc), scores[doc]) for doc in order[:top_k]]
+
+
+@pytest.mark.parametrize('processes', [0, 2])
+def test_lsi_shards_merge_the_exact_results(tmp_path, processes):
+    rnd = numpy.random.RandomState(0)
+    vectors = rnd.randn(500, 16).astype(numpy.float32)
+    vectors /= numpy.linalg.norm(vectors, axis=1, keepdims=True)
+    write_lsi_shards(str(tmp_path), vectors, 4)
+    queries = rnd.randn(16, 5)
+    queries /= numpy.linalg.norm(queries, axis=0)
+    index = ShardedIndex(str(tmp_path), processes)
+    try:
+        assert len(index) == 500 and index.num_shards == 4
+        for top_k, min_score in ((10, -1.0), (600, 0.2), (0, -1.0)):
+            results = index.search(queries, top_k, min_score)
+            for i, sims in enumerate(results):
+                assert_same_results(sims, exact_top_k(vectors.dot(queries[:, i]), top_k, min_score))
+    finally:
+        index.close()
+
+
+def random_model(model):
+    rnd = random.Random(0)
+    for doc in range(300):
+        model.add_document('doc-%d.txt' % doc, ['w%d' % (int(rnd.paretovariate(1.0)) % 200) for i in range(rnd.randint(5, 60))])
+    return model
+
+
+@pytest.mark.parametrize('model_class, scoring', [(TfIdf, None), (SparseTfIdf, 'compat'), (SparseTfIdf, 'tfidf')])
+@pytest.mark.parametrize('processes', [0, 3])
+def test_tfidf_shards_merge_the_results_of_the_model(tmp_path, model_class, scoring, processes):
+    model = random_model(model_class(scoring) if scoring else model_class())
+    write_tfidf_shards(str(tmp_path), model, 3)
+    index = ShardedIndex(str(tmp_path), processes)
+    try:
+        results = index.search(QUERIES, 10, 0.0)
+        for query, sims in zip(QUERIES, results):
+            scores = numpy.zeros(len(model.documents))
+            for name, score in model.similarities(query):
+                scores[model.documents.index(name)] = score
+            assert_same_results(sims, exact_top_k(scores, 10, 0.0))
+    finally:
+        index.close()
+
+
+@pytest.mark.parametrize('model_name', ['lsi', 'tfidf'])
+def test_sharded_engine_retrieves_as_the_whole_model(project_dir, engine, model_name):
+    se = engine(project_dir, model_name=model_name, languages=['english'])
+    queries = [['en%d' % i, 'en%d' % (i + 7)] for i in range(1, 40, 3)]
+    expected = [se.model_similarities('english', query, 5) for query in queries]
+    sharded = engine(project_dir, model_name=model_name, languages=['english'], shards=3, shard_processes=0)
+    try:
+        assert 'english' in sharded.shards and sharded.build_stats == {}  # the model is loaded, the shards built
+        for query, sims in zip(queries, expected):
+            assert_same_results(sharded.model_similarities('english', query, 5), sims)
+    finally:
+        sharded.shards['english'].close()
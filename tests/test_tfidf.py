@@ -0,0 +1,117 @@
+'''
+Tests of the term models of tfidf.py against each other
+'''
+
+import random
+
+import numpy
+import pytest
+
+from tfidf import BM25, SparseTfIdf, TfIdf
+
+
+def random_documents(num_docs=150, vocabulary=400, seed=0):
+    rnd = random.Random(seed)
+    return [('doc-%d.txt' % doc, ['w%d' % (int(rnd.paretovariate(1.0)) % vocabulary) for i in range(rnd.randint(5, 100))])
+            for doc in range(num_docs)]
+
+
+def random_queries(num_queries=30, seed=1):
+    rnd = random.Random(seed)
+    return [['w%d' % rnd.randint(0, 60) for j in range(rnd.randint(1, 5))] for i in range(num_queries)] + [['unknown']]
+
+
+def build(model, documents):
+    for name, words in documents:
+        model.add_document(name, words)
+    return model
+
+
+def test_sparse_backend_scores_as_the_inverted_index():
+    documents = random_documents()
+    tfidf = build(TfIdf(), documents)
+    sparse = build(SparseTfIdf(), documents[:100])
+    sparse.scores(['w1'])  # the matrix is built, the next documents are merged into it
+    build(sparse, documents[100:])
+    for query in random_queries():
+        expected = dict(tfidf.similarities(query))
+        sims = dict(sparse.similarities(query))
+        assert sims.keys() == expected.keys()
+        assert [sims[doc] for doc in expected] == pytest.approx(list(expected.values()), rel=1e-5)
+        scores = sparse.scores(query)
+        assert len(scores) == len(documents)
+        assert scores[[doc for doc, score in enumerate(scores) if documents[doc][0] not in expected]].sum() == 0
+
+
+def test_tfidf_scoring_is_the_dot_product_of_the_tfidf_vectors():
+    documents = random_documents(50)
+    sparse = build(SparseTfIdf(scoring='tfidf'), documents)
+    vocabulary = sorted({w for name, words in documents for w in words})
+    tf = numpy.array([[words.count(w) / float(len(words)) for w in vocabulary] for name, words in documents])
+    idf = numpy.log(len(documents) / (tf > 0).sum(axis=0))
+    for query in random_queries(10):
+        query_tf = numpy.array([query.count(w) / float(len(query)) for w in vocabulary])
+        assert sparse.scores(query) == pytest.approx((tf * idf).dot(query_tf * idf), abs=1e-6)
+
+
+def test_unknown_scoring_is_rejected():
+    with pytest.raises(ValueError):
+        SparseTfIdf(scoring='bm25')
+
+
+def exhaustive_bm25(documents, query, k1=1.2, b=0.75):
+    '''
+    It scores every document with the Okapi BM25 formula, without any index
+    :return: dictionary with the score of each document which shares a term with the query
+    '''
+    avg_len = sum(len(words) for name, words in documents) / float(len(documents))
+    scores = {}
+    for w in set(query):
+        df = sum(1 for name, words in documents if w in words)
+        idf = numpy.log(1.0 + (len(documents) - df + 0.5) / (df + 0.5))
+        for name, words in documents:
+            tf = words.count(w)
+            if tf:
+                norm = k1 * (1.0 - b + b * len(words) / avg_len)
+                scores[name] = scores.get(name, 0.0) + query.count(w) * idf * tf * (k1 + 1) / (tf + norm)
+    return scores
+
+
+def test_bm25_scores_as_the_formula():
+    documents = random_documents()
+    bm25 = build(BM25(), documents)
+    for query in random_queries():
+        expected = exhaustive_bm25(documents, query)
+        sims = dict(bm25.similarities(query))
+        assert sims.keys() == expected.keys()
+        assert [sims[doc] for doc in expected] == pytest.approx(list(expected.values()))
+
+
+@pytest.mark.parametrize('k', [1, 5, 20, 1000])
+@pytest.mark.parametrize('min_score', [0.0, 2.0])
+def test_maxscore_returns_the_exhaustive_top_k(k, min_score):
+    documents = random_documents(300)
+    bm25 = build(BM25(), documents)
+    pruned_postings = exhaustive_postings = 0
+    for query in random_queries(40, seed=k):
+        stats, exhaustive = {}, {}
+        sims = bm25.top_k(query, k, min_score, True, stats)
+        expected = bm25.top_k(query, k, min_score, False, exhaustive)
+        assert [score for doc, score in sims] == pytest.approx([score for doc, score in expected])
+        if expected:  # the documents tied with the k-th score can be different ones
+            kth = expected[-1][1] + 1e-9
+            assert {doc for doc, score in sims if score > kth} == {doc for doc, score in expected if score > kth}
+        assert all(score > min_score for doc, score in sims)
+        assert stats['scored'] <= exhaustive['scored']
+        pruned_postings += stats['postings']
+        exhaustive_postings += exhaustive['postings']
+    if k <= 5:
+        assert pruned_postings < exhaustive_postings
+
+
+def test_added_documents_update_the_bounds():
+    documents = random_documents()
+    bm25 = build(BM25(), documents[:100])
+    assert bm25.top_k(['w3', 'w7'], 3)
+    build(bm25, documents[100:])
+    assert bm25.top_k(['w3', 'w7'], 3) == bm25.top_k(['w3', 'w7'], 3, prune=False)
@@ -5,10 +5,21 @@ Add your documents as two-element lists `[docname,
 [list_of_words_in_the_document]]` with `addDocument(docname, list_of_words)`.
 Get a list of all the `[docname, similarity_score]` pairs relative to a
 document by calling `similarities([list_of_words])`.
+
+The documents are kept in an inverted index (term -> postings of
+`(doc_id, count)`), so a query only visits the postings of its own
+terms instead of the whole corpus. The counts are normalized by the length
+of their documents when the queries are scored.
 """
 
 import sys
 import os
+import bisect
+import collections
+import heapq
+from array import array
+import numpy
+from scipy import sparse
 
 
 class TfIdf:
@@ -16,25 +27,38 @@ class TfIdf:
         self.weighted = False
         self.documents = []
         self.corpus_dict = {}
+        self.postings = {}
+        self.doc_len = array('i')
 
     def add_document(self, doc_name, list_of_words):
         # building a dictionary
         doc_dict = {}
         for w in list_of_words:
-            doc_dict[w] = doc_dict.get(w, 0.) + 1.0
+            doc_dict[w] = doc_dict.get(w, 0) + 1
             self.corpus_dict[w] = self.corpus_dict.get(w, 0.0) + 1.0
 
-        # normalizing the dictionary
-        length = float(len(list_of_words))
+        # adding the counts to the postings, they are normalized by the document length when scoring
+        doc_id = len(self.documents)
         for k in doc_dict:
-            doc_dict[k] = doc_dict[k] / length
+            self.postings.setdefault(k, []).append((doc_id, doc_dict[k]))
+
+        # add the document name and its length to the corpus
+        self.documents.append(doc_name)
+        self.doc_len.append(len(list_of_words))
 
-        # add the normalized document to the corpus
-        self.documents.append([doc_name, doc_dict])
+    def term_postings(self, w):
+        """Returns the corpus frequency and the `(doc_id, count)` postings of a
+term, or None if it is not in any document.
+        """
+        postings = self.postings.get(w)
+        if postings is None:
+            return None
+        return self.corpus_dict[w], postings
 
     def similarities(self, list_of_words):
-        """Returns a list of all the [docname, similarity_score] pairs relative to a
-list of words.
+        """Returns a list of the [docname, similarity_score] pairs relative to a
+list of words. Only the documents which share at least one term with the
+query are returned, the rest would score 0.
         """
 
         # building the query dictionary
@@ -47,15 +71,348 @@ list of words.
         for k in query_dict:
             query_dict[k] = query_dict[k] / length
 
-        # computing the list of similarities
-        sims = []
-        for doc in self.documents:
+        # accumulating the scores walking only the query terms postings
+        scores = {}
+        doc_len = self.doc_len
+        for k in query_dict:
+            term = self.term_postings(k)
+            if term is None:
+                continue
+            cf, postings = term
+            query_weight = query_dict[k] / cf
+            for doc_id, count in postings:
+                scores[doc_id] = scores.get(doc_id, 0.0) + (query_weight + count / doc_len[doc_id] / cf)
+
+        return [[self.documents[doc_id], score] for doc_id, score in scores.items()]
+
+    def document_scores(self, list_of_words, doc_ids):
+        """Returns the similarity score of each of the given documents relative
+to a list of words (0 for the ones which share no term), looking the
+documents up in the postings of the query terms.
+        """
+        query_dict = collections.Counter(list_of_words)
+        length = float(len(list_of_words))
+        scores = [0.0] * len(doc_ids)
+        for k, count in query_dict.items():
+            term = self.term_postings(k)
+            if term is None:
+                continue
+            cf, postings = term
+            query_weight = count / length / cf
+            for i, doc_id in enumerate(doc_ids):
+                pos = bisect.bisect_left(postings, (doc_id,))
+                if pos < len(postings) and postings[pos][0] == doc_id:
+                    scores[i] += query_weight + postings[pos][1] / self.doc_len[doc_id] / cf
+        return scores
+
+
+class SparseTfIdf:
+    """Compact version of `TfIdf`: the term counts are kept in a CSR matrix of
+terms x documents (float32 counts, int32 indices), so each row is the postings
+of a term, and the queries are scored with sparse matrix-vector products over
+the rows of their terms, normalized by the document lengths. `scores([list_of_words])` returns a NumPy array with
+the score of every document, `similarities([list_of_words])` keeps the
+`[docname, similarity_score]` pairs format of `TfIdf`.
+
+With scoring='compat' the score is the same one as `TfIdf`
+(query_tf/cf + doc_tf/cf summed over the shared terms), with scoring='tfidf'
+it is the dot product of the tf*idf vectors.
+    """
+
+    def __init__(self, scoring='compat'):
+        if scoring not in ('compat', 'tfidf'):
+            raise ValueError("scoring has to be either 'compat' or 'tfidf'")
+        self.scoring = scoring
+        self.documents = []
+        self.term_ids = {}
+        self.vocabulary = []
+        self.corpus_freq = array('d')
+        self.doc_freq = array('i')
+        self.doc_len = array('i')
+        self.matrix = None
+        # postings added since the last time the matrix was built
+        self.new_rows = array('i')
+        self.new_cols = array('i')
+        self.new_data = array('f')
+
+    def add_document(self, doc_name, list_of_words):
+        doc_id = len(self.documents)
+        for w, count in collections.Counter(list_of_words).items():
+            term_id = self.term_ids.get(w)
+            if term_id is None:
+                term_id = self.term_ids[w] = len(self.vocabulary)
+                self.vocabulary.append(w)
+                self.corpus_freq.append(0.0)
+                self.doc_freq.append(0)
+            self.corpus_freq[term_id] += count
+            self.doc_freq[term_id] += 1
+            self.new_rows.append(term_id)
+            self.new_cols.append(doc_id)
+            self.new_data.append(count)
+        self.documents.append(doc_name)
+        self.doc_len.append(len(list_of_words))
+
+    def build_matrix(self):
+        """Merges the postings added since the last call into the CSR matrix."""
+        shape = (len(self.vocabulary), len(self.documents))
+        if self.matrix is not None and not len(self.new_data) and self.matrix.shape == shape:
+            return self.matrix
+        new = sparse.csr_matrix((numpy.frombuffer(self.new_data, dtype=numpy.float32),
+                                 (numpy.frombuffer(self.new_rows, dtype=numpy.int32),
+                                  numpy.frombuffer(self.new_cols, dtype=numpy.int32))),
+                                shape=shape, dtype=numpy.float32)
+        if self.matrix is not None:
+            old = self.matrix
+            old.resize(shape)
+            new = old + new
+        new.indices = new.indices.astype(numpy.int32, copy=False)
+        new.indptr = new.indptr.astype(numpy.int32, copy=False)
+        new.sort_indices()
+        self.matrix = new
+        self.new_rows, self.new_cols, self.new_data = array('i'), array('i'), array('f')
+        return self.matrix
+
+    def normalize(self, postings):
+        """Divides the counts of some rows of the matrix by the lengths of
+their documents, in place.
+        """
+        doc_len = numpy.frombuffer(self.doc_len, dtype=numpy.int32)
+        postings.data = postings.data / doc_len[postings.indices]
+        return postings
+
+    def weights(self):
+        """Returns the CSR matrix of the normalized term frequencies."""
+        return self.normalize(self.build_matrix().copy())
+
+    def scores(self, list_of_words, doc_ids=None):
+        """Returns a NumPy array with the similarity score of every document
+relative to a list of words (0 for the documents which share no term), or
+only of the documents in doc_ids if they are given.
+        """
+        matrix = self.build_matrix()
+        counts = collections.Counter(w for w in list_of_words if w in self.term_ids)
+        if not counts:
+            return numpy.zeros(len(self.documents) if doc_ids is None else len(doc_ids))
+        ids = numpy.array([self.term_ids[w] for w in counts], dtype=numpy.int64)
+        query_tf = numpy.array(list(counts.values()), dtype=numpy.float64) / len(list_of_words)
+        postings = self.normalize(matrix[ids])  # rows of the query terms, a copy
+        if doc_ids is not None:
+            postings = postings[:, numpy.asarray(doc_ids, dtype=numpy.int64)]
+        if self.scoring == 'compat':
+            cf = numpy.frombuffer(self.corpus_freq, dtype=numpy.float64)[ids]
+            return postings.T.dot(1.0 / cf) + (postings != 0).T.dot(query_tf / cf)
+        idf = numpy.log(len(self.documents) / numpy.frombuffer(self.doc_freq, dtype=numpy.int32)[ids])
+        return postings.T.dot(query_tf * idf * idf)
+
+    def similarities(self, list_of_words):
+        """Returns a list of the [docname, similarity_score] pairs relative to a
+list of words, for the documents which share at least one term with the query.
+        """
+        scores = self.scores(list_of_words)
+        return [[self.documents[doc_id], scores[doc_id]] for doc_id in numpy.flatnonzero(scores)]
+
+    def document_scores(self, list_of_words, doc_ids):
+        """Returns the similarity score of each of the given documents relative
+to a list of words.
+        """
+        return self.scores(list_of_words, doc_ids)
+
+
+class BM25:
+    """Okapi BM25 over an inverted index (term -> sorted postings of
+`(doc_id, tf)` kept in two arrays). The maximum score each term can give to a
+document is stored with the term, so `top_k([list_of_words], k)` can skip
+the documents which can not reach the k best scores (MaxScore): the query
+terms are sorted by their upper bound, the ones whose bounds add up to less
+than the k-th best score so far are not walked, they are only looked up in
+the documents found through the other terms, and a document stops being
+scored as soon as its bound falls below the k-th best score.
+`similarities([list_of_words])` scores every document which shares a term
+with the query, in the `[docname, similarity_score]` pairs format of `TfIdf`.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.documents = []
+        self.doc_len = array('i')
+        self.total_len = 0
+        self.doc_ids = {}  # term -> array of document identifiers
+        self.tfs = {}  # term -> array of term frequencies
+        self.idf = {}
+        self.upper_bounds = {}
+        self.norms = None
+        self.dirty = True
+
+    def add_document(self, doc_name, list_of_words):
+        doc_id = len(self.documents)
+        for w, count in collections.Counter(list_of_words).items():
+            if w not in self.doc_ids:
+                self.doc_ids[w] = array('i')
+                self.tfs[w] = array('i')
+            self.doc_ids[w].append(doc_id)
+            self.tfs[w].append(count)
+        self.documents.append(doc_name)
+        self.doc_len.append(len(list_of_words))
+        self.total_len += len(list_of_words)
+        self.dirty = True
+
+    def update_statistics(self):
+        """Computes the length normalization of every document and the idf and
+the upper bound of every term. It is called after the documents change.
+        """
+        if not self.dirty:
+            return
+        num_docs = len(self.documents)
+        avg_len = self.total_len / float(num_docs) if num_docs else 1.0
+        doc_len = numpy.frombuffer(self.doc_len, dtype=numpy.int32) if num_docs else numpy.zeros(0)
+        norms = self.k1 * (1.0 - self.b + self.b * doc_len / max(avg_len, 1e-9))
+        for w, ids in self.doc_ids.items():
+            df = len(ids)
+            idf = numpy.log(1.0 + (num_docs - df + 0.5) / (df + 0.5))
+            tf = numpy.frombuffer(self.tfs[w], dtype=numpy.int32)
+            self.idf[w] = float(idf)
+            upper_bound = (idf * tf * (self.k1 + 1) / (tf + norms[numpy.frombuffer(ids, dtype=numpy.int32)])).max()
+            self.upper_bounds[w] = float(upper_bound) * (1 + 1e-9)  # so the rounding errors never prune a document
+        self.norms = array('d', norms.astype(numpy.float64).tobytes())  # plain floats are faster in the query loops
+        self.dirty = False
+
+    def __getstate__(self):
+        self.update_statistics()  # so a loaded model does not compute them with its first query
+        return self.__dict__
+
+    def has_term(self, w):
+        return w in self.doc_ids
+
+    def term_postings(self, w):
+        """Returns the idf, the upper bound, the document identifiers and the
+term frequencies of a term of the index.
+        """
+        return self.idf[w], self.upper_bounds[w], self.doc_ids[w], self.tfs[w]
+
+    def query_terms(self, list_of_words):
+        """Returns the (weight, term) pairs of the query terms which are in the
+index, where the weight is the number of times the term is in the query.
+        """
+        counts = collections.Counter(w for w in list_of_words if self.has_term(w))
+        return [(float(count), w) for w, count in counts.items()]
+
+    def similarities(self, list_of_words, stats=None):
+        """Returns a list of the [docname, similarity_score] pairs relative to a
+list of words, for all the documents which share at least one term with the
+query (no pruning).
+        """
+        self.update_statistics()
+        k1 = self.k1 + 1
+        norms = self.norms
+        scores = {}
+        postings = 0
+        for weight, w in self.query_terms(list_of_words):
+            idf, upper_bound, ids, tfs = self.term_postings(w)
+            idf *= weight
+            for doc_id, tf in zip(ids, tfs):
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * k1 / (tf + norms[doc_id])
+            postings += len(ids)
+        if stats is not None:
+            stats['scored'] = len(scores)
+            stats['postings'] = postings
+        return [[self.documents[doc_id], score] for doc_id, score in scores.items()]
+
+    def document_scores(self, list_of_words, doc_ids):
+        """Returns the score of each of the given documents relative to a list
+of words, looking the documents up in the postings of the query terms.
+        """
+        self.update_statistics()
+        k1 = self.k1 + 1
+        norms = self.norms
+        scores = [0.0] * len(doc_ids)
+        for weight, w in self.query_terms(list_of_words):
+            idf, upper_bound, ids, tfs = self.term_postings(w)
+            idf *= weight
+            for i, doc_id in enumerate(doc_ids):
+                pos = bisect.bisect_left(ids, doc_id)
+                if pos < len(ids) and ids[pos] == doc_id:
+                    tf = tfs[pos]
+                    scores[i] += idf * tf * k1 / (tf + norms[doc_id])
+        return scores
+
+    def top_k(self, list_of_words, k, min_score=0.0, prune=True, stats=None):
+        """Returns the k best [docname, similarity_score] pairs, sorted by score,
+whose score is above min_score. With prune=False every matching document is
+scored. If a stats dictionary is given, the number of scored documents and
+of visited postings is written in it.
+        """
+        if not prune:
+            sims = [sim for sim in self.similarities(list_of_words, stats) if sim[1] > min_score]
+            return heapq.nlargest(k, sims, key=lambda sim: sim[1]) if k > 0 else []
+        self.update_statistics()
+        k1 = self.k1 + 1
+        norms = self.norms
+        # the terms sorted by their upper bound, the lowest first
+        terms = []
+        for weight, w in self.query_terms(list_of_words):
+            idf, upper_bound, ids, tfs = self.term_postings(w)
+            terms.append((weight * upper_bound, weight * idf, ids, tfs))
+        terms.sort(key=lambda term: term[:2])
+        num_terms = len(terms)
+        if k <= 0 or not num_terms:
+            if stats is not None:
+                stats['scored'] = stats['postings'] = 0
+            return []
+        bounds = []  # bounds[i]: sum of the upper bounds of the terms 0..i
+        total = 0.0
+        for term in terms:
+            total += term[0]
+            bounds.append(total)
+        positions = [0] * num_terms
+        sizes = [len(term[2]) for term in terms]
+        heap = []  # the k best (score, doc_id) so far
+        threshold = min_score
+        first_essential = 0  # the terms before it can not make a document enter the top k on their own
+        while first_essential < num_terms and bounds[first_essential] <= threshold:
+            first_essential += 1
+        scored = postings = 0
+        while first_essential < num_terms:
+            # the next document of the essential terms
+            doc_id = None
+            for i in range(first_essential, num_terms):
+                if positions[i] < sizes[i]:
+                    candidate = terms[i][2][positions[i]]
+                    if doc_id is None or candidate < doc_id:
+                        doc_id = candidate
+            if doc_id is None:
+                break
             score = 0.0
-            doc_dict = doc[1]
-            for k in query_dict:
-                if k in doc_dict:
-                    score += (query_dict[k] / self.corpus_dict[k]) + (
-                      doc_dict[k] / self.corpus_dict[k])
-            sims.append([doc[0], score])
-
-        return sims
\ No newline at end of file
+            norm = norms[doc_id]
+            for i in range(first_essential, num_terms):
+                pos = positions[i]
+                if pos < sizes[i] and terms[i][2][pos] == doc_id:
+                    tf = terms[i][3][pos]
+                    score += terms[i][1] * tf * k1 / (tf + norm)
+                    positions[i] = pos + 1
+                    postings += 1
+            # the non-essential terms are looked up while the document can still reach the top k
+            for i in range(first_essential - 1, -1, -1):
+                if score + bounds[i] <= threshold:
+                    break
+                ids = terms[i][2]
+                pos = bisect.bisect_left(ids, doc_id, positions[i])
+                positions[i] = pos
+                postings += 1
+                if pos < sizes[i] and ids[pos] == doc_id:
+                    tf = terms[i][3][pos]
+                    score += terms[i][1] * tf * k1 / (tf + norm)
+            scored += 1
+            if score > threshold:
+                if len(heap) < k:
+                    heapq.heappush(heap, (score, -doc_id))
+                else:
+                    heapq.heapreplace(heap, (score, -doc_id))
+                if len(heap) == k:
+                    threshold = max(min_score, heap[0][0])
+                    while first_essential < num_terms and bounds[first_essential] <= threshold:
+                        first_essential += 1
+        if stats is not None:
+            stats['scored'] = scored
+            stats['postings'] = postings
+        return [[self.documents[-doc_id], score] for score, doc_id in sorted(heap, reverse=True)]